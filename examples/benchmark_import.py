@@ -0,0 +1,42 @@
+import subprocess
+import sys
+import time
+
+# Measures the import and setup cost that every fresh interpreter (CLI
+# invocation, process pool child) pays before the first fit. Every stage is
+# run in a new interpreter and the total wall clock time including the
+# interpreter startup is measured, the minimum over all repetitions is
+# reported. The line shape modules and lmfit are only loaded by the
+# registry and the first fit respectively.
+
+STAGES = [
+    ("python startup", "pass"),
+    ("import numpy", "import numpy"),
+    ("import mixfit.mixfit", "import mixfit.mixfit"),
+    ("Mixfit()", "import mixfit.mixfit; mixfit.mixfit.Mixfit()"),
+    ("import lmfit", "import lmfit"),
+    ("Mixfit() + small fit", "import numpy as np; import mixfit.mixfit; x = np.linspace(-10, 10, 200); mixfit.mixfit.Mixfit(maxIterations = 1).fit(x, np.exp(-x*x/2))")
+]
+
+def measure(code, repeat):
+    best = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        subprocess.run([ sys.executable, "-c", code ], check = True)
+        t = time.perf_counter() - t0
+        if (best is None) or (t < best):
+            best = t
+    return best
+
+if __name__ == "__main__":
+    repeat = 5
+    if len(sys.argv) > 1:
+        repeat = int(sys.argv[1])
+
+    print(f"Minimum over {repeat} fresh interpreters (ms)")
+    for name, code in STAGES:
+        print(f"{name:>22} {measure(code, repeat)*1e3:10.2f}")
+
+    print("\nModules loaded after import mixfit.mixfit:")
+    out = subprocess.run([ sys.executable, "-c", "import sys, mixfit.mixfit; print(' '.join(sorted(m for m in ('lmfit', 'scipy', 'asyncio', 'numba', 'mixfitfunctions.gaussian') if m in sys.modules)) or '-')" ], capture_output = True, text = True, check = True)
+    print(out.stdout.strip())
@@ -0,0 +1,76 @@
+import sys
+import time
+
+import numpy as np
+
+from mixfitfunctions import kernels
+
+# Compares the NumPy expressions that have been used by the line shapes
+# before the kernels have been introduced with the in-place NumPy fallback
+# and the compiled numba backend of mixfitfunctions.kernels
+
+def timeit(fun, repeat = 10):
+    fun()
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        fun()
+    return (time.perf_counter() - t0) / repeat
+
+def reference(shape, x, amp, c, w, offs):
+    if shape == kernels.GAUSSIAN:
+        return amp * np.exp(-np.power(x - c, 2.0) / (2 * np.power(w, 2.0))) + offs
+    if shape == kernels.CAUCHY:
+        return amp * w / np.pi * 1.0 / ((x - c)**2.0 + w**2.0) + offs
+    if shape == kernels.DIFFGAUSSIAN:
+        return -1.0 * amp / w * (x - c) / w * np.exp(-0.5 * np.power((x - c) / w, 2)) + offs
+    if shape == kernels.DIFFCAUCHY:
+        return -1.0 * amp * w / np.pi * 2 * (x - c) / ((x - c) ** 2 + w ** 2)**2 + offs
+
+if __name__ == "__main__":
+    n = 1000000
+    if len(sys.argv) > 1:
+        n = int(sys.argv[1])
+
+    x = np.linspace(-100, 100, n)
+    data = np.random.normal(0, 1, n)
+
+    backends = [ "numpy" ]
+    try:
+        kernels.use_backend("numba")
+        backends.append("numba")
+    except ImportError:
+        print("numba not available, only benchmarking the NumPy backend")
+
+    print(f"Single shapes, {n} samples, residual data - model (ms)")
+    print(f"{'shape':>14} {'reference':>10} " + " ".join([ f"{b:>10}" for b in backends ]))
+    for name, shape in [ ("Gaussian", kernels.GAUSSIAN), ("Cauchy", kernels.CAUCHY), ("DiffGaussian", kernels.DIFFGAUSSIAN), ("DiffCauchy", kernels.DIFFCAUCHY) ]:
+        tref = timeit(lambda: data - reference(shape, x, 1.5, 3.0, 2.0, 0.1))
+        line = f"{name:>14} {tref*1e3:10.2f} "
+        for b in backends:
+            kernels.use_backend(b)
+            t = timeit(lambda: kernels.evaluate(shape, x, 1.5, 3.0, 2.0, 0.1, data = data))
+            line = line + f"{t*1e3:10.2f} "
+        print(line)
+
+    ncomp = 20
+    rng = np.random.default_rng(0)
+    shapes = rng.choice([ kernels.GAUSSIAN, kernels.CAUCHY, kernels.DIFFGAUSSIAN, kernels.DIFFCAUCHY ], ncomp)
+    params = np.stack((rng.uniform(0.1, 2, ncomp), rng.uniform(-90, 90, ncomp), rng.uniform(0.5, 5, ncomp), np.zeros((ncomp,))), axis = 1)
+
+    print(f"\nMixture of {ncomp} components, {n} samples (ms)")
+    def refmixture():
+        res = np.zeros((n,))
+        for i in range(ncomp):
+            res = res + reference(shapes[i], x, *params[i])
+        return data - res
+    line = f"{'mixture':>14} {timeit(refmixture)*1e3:10.2f} "
+    for b in backends:
+        kernels.use_backend(b)
+        line = line + f"{timeit(lambda: kernels.evaluate_mixture(shapes, params, x, data = data))*1e3:10.2f} "
+    print(line)
+
+    line = f"{'jacobian':>14} {'-':>10} "
+    for b in backends:
+        kernels.use_backend(b)
+        line = line + f"{timeit(lambda: kernels.mixture_jacobian(shapes, params, x), repeat = 3)*1e3:10.2f} "
+    print(line)
@@ -0,0 +1,54 @@
+import sys
+import time
+
+import numpy as np
+
+from mixfit.mixfit import Mixfit
+from mixfit.synthetic import generate
+
+# Scaling and accuracy of the mixture fit on synthetic spectra: fit time
+# per spectrum and the fraction of recovered ground truth components for
+# growing numbers of samples and components, with and without prescreening.
+# The synthetic generator itself is timed as well.
+
+def run(npoints, ncomponents, nspectra, **kwargs):
+    batch = generate(
+        nspectra,
+        np.linspace(0, 1000, npoints),
+        components = ncomponents,
+        shapes = [ "GAUSSIAN", "CAUCHY" ],
+        width = (1, 5),
+        separation = 2,
+        amplitude = (0.3, 1),
+        noise = 0.01,
+        seed = 0
+    )
+    mf = Mixfit(allowed = [ "GAUSSIAN", "CAUCHY" ], maxIterations = ncomponents + 2, minResiduumImprovement = 1e-3, **kwargs)
+
+    t = 0
+    recovered = 0
+    for i in range(nspectra):
+        t0 = time.perf_counter()
+        res = mf.fit(batch.x, batch.data[i])
+        t = t + time.perf_counter() - t0
+        recovered = recovered + np.sum(batch.recovered(i, res))
+    return t / nspectra, recovered / np.sum(batch.ncomponents)
+
+if __name__ == "__main__":
+    nspectra = 3
+    if len(sys.argv) > 1:
+        nspectra = int(sys.argv[1])
+
+    print("Generator (float32)")
+    for n, s, c in [ (10000, 1000, 20), (100000, 100, 20), (1000000, 10, 20) ]:
+        t0 = time.perf_counter()
+        generate(s, np.linspace(0, 1000, n), components = c, seed = 0, dtype = np.float32)
+        t = time.perf_counter() - t0
+        print(f"{s:6d} spectra x {n:8d} samples x {c} lines: {t:8.2f} s ({s * n * c / t / 1e6:8.1f} M evaluations/s)")
+
+    print(f"\nFit time per spectrum and recovered fraction ({nspectra} spectra each)")
+    print(f"{'samples':>8} {'lines':>6} {'full (s)':>10} {'recovered':>10} {'prescreen (s)':>14} {'recovered':>10}")
+    for npoints, ncomponents in [ (2000, 3), (2000, 6), (20000, 6), (20000, 10) ]:
+        tf, rf = run(npoints, ncomponents, nspectra)
+        tp, rp = run(npoints, ncomponents, nspectra, prescreen = 1)
+        print(f"{npoints:8d} {ncomponents:6d} {tf:10.2f} {rf:10.2f} {tp:14.2f} {rp:10.2f}")
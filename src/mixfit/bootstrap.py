@@ -0,0 +1,281 @@
+"""Bootstrap uncertainties of fitted mixtures
+
+The standard errors lmfit reports after the last refinement are often not
+available or unreliable: every component carries its own constant offset
+(only their sum is determined by the data) and neighbouring components are
+strongly correlated. The bootstrap keeps the structure of a fitted mixture
+(the selected functions), resamples its residuals and refits all parameters
+from the converged values for every resampled data set. Percentiles of the
+refitted values give the confidence intervals.
+
+Resampled sets are generated per chunk in a single vectorized pass (from
+independent seeds spawned from the bootstrap seed, so the result only
+depends on the seed and the number of chunks, not on the executor) and the
+chunks are refit in parallel. The constant offsets (and intercepts) of all
+but the first component are kept fixed during the refits like in
+Mixture._refine, their sum is reported as "offset".
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from mixfit.mixfit import Mixture, _minimize
+from mixfit.sharedmem import SharedArray, _SharedArrayRef, attach
+
+METHODS = ("residual", "wild")
+
+class BootstrapResult:
+    """Bootstrap samples of the parameters of a mixture
+
+    Attributes
+    ----------
+
+    names: list
+        Parameter names (as in the mixture, for example f0_mu) and "offset"
+        for the sum of all constant offsets
+    values: ndarray
+        Parameter values of the fitted mixture
+    samples: ndarray
+        Refitted values, shape (number of resampled sets, len(names)). Rows
+        of failed refits are NaN
+    chis: ndarray
+        chi^2 of every refit
+    level: float
+        Confidence level of the intervals
+    """
+    def __init__(self, names, values, samples, chis, level):
+        self.names = names
+        self.values = values
+        self.samples = samples
+        self.chis = chis
+        self.level = level
+
+    def interval(self, name, level = None):
+        """Percentile interval (low, high) of a parameter"""
+        return self.intervals(level)[name]
+
+    def intervals(self, level = None):
+        """Percentile intervals of all parameters as dictionary name -> (low, high)"""
+        if level is None:
+            level = self.level
+        q = [ 50.0 * (1.0 - level), 50.0 * (1.0 + level) ]
+        lohi = np.nanpercentile(self.samples, q, axis = 0)
+        return { n : (lohi[0,i], lohi[1,i]) for i, n in enumerate(self.names) }
+
+    def stderr(self):
+        """Standard deviation of the bootstrap samples per parameter"""
+        return dict(zip(self.names, np.nanstd(self.samples, axis = 0, ddof = 1)))
+
+def _offset_names(mixture):
+    # Constant offsets (and intercepts) of all components, only their sum
+    # is determined by the data
+    res = []
+    for fun in mixture._functions:
+        n = fun._offset_name()
+        if n is not None:
+            res.append(n)
+    return res
+
+def _resample(rng, model, residual, weights, count, method):
+    # count resampled data sets at once
+    n = len(model)
+    if method == "wild":
+        # Rademacher signs keep the size of every residual at its position
+        signs = rng.integers(0, 2, (count, n)).astype(np.float64)
+        signs *= 2.0
+        signs -= 1.0
+        signs *= residual[np.newaxis,:]
+        signs += model[np.newaxis,:]
+        return signs
+
+    idx = rng.integers(0, n, (count, n))
+    if weights is None:
+        sets = residual[idx]
+    else:
+        # Weighted residuals are exchangeable, not the raw ones
+        scaled = residual * weights
+        sets = scaled[idx]
+        nz = weights != 0
+        sets[:,nz] /= weights[nz][np.newaxis,:]
+        sets[:,~nz] = residual[~nz][np.newaxis,:]
+    sets += model[np.newaxis,:]
+    return sets
+
+def refit_task(compact, x, model, residual, weights, seed, count, method, loss = None, lossScale = 1.0, maxNfev = None):
+    """Generate count resampled data sets and refit the mixture (given as
+    CompactMixture) to each of them starting from its parameters
+
+    x, model, residual and weights are arrays or (in process pool workers)
+    SharedArray references. Returns the refitted values (in the order of
+    the mixture parameters followed by the offset sum) and the chi^2 of
+    every set
+    """
+    from lmfit import Parameters
+
+    arrays = []
+    releases = []
+    try:
+        for a in (x, model, residual, weights):
+            if isinstance(a, _SharedArrayRef):
+                a, release = attach(a)
+                releases.append(release)
+            arrays.append(a)
+        xs, m, r, w = arrays
+
+        mixture = compact.to_mixture()
+        offsets = _offset_names(mixture)
+        params = Parameters()
+        for p in mixture._params:
+            params.add_many(*p.values())
+        mixture._fold_offsets(params)
+        names = list(params)
+
+        sets = _resample(np.random.default_rng(seed), m, r, w, count, method)
+        values = np.full((count, len(names) + 1), np.nan)
+        chis = np.full((count,), np.nan)
+        minkws = {}
+        if maxNfev is not None:
+            minkws["max_nfev"] = maxNfev
+        dfun = None
+        if mixture._has_jacobian():
+            dfun = mixture._jacobian2
+        for i in range(count):
+            try:
+                res = _minimize(mixture._call2, params, dfun, args = (xs,), kws = { 'data' : sets[i], 'weights' : w, 'loss' : loss, 'lossScale' : lossScale }, **minkws)
+            except (ValueError, FloatingPointError):
+                continue
+            values[i,:-1] = [ res.params[n].value for n in names ]
+            values[i,-1] = np.sum([ res.params[n].value for n in offsets ])
+            chis[i] = np.sum(np.square(res.residual))
+        return values, chis
+    finally:
+        # All views have to be gone before the blocks can be unmapped
+        arrays = None
+        xs = m = r = w = None
+        for release in releases:
+            release()
+
+def bootstrap(
+    mixfit,
+    x,
+    inputData,
+    mixture,
+    *,
+    n = 200,
+    weights = None,
+    method = "residual",
+    level = 0.95,
+    seed = None,
+    executor = None,
+    chunks = None
+):
+    """Bootstrap confidence intervals of the parameters of a fitted mixture
+
+    Parameters
+    ----------
+
+    mixfit: Mixfit
+        The fitter that produced the mixture (its loss and evaluation
+        budget are used for the refits)
+    x: ndarray
+        Sample positions
+    inputData: ndarray
+        The fitted data
+    mixture: Mixture
+        The fitted mixture (a CompactMixture is accepted as well)
+    n: int, optional
+        Number of resampled data sets
+    weights: ndarray, optional
+        Per point weights used for the fit
+    method: str, optional
+        "residual" resamples the (weighted) residuals with replacement,
+        "wild" flips the sign of every residual randomly which keeps
+        residuals that depend on the position (heteroscedastic noise,
+        misfit) at their place
+    level: float, optional
+        Confidence level of the percentile intervals
+    seed: int or numpy.random.SeedSequence, optional
+        Seed of the resampling, the same seed (and number of chunks)
+        reproduces the result
+    executor: concurrent.futures.Executor, optional
+        Executor the refits run on. When not supplied a process pool is
+        created by the execution policy of the fitter (see
+        mixfit.execution)
+    chunks: int, optional
+        Number of tasks the resampled sets are split into. Defaults to four
+        per worker of the execution policy of the fitter. Pass it explicitly
+        when the supplied executor has a different number of workers
+
+    Returns
+    -------
+
+    A BootstrapResult
+    """
+    if (int(n) != n) or (n < 2):
+        raise ValueError("Number of resampled sets has to be an integer of at least 2")
+    if method not in METHODS:
+        raise ValueError(f"Unknown bootstrap method {method}, supported are {', '.join(METHODS)}")
+    if not (0 < float(level) < 1):
+        raise ValueError("Confidence level has to be between 0 and 1")
+    if chunks is not None:
+        if (int(chunks) != chunks) or (chunks < 1):
+            raise ValueError("Number of chunks has to be a positive integer")
+
+    x = np.asarray(x, dtype = np.float64)
+    inputData = np.asarray(inputData, dtype = np.float64)
+    if len(x) != len(inputData):
+        raise ValueError("x and data have to be of the same length")
+    if weights is not None:
+        weights = np.asarray(weights, dtype = np.float64)
+        if weights.shape != inputData.shape:
+            raise ValueError("Weights have to be of the same shape as the input data")
+
+    compact = mixture.compact() if isinstance(mixture, Mixture) else mixture
+    if len(compact) == 0:
+        raise ValueError("Mixture has no components")
+    full = compact.to_mixture()
+    offsets = _offset_names(full)
+    names = [ n for p in full._params for n in p ] + [ "offset" ]
+    values = np.asarray([ p[n].value for p in full._params for n in p ] + [ np.sum([ p[n].value for p in full._params for n in p if n in offsets ]) ])
+
+    model = compact(x)
+    residual = inputData - model
+
+    policy = mixfit._execution_policy(len(x), n, len(compact))
+    ownedExecutor = None
+    if executor is None:
+        ownedExecutor = policy.process_pool(n)
+        executor = ownedExecutor
+    if chunks is None:
+        chunks = 4 * policy.pool_workers(n)
+    chunks = int(min(chunks, n))
+    counts = [ len(c) for c in np.array_split(np.arange(n), chunks) ]
+    if not isinstance(seed, np.random.SeedSequence):
+        seed = np.random.SeedSequence(seed)
+    seeds = seed.spawn(chunks)
+
+    shared = None
+    try:
+        if isinstance(executor, ProcessPoolExecutor):
+            # The data is published once, tasks only transfer their seed
+            shared = [ SharedArray(a, persistent = True) for a in (x, model, residual, weights) if a is not None ]
+            if weights is None:
+                shared.append(None)
+            arrays = shared
+        else:
+            arrays = [ x, model, residual, weights ]
+
+        futures = [ executor.submit(refit_task, compact, *arrays, s, c, method, mixfit._loss, mixfit._lossScale, mixfit._maxNfev) for s, c in zip(seeds, counts) ]
+        results = [ f.result() for f in futures ]
+    finally:
+        if ownedExecutor is not None:
+            ownedExecutor.shutdown()
+        if shared is not None:
+            for s in shared:
+                if s is not None:
+                    s.close()
+
+    samples = np.concatenate([ r[0] for r in results ], axis = 0)
+    chis = np.concatenate([ r[1] for r in results ])
+    return BootstrapResult(names, values, samples, chis, float(level))
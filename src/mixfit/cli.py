@@ -0,0 +1,265 @@
+"""Command line batch runner
+
+Fits one or more arrays of every .npz input file on a process pool and
+appends one JSON line per (file, array) to the result file as soon as the
+fit finished. On restart all (file, array) pairs that are already recorded
+as successful in the result file are skipped, so an interrupted batch
+continues where it stopped.
+
+    mixfit -c config.json -o results.jsonl data/ "runs/*.npz"
+
+The configuration file is a JSON object. The keys x, y and meanAxis select
+the data, all other keys are passed to Mixfit. allowed is a list of function
+ids or objects { "fid" : ..., "limits" : { name : [min, max] } }:
+
+    {
+        "x" : "f_RF",
+        "y" : [ "sigI", "sigQ" ],
+        "meanAxis" : 1,
+        "maxIterations" : 4,
+        "stopError" : 0.05,
+        "allowed" : [
+            { "fid" : "GAUSSIAN", "limits" : { "sigma" : [3, 20] } },
+            "DIFFERENTIALCAUCHY"
+        ]
+    }
+"""
+
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+
+from concurrent.futures import FIRST_COMPLETED, wait
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+
+from mixfit.execution import ExecutionPolicy
+from mixfit.store import mixture_record
+
+_DATAKEYS = ("x", "y", "meanAxis")
+
+# Fitter of the worker process, created once by the pool initializer
+_workerFitter = None
+
+def load_config(path):
+    """Load and validate a batch configuration file"""
+    with open(path, "r") as f:
+        config = json.load(f)
+    if not isinstance(config, dict):
+        raise ValueError("Configuration has to be a JSON object")
+    return config
+
+def build_fitter(config):
+    """Create the Mixfit instance described by the (non data) entries of a
+    configuration"""
+    from mixfit.mixfit import Mixfit
+    from mixfitfunctions import registry
+
+    kwargs = { k : v for k, v in config.items() if k not in _DATAKEYS }
+    if "allowed" in kwargs:
+        allowed = []
+        for a in kwargs["allowed"]:
+            if isinstance(a, str):
+                allowed.append(registry.create(a))
+            elif isinstance(a, dict) and ("fid" in a):
+                limits = a.get("limits")
+                if limits is not None:
+                    limits = { n : tuple(l) for n, l in limits.items() }
+                allowed.append(registry.create(a["fid"], limits = limits))
+            else:
+                raise ValueError(f"Invalid allowed function {a}, expecting a function id or an object with fid")
+        kwargs["allowed"] = allowed
+    return Mixfit(**kwargs)
+
+def find_inputs(specs):
+    """Expand directories (all .npz files inside), glob patterns and plain
+    file names into a sorted list of unique absolute paths"""
+    files = []
+    for s in specs:
+        if os.path.isdir(s):
+            files = files + glob.glob(os.path.join(s, "*.npz"))
+        elif glob.has_magic(s):
+            files = files + glob.glob(s, recursive = True)
+        else:
+            files.append(s)
+    return sorted(set([ os.path.abspath(f) for f in files ]))
+
+def load_done(path):
+    """Return the set of (file, array) pairs recorded as successful in an
+    existing result file. A partially written last line is ignored"""
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, "r") as f:
+        for line in f:
+            try:
+                rec = json.loads(line)
+            except ValueError:
+                continue
+            if isinstance(rec, dict) and (rec.get("status") == "ok"):
+                done.add((rec["file"], rec["key"]))
+    return done
+
+def _init_worker(config):
+    global _workerFitter
+    _workerFitter = build_fitter(config)
+
+def _fit_unit(path, xkey, ykey, meanAxis):
+    t0 = time.perf_counter()
+    with np.load(path) as data:
+        x = np.asarray(data[xkey], dtype = np.float64)
+        y = np.asarray(data[ykey], dtype = np.float64)
+    if meanAxis is not None:
+        y = y.mean(meanAxis)
+    rec = mixture_record(_workerFitter.fit(x, y))
+    rec["elapsed"] = time.perf_counter() - t0
+    return rec
+
+def _write_record(out, rec):
+    out.write(json.dumps(rec) + "\n")
+    out.flush()
+    os.fsync(out.fileno())
+
+def _parser():
+    parser = argparse.ArgumentParser(prog = "mixfit", description = "Mixture fit of arrays stored in .npz files")
+    parser.add_argument("inputs", nargs = "+", help = "Input .npz files, directories or glob patterns")
+    parser.add_argument("-c", "--config", help = "JSON configuration of the data keys and the Mixfit options")
+    parser.add_argument("-o", "--output", default = "mixfit-results.jsonl", help = "Result file (JSON lines), appended to and used for resuming")
+    parser.add_argument("-s", "--store", help = "Also insert successful fits into this SQLite result store (see mixfit.store)")
+    parser.add_argument("-x", dest = "x", help = "Key of the sample positions (overrides the configuration)")
+    parser.add_argument("-y", dest = "y", action = "append", help = "Key of an array to fit, may be given multiple times (overrides the configuration)")
+    parser.add_argument("--mean-axis", type = int, dest = "meanAxis", help = "Average the fitted arrays over this axis before fitting")
+    parser.add_argument("-j", "--workers", type = int, help = "Number of worker processes (default: all cores)")
+    parser.add_argument("--threads", type = int, help = "BLAS/OpenMP threads per worker process (default: the cores left per worker)")
+    parser.add_argument("-q", "--quiet", action = "store_true", help = "Do not report progress")
+    return parser
+
+def main(argv = None):
+    args = _parser().parse_args(argv)
+
+    config = {}
+    if args.config is not None:
+        config = load_config(args.config)
+    for k in _DATAKEYS:
+        if getattr(args, k) is not None:
+            config[k] = getattr(args, k)
+    if ("x" not in config) or ("y" not in config):
+        print("mixfit: the keys of x and the fitted arrays have to be specified (-x, -y or configuration)", file = sys.stderr)
+        return 2
+    ykeys = config["y"] if isinstance(config["y"], list) else [ config["y"] ]
+    if (args.workers is not None) and (args.workers < 1):
+        print("mixfit: number of workers has to be a positive integer", file = sys.stderr)
+        return 2
+    if (args.threads is not None) and (args.threads < 1):
+        print("mixfit: number of threads has to be a positive integer", file = sys.stderr)
+        return 2
+
+    # Fail early on configuration errors instead of in every worker
+    try:
+        build_fitter(config)
+    except (ValueError, TypeError) as e:
+        print(f"mixfit: invalid configuration: {e}", file = sys.stderr)
+        return 2
+
+    done = load_done(args.output)
+    units = [ (f, k) for f in find_inputs(args.inputs) for k in ykeys if (f, k) not in done ]
+    if not args.quiet:
+        print(f"mixfit: {len(units)} fits to run, {len(done)} already done", file = sys.stderr)
+    if len(units) == 0:
+        return 0
+
+    # Workers only split the cores among themselves, their BLAS threads
+    # are limited so the fits do not oversubscribe the machine
+    policy = ExecutionPolicy(workers = args.workers, threads = args.threads)
+    workers = policy.pool_workers(len(units))
+    failed = 0
+    t0 = time.perf_counter()
+
+    store = None
+    try:
+        if args.store is not None:
+            from mixfit.store import ResultStore
+            store = ResultStore(args.store)
+
+        with open(args.output, "a") as out:
+            # Terminate a partially written line of an interrupted run so the
+            # next record starts on a line of its own
+            if out.tell() > 0:
+                with open(args.output, "rb") as f:
+                    f.seek(-1, os.SEEK_END)
+                    if f.read(1) != b"\n":
+                        out.write("\n")
+
+            executor = policy.process_pool(len(units), initializer = _init_worker, initargs = (config,))
+            try:
+                # Only a bounded number of units is queued so a large batch does
+                # not create all futures upfront
+                pending = {}
+                queue = iter(units)
+                unsent = []
+                finished = 0
+                while True:
+                    while (len(unsent) == 0) and (len(pending) < 2 * workers):
+                        unit = next(queue, None)
+                        if unit is None:
+                            break
+                        try:
+                            pending[executor.submit(_fit_unit, unit[0], config["x"], unit[1], config.get("meanAxis"))] = unit
+                        except BrokenProcessPool:
+                            # A worker died (for example killed when running
+                            # out of memory), the pool does not accept tasks
+                            # any more. The queued fits fail with the same
+                            # error, the remaining ones are not run
+                            unsent = [ unit ] + list(queue)
+                    if len(pending) == 0:
+                        break
+
+                    complete, _ = wait(pending, return_when = FIRST_COMPLETED)
+                    for fut in complete:
+                        path, key = pending.pop(fut)
+                        try:
+                            rec = fut.result()
+                            rec = dict({ "file" : path, "key" : key, "status" : "ok" }, **rec)
+                            if store is not None:
+                                # Stored before the result line is written, a
+                                # fit repeated after a crash replaces its row
+                                store.add(rec, source = f"{path}:{key}", replace = True)
+                        except Exception as e:
+                            failed = failed + 1
+                            rec = { "file" : path, "key" : key, "status" : "error", "error" : f"{type(e).__name__}: {e}" }
+                        _write_record(out, rec)
+
+                        finished = finished + 1
+                        if not args.quiet:
+                            elapsed = time.perf_counter() - t0
+                            rate = finished / elapsed
+                            eta = (len(units) - finished) / rate
+                            print(f"mixfit: {finished}/{len(units)} done, {failed} failed, {rate:.2f} fits/s, {rate * 60:.1f} fits/min, eta {eta:.0f} s", file = sys.stderr)
+
+                if len(unsent) > 0:
+                    print(f"mixfit: worker pool is broken, {len(unsent)} fits have not been run", file = sys.stderr)
+                    for path, key in unsent:
+                        failed = failed + 1
+                        _write_record(out, { "file" : path, "key" : key, "status" : "error", "error" : "BrokenProcessPool: fit has not been run, a worker process terminated abruptly" })
+            except KeyboardInterrupt:
+                print("mixfit: interrupted, finished fits have been written", file = sys.stderr)
+                try:
+                    executor.shutdown(wait = False, cancel_futures = True)
+                except TypeError:
+                    # cancel_futures is only supported since Python 3.9
+                    executor.shutdown(wait = False)
+                return 130
+            executor.shutdown()
+    finally:
+        # Also on interrupts, the output file is closed by its with block
+        if store is not None:
+            store.close()
+
+    return 1 if failed > 0 else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
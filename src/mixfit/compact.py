@@ -0,0 +1,168 @@
+"""Compact array backed representation of fitted mixtures
+
+A Mixture keeps one function object and one lmfit Parameters object per
+component - several kilobytes of Python objects per fit. CompactMixture
+keeps only a tuple of shared per type metadata (function id, parameter
+names, bounds, kernel slots and a prototype function) and the parameter
+values, standard errors and the chi^2 history in contiguous NumPy arrays.
+
+Mixtures are converted on demand (Mixture.compact, CompactMixture.to_mixture)
+and compact mixtures can be evaluated without creating any lmfit objects.
+"""
+
+import threading
+
+import numpy as np
+
+from mixfitfunctions import kernels
+
+_types = {}
+_typesLock = threading.Lock()
+
+class _ComponentType:
+    """Metadata shared by all components of the same function type"""
+    __slots__ = ("fid", "title", "names", "vary", "min", "max", "kernel", "kernelSlots", "prototype", "_key")
+
+    def __init__(self, prototype, key):
+        template = prototype._paramsd
+        self.fid = prototype._fid
+        self.title = prototype._title
+        self.names = tuple(template)
+        self.vary = np.asarray([ template[n]["vary"] for n in self.names ], dtype = bool)
+        self.min = np.asarray([ -np.inf if template[n]["min"] is None else template[n]["min"] for n in self.names ], dtype = np.float64)
+        self.max = np.asarray([ np.inf if template[n]["max"] is None else template[n]["max"] for n in self.names ], dtype = np.float64)
+        self.kernel = prototype._kernel
+        self.kernelSlots = None
+        if prototype._kernel is not None:
+            self.kernelSlots = tuple([ -1 if n is None else self.names.index(n) for n in prototype._kernel_names ])
+        self.prototype = prototype._with_prefix(None)
+        self._key = key
+
+    def __reduce__(self):
+        return (_component_type, (self.prototype,))
+
+def _component_type(fun):
+    # Types are interned so all compact mixtures share one instance per
+    # function class, parameter template and definition
+    template = fun._paramsd
+    definition = getattr(fun, "_definition", None)
+    key = (
+        type(fun),
+        fun._fid,
+        tuple([ (n, d["vary"], d["min"], d["max"]) for n, d in template.items() ]),
+        None if definition is None else (definition.expression, definition.names)
+    )
+    t = _types.get(key)
+    if t is None:
+        with _typesLock:
+            t = _types.get(key)
+            if t is None:
+                t = _ComponentType(fun, key)
+                _types[key] = t
+    return t
+
+class CompactMixture:
+    __slots__ = ("_types", "_starts", "_values", "_stderr", "_chis", "_nfev", "_budgetExhausted")
+
+    def __init__(self, types, values, stderr, chis, nfev = 0, budgetExhausted = False):
+        """Create a compact mixture
+
+        Parameters
+        ----------
+
+        types: tuple
+            Component type of every component (see from_mixture)
+        values: ndarray
+            Parameter values of all components, in the order of the
+            components and their parameter templates
+        stderr: ndarray
+            Standard errors in the same order (NaN when not available)
+        chis: ndarray
+            chi^2 after every stage
+        """
+        self._types = tuple(types)
+        self._starts = np.cumsum([ 0 ] + [ len(t.names) for t in self._types ]).astype(np.int32)
+        self._values = np.asarray(values, dtype = np.float64)
+        self._stderr = np.asarray(stderr, dtype = np.float64)
+        self._chis = np.asarray(chis, dtype = np.float64)
+        self._nfev = int(nfev)
+        self._budgetExhausted = bool(budgetExhausted)
+        if (len(self._values) != self._starts[-1]) or (len(self._stderr) != self._starts[-1]):
+            raise ValueError("Number of parameter values does not match the component types")
+
+    @classmethod
+    def from_mixture(cls, mixture):
+        """Create the compact representation of a Mixture"""
+        types = []
+        values = []
+        stderr = []
+        for fun, params in zip(mixture._functions, mixture._params):
+            t = _component_type(fun)
+            types.append(t)
+            pnames = fun._pnames
+            byName = { pnames[n] : p for n, p in params.items() }
+            for n in t.names:
+                values.append(byName[n].value)
+                stderr.append(np.nan if byName[n].stderr is None else byName[n].stderr)
+        return cls(types, values, stderr, mixture._chis, mixture._nfev, mixture._budgetExhausted)
+
+    def to_mixture(self):
+        """Create the lmfit based Mixture (with functions prefixed f0, f1, ...)"""
+        from lmfit import Parameters
+        from mixfit.mixfit import Mixture
+
+        res = Mixture()
+        for i, t in enumerate(self._types):
+            prefix = f"f{i}"
+            fun = t.prototype._with_prefix(prefix)
+            s = self._starts[i]
+            params = Parameters()
+            params.add_many(*[ (f"{prefix}_{n}", self._values[s+k], bool(t.vary[k]), None if np.isinf(t.min[k]) else t.min[k], None if np.isinf(t.max[k]) else t.max[k]) for k, n in enumerate(t.names) ])
+            for k, n in enumerate(t.names):
+                if not np.isnan(self._stderr[s+k]):
+                    params[f"{prefix}_{n}"].stderr = float(self._stderr[s+k])
+            res._functions.append(fun)
+            res._params.append(params)
+        res._chis = [ np.float64(c) for c in self._chis ]
+        res._nfev = self._nfev
+        res._budgetExhausted = self._budgetExhausted
+        return res
+
+    def __len__(self):
+        return len(self._types)
+
+    def fids(self):
+        """Function ids of all components"""
+        return [ t.fid for t in self._types ]
+
+    def params(self, i):
+        """Parameters of component i as a dictionary name -> (value, stderr)"""
+        t = self._types[i]
+        s = self._starts[i]
+        return { n : (self._values[s+k], self._stderr[s+k]) for k, n in enumerate(t.names) }
+
+    def __call__(self, x, *, data = None):
+        # Evaluate the mixture, using the fused kernels when possible
+        if all([ t.kernel is not None for t in self._types ]):
+            shapes = np.asarray([ t.kernel for t in self._types ], dtype = np.int64)
+            kparams = np.zeros((len(self._types), 4))
+            for i, t in enumerate(self._types):
+                for slot, k in enumerate(t.kernelSlots):
+                    if k >= 0:
+                        kparams[i, slot] = self._values[self._starts[i] + k]
+            return kernels.evaluate_mixture(shapes, kparams, np.asarray(x, dtype = np.float64), data = data)
+
+        res = np.zeros((len(x),))
+        for i, t in enumerate(self._types):
+            s = self._starts[i]
+            res = res + t.prototype({ n : self._values[s+k] for k, n in enumerate(t.names) }, x)
+        if data is None:
+            return res
+        return data - res
+
+    def __repr__(self):
+        res = ""
+        for i, t in enumerate(self._types):
+            s = self._starts[i]
+            res = res + "\n" + f"{t.title}(" + ", ".join([ f"{n}={self._values[s+k]}+-{self._stderr[s+k]}" for k, n in enumerate(t.names) ]) + ")"
+        return res
@@ -0,0 +1,202 @@
+"""Execution policies of the parallel paths
+
+Fits can be parallelized on several levels: over spectra (batches, maps,
+segments, bootstrap sets) and inside every fit by the threaded BLAS and
+OpenMP libraries NumPy and SciPy link against. Running all of them with one
+thread per core each oversubscribes the machine and throughput collapses.
+
+An ExecutionPolicy splits a core budget into pool workers and library
+threads per worker. Every parallel path of mixfit (fit_async with the owned
+thread pool, fit_segmented, fit_map, bootstrap and the command line runner)
+creates its pools through the policy of the fitter. When no policy has been
+set the owned thread pool of fit_async (which serves all later fits) gets
+one worker per core and the other pools choose one from the size of their
+workload: small workloads do not pay for the start of a pool and the cores
+are left to the libraries, large batches use one worker per core with
+single threaded libraries.
+
+Library threads of process pool workers are limited in the worker
+initializer using threadpoolctl when it is installed. Otherwise the usual
+environment variables are set in the worker which only affects libraries
+that are loaded afterwards (workers started with the spawn or forkserver
+method). Thread pools share the libraries with the calling process, their
+limit is applied with threadpoolctl while at least one task is running and
+restored afterwards. The environment of the calling process is never
+modified.
+"""
+
+import os
+import threading
+
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+# Environment variables of the common BLAS and OpenMP implementations
+_THREAD_ENV = (
+    "OMP_NUM_THREADS",
+    "OPENBLAS_NUM_THREADS",
+    "MKL_NUM_THREADS",
+    "BLIS_NUM_THREADS",
+    "VECLIB_MAXIMUM_THREADS",
+    "NUMEXPR_NUM_THREADS"
+)
+
+# Work (samples times candidate functions) a worker should receive so
+# starting it pays off - about half a second of fitting
+_WORK_PER_WORKER = 50000
+
+def available_cores():
+    """Number of cores this process may run on"""
+    if hasattr(os, "sched_getaffinity"):
+        return max(len(os.sched_getaffinity(0)), 1)
+    return os.cpu_count() or 1
+
+def _limit_worker_threads(threads):
+    # Limit the threads of the BLAS and OpenMP libraries of a pool worker
+    # process for its whole lifetime. Only ever called in the workers
+    for k in _THREAD_ENV:
+        os.environ[k] = str(threads)
+    try:
+        from threadpoolctl import threadpool_limits
+    except ImportError:
+        return
+    threadpool_limits(limits = threads)
+
+def _init_worker(threads, initializer = None, initargs = ()):
+    _limit_worker_threads(threads)
+    if initializer is not None:
+        initializer(*initargs)
+
+class _ThreadLimit:
+    """Library thread limit of the tasks of a thread pool
+
+    The threadpoolctl limits apply to the whole process. The limit is
+    applied when the first task starts and the previous limits are restored
+    when the last running task finished, so overlapping tasks never restore
+    each others limit. Without threadpoolctl the tasks run unlimited.
+    """
+    def __init__(self, threads):
+        self._threads = threads
+        self._lock = threading.Lock()
+        self._running = 0
+        self._limiter = None
+
+    def __enter__(self):
+        with self._lock:
+            if self._running == 0:
+                try:
+                    from threadpoolctl import threadpool_limits
+                except ImportError:
+                    threadpool_limits = None
+                if threadpool_limits is not None:
+                    self._limiter = threadpool_limits(limits = self._threads)
+            self._running = self._running + 1
+        return self
+
+    def __exit__(self, *args):
+        with self._lock:
+            self._running = self._running - 1
+            if (self._running == 0) and (self._limiter is not None):
+                self._limiter.restore_original_limits()
+                self._limiter = None
+        return False
+
+    def run(self, fn, *args, **kwargs):
+        with self:
+            return fn(*args, **kwargs)
+
+class _LimitedThreadPoolExecutor(ThreadPoolExecutor):
+    """Thread pool running every task inside a _ThreadLimit"""
+    def __init__(self, maxWorkers, threads):
+        super().__init__(max_workers = maxWorkers)
+        self._limit = _ThreadLimit(threads)
+
+    def submit(self, fn, *args, **kwargs):
+        return super().submit(self._limit.run, fn, *args, **kwargs)
+
+class ExecutionPolicy:
+    """Split of a core budget into pool workers and library threads
+
+    Parameters
+    ----------
+
+    cores: int, optional
+        Core budget. Defaults to the cores available to this process
+    workers: int, optional
+        Number of pool workers. Defaults to one per core
+    threads: int, optional
+        BLAS and OpenMP threads per worker. Defaults to the cores left per
+        worker (at least one) of every pool, pools with fewer workers
+        than the policy give their workers more threads
+    """
+    def __init__(self, cores = None, workers = None, threads = None):
+        if cores is None:
+            cores = available_cores()
+        if (int(cores) != cores) or (cores < 1):
+            raise ValueError("Core budget has to be a positive integer")
+        if workers is None:
+            workers = cores
+        if (int(workers) != workers) or (workers < 1):
+            raise ValueError("Number of workers has to be a positive integer")
+        if threads is not None:
+            if (int(threads) != threads) or (threads < 1):
+                raise ValueError("Number of threads has to be a positive integer")
+            threads = int(threads)
+
+        self.cores = int(cores)
+        self.workers = int(workers)
+        self._threads = threads
+
+    @property
+    def threads(self):
+        """BLAS and OpenMP threads of each worker of a full pool"""
+        return self.pool_threads()
+
+    @classmethod
+    def auto(cls, traceLength, spectra = 1, factories = 1, cores = None):
+        """Policy for fitting spectra independent fits of traceLength
+        samples with factories candidate functions each
+
+        Workers are only started for the share of the work that keeps each
+        of them busy, the remaining cores are given to the libraries
+        """
+        if cores is None:
+            cores = available_cores()
+        work = max(int(traceLength), 1) * max(int(factories), 1) * max(int(spectra), 1)
+        workers = min(int(cores), max(int(spectra), 1), max(work // _WORK_PER_WORKER, 1))
+        return cls(cores = cores, workers = workers)
+
+    def pool_workers(self, tasks = None):
+        """Number of workers of a pool that runs tasks independent tasks"""
+        if tasks is None:
+            return self.workers
+        return max(min(self.workers, int(tasks)), 1)
+
+    def pool_threads(self, tasks = None):
+        """BLAS and OpenMP threads per worker of a pool that runs tasks
+        independent tasks"""
+        if self._threads is not None:
+            return self._threads
+        return max(self.cores // self.pool_workers(tasks), 1)
+
+    def process_pool(self, tasks = None, initializer = None, initargs = ()):
+        """Process pool whose workers limit their library threads before
+        running initializer(*initargs)"""
+        return ProcessPoolExecutor(
+            max_workers = self.pool_workers(tasks),
+            initializer = _init_worker,
+            initargs = (self.pool_threads(tasks), initializer, initargs)
+        )
+
+    def thread_pool(self, tasks = None, maxWorkers = None):
+        """Thread pool of maxWorkers (default: the policy's workers) threads.
+        The library thread limit is applied (process wide) while tasks of
+        the pool are running"""
+        if maxWorkers is None:
+            maxWorkers = self.pool_workers(tasks)
+        threads = self._threads
+        if threads is None:
+            threads = max(self.cores // maxWorkers, 1)
+        return _LimitedThreadPoolExecutor(maxWorkers, threads)
+
+    def __repr__(self):
+        return f"ExecutionPolicy(cores={self.cores}, workers={self.workers}, threads={self.threads})"
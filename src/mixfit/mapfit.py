@@ -0,0 +1,213 @@
+"""Fitting of spectral maps
+
+Spectra measured on a spatial grid change slowly from pixel to pixel. Instead
+of running an independent greedy fit for every pixel, a seed pixel is fit
+completely and the results are propagated outwards in wavefronts of equal
+Manhattan distance to the seed. Every pixel starts from the mixture of an
+already fitted neighbour (one step closer to the seed) and only runs a
+single refinement of those components. When the refined chi^2 is clearly
+worse than the neighbour's (a line appeared, the neighbour mixture does
+not describe this pixel) the pixel is fit from scratch and the better of
+both mixtures is kept. All pixels of a wavefront are independent and fit
+in parallel.
+
+Results are kept as CompactMixture objects to bound the memory of large
+maps.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from mixfit.mixfit import Mixture, _FitBudget
+from mixfit.sharedmem import SharedArray, _SharedArrayRef, attach
+
+def fit_pixel(mixfit, x, cube, weights, index, initial = None, reference = None, refitRatio = 1.5, warmNfev = None):
+    """Fit a single pixel of a map and return its CompactMixture
+
+    Parameters
+    ----------
+
+    mixfit: Mixfit
+        The configured mixture fitter
+    x, cube, weights: ndarray or SharedArray
+        Sample positions, the (rows, cols, len(x)) cube and optional weights
+        of the same shape (process pool workers receive SharedArray
+        references)
+    index: tuple
+        Row and column of the pixel
+    initial: CompactMixture, optional
+        Mixture of the neighbour the pixel is started from. When not
+        supplied the pixel is fit from scratch
+    reference: float, optional
+        Final chi^2 of the neighbour
+    refitRatio: float, optional
+        The pixel is fit from scratch when the refined chi^2 exceeds
+        refitRatio times the reference. None accepts every refinement
+    warmNfev: int, optional
+        Number of function evaluations of the refinement of the warm start.
+        Defaults to 10*(number of parameters + 1)
+    """
+    arrays = []
+    releases = []
+    try:
+        for a in (x, cube, weights):
+            if isinstance(a, _SharedArrayRef):
+                a, release = attach(a)
+                releases.append(release)
+            arrays.append(a)
+        xs = arrays[0]
+        data = arrays[1][index]
+        w = None if arrays[2] is None else arrays[2][index]
+
+        if (initial is None) or (len(initial) == 0):
+            res = mixfit.fit(xs, data, weights = w)
+        else:
+            # Components that only describe noise make the refinement
+            # degenerate, it is limited like the polishing of stitched
+            # segments. Reaching this limit is not an exhausted fit budget
+            if warmNfev is None:
+                warmNfev = 10 * (len(initial._values) + 1)
+            if mixfit._maxNfev is not None:
+                warmNfev = min(warmNfev, mixfit._maxNfev)
+            res = Mixture()
+            res._warm_start(initial, xs, data, weights = w, loss = mixfit._loss, lossScale = mixfit._lossScale, budget = _FitBudget(mixfit._maxTime, warmNfev))
+            res._budgetExhausted = False
+            if (refitRatio is not None) and (not (res._chis[-1] <= refitRatio * reference)):
+                warm = res
+                res = mixfit.fit(xs, data, weights = w)
+                if (len(res._chis) == 0) or (warm._chis[-1] < res._chis[-1]):
+                    warm, res = res, warm
+                res._nfev = res._nfev + warm._nfev
+        return res.compact()
+    finally:
+        # All views have to be gone before the blocks can be unmapped
+        arrays = None
+        data = None
+        w = None
+        for release in releases:
+            release()
+
+def _neighbour(chis, dist, r, c):
+    # Already fitted 4-neighbour one step closer to the seed with the
+    # lowest chi^2
+    best = None
+    for dr, dc in ((-1, 0), (1, 0), (0, -1), (0, 1)):
+        rn, cn = r + dr, c + dc
+        if (rn < 0) or (cn < 0) or (rn >= dist.shape[0]) or (cn >= dist.shape[1]):
+            continue
+        if dist[rn, cn] != dist[r, c] - 1:
+            continue
+        if (best is None) or (chis[rn, cn] < chis[best]):
+            best = (rn, cn)
+    return best
+
+def fit_map(
+    mixfit,
+    x,
+    cube,
+    *,
+    weights = None,
+    seed = None,
+    executor = None,
+    refitRatio = 1.5,
+    warmNfev = None
+):
+    """Fit all pixels of a spectral map
+
+    Parameters
+    ----------
+
+    mixfit: Mixfit
+        The configured mixture fitter
+    x: ndarray
+        Sample positions (common to all pixels)
+    cube: ndarray
+        Data of shape (rows, cols, len(x))
+    weights: ndarray, optional
+        Per point weights of the same shape as the cube
+    seed: tuple, optional
+        Row and column of the pixel that is fit from scratch. Defaults to
+        the center of the map
+    executor: concurrent.futures.Executor, optional
+        Executor the pixels of a wavefront are fit on. When not supplied a
+        process pool is created by the execution policy of the fitter (see
+        mixfit.execution)
+    refitRatio: float, optional
+        A warm started pixel is fit from scratch when its refined chi^2
+        exceeds refitRatio times the chi^2 of the neighbour it has been
+        started from. None accepts every refinement
+    warmNfev: int, optional
+        Number of function evaluations of the refinement of a warm started
+        pixel. Defaults to 10*(number of parameters + 1)
+
+    Returns
+    -------
+
+    An object array of shape (rows, cols) containing the CompactMixture of
+    every pixel
+    """
+    x = np.asarray(x)
+    cube = np.asarray(cube)
+    if (cube.ndim != 3) or (cube.shape[2] != len(x)):
+        raise ValueError("Cube has to be of shape (rows, cols, len(x))")
+    if weights is not None:
+        weights = np.asarray(weights, dtype = np.float64)
+        if weights.shape != cube.shape:
+            raise ValueError("Weights have to be of the same shape as the cube")
+    if refitRatio is not None:
+        if float(refitRatio) <= 0:
+            raise ValueError("Refit ratio has to be a positive value")
+    if warmNfev is not None:
+        if (int(warmNfev) != warmNfev) or (warmNfev < 1):
+            raise ValueError("Warm start function evaluations have to be a positive integer")
+
+    rows, cols = cube.shape[:2]
+    if seed is None:
+        seed = (rows // 2, cols // 2)
+    r0, c0 = int(seed[0]), int(seed[1])
+    if (r0 < 0) or (c0 < 0) or (r0 >= rows) or (c0 >= cols):
+        raise ValueError("Seed pixel is outside of the map")
+
+    rr, cc = np.indices((rows, cols))
+    dist = np.abs(rr - r0) + np.abs(cc - c0)
+    results = np.empty((rows, cols), dtype = object)
+    chis = np.full((rows, cols), np.inf)
+
+    ownedExecutor = None
+    if executor is None:
+        ownedExecutor = mixfit._execution_policy(len(x), rows * cols).process_pool()
+        executor = ownedExecutor
+    shared = None
+    try:
+        if isinstance(executor, ProcessPoolExecutor):
+            # The cube is published once, tasks only transfer the pixel
+            # index and the (compact) neighbour mixture
+            shared = [ SharedArray(a, persistent = True) for a in (x, cube, weights) if a is not None ]
+            if weights is None:
+                shared.append(None)
+            arrays = shared
+        else:
+            arrays = [ x, cube, weights ]
+
+        for d in range(int(np.max(dist)) + 1):
+            futures = []
+            for r, c in zip(*np.nonzero(dist == d)):
+                initial, reference = None, None
+                nb = _neighbour(chis, dist, r, c)
+                if nb is not None:
+                    initial, reference = results[nb], chis[nb]
+                futures.append(((r, c), executor.submit(fit_pixel, mixfit, *arrays, (r, c), initial, reference, refitRatio, warmNfev)))
+            for (r, c), f in futures:
+                results[r, c] = f.result()
+                if len(results[r, c]._chis) > 0:
+                    chis[r, c] = results[r, c]._chis[-1]
+    finally:
+        if ownedExecutor is not None:
+            ownedExecutor.shutdown()
+        if shared is not None:
+            for s in shared:
+                if s is not None:
+                    s.close()
+
+    return results
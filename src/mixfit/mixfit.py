@@ -1,23 +1,169 @@
-import numpy as np
+import functools
+import threading
+import time
 
-from lmfit import Parameters, minimize
+import numpy as np
 
+from mixfitfunctions import kernels, registry
 from mixfitfunctions.mixfitfunction import MixfitFunctionFactory
-from mixfitfunctions.gaussian import MixfitFunctionGaussianFactory
-from mixfitfunctions.constant import MixfitFunctionConstantFactory
-from mixfitfunctions.linear import MixfitFunctionLinearFactory
-from mixfitfunctions.differentialgaussian import MixfitFunctionDifferentialGaussianFactory
-from mixfitfunctions.cauchy import MixfitFunctionCauchyFactory
-from mixfitfunctions.differentialcauchy import MixfitFunctionDifferentialCauchyFactory
+
+# lmfit (and the line shape modules via the registry), asyncio and the
+# executors are imported on first use only. Importing lmfit pulls in scipy
+# which dominates the import time of short lived workers
+
+# Change of the residual in the support region of a candidate (relative to
+# its energy there) up to which the previous optimum is used as start value
+_WARM_START_LIMIT = 0.25
+
+# Tests a stage's best candidate has to pass before the mixture is refined
+ACCEPTANCE_TESTS = ("chi", "bic")
+
+def _minimize(fcn, params, dfun = None, **kwargs):
+    # lmfit minimize with the analytic jacobian dfun. Steps from a nearly
+    # singular jacobian (components that vanished between the samples) can
+    # overflow the model - such fits are repeated with finite differences
+    from lmfit import minimize
+
+    if dfun is not None:
+        try:
+            return minimize(fcn, params, Dfun = dfun, **kwargs)
+        except ValueError:
+            pass
+    return minimize(fcn, params, **kwargs)
+
+def _selection(x, n, mask = None, roi = None, exclude = None):
+    # Samples that take part in a fit: None in case all samples are used, a
+    # slice when they are contiguous (a single region of interest on a
+    # sorted grid, selecting them creates views) or the sorted indices
+    if (mask is None) and (roi is None) and (exclude is None):
+        return None
+
+    keep = np.ones((n,), dtype = bool)
+    if mask is not None:
+        mask = np.asarray(mask)
+        if mask.dtype == bool:
+            if mask.shape != (n,):
+                raise ValueError("Boolean masks have to be of the same shape as the input data")
+            keep &= mask
+        else:
+            if (mask.ndim != 1) or (not np.issubdtype(mask.dtype, np.integer)):
+                raise ValueError("Masks have to be boolean arrays or arrays of sample indices")
+            sel = np.zeros((n,), dtype = bool)
+            sel[mask] = True
+            keep &= sel
+    x = np.asarray(x)
+    if roi is not None:
+        if len(roi) != 2:
+            raise ValueError("Region of interest has to be a (min, max) pair")
+        lo, hi = roi
+        if lo is not None:
+            keep &= x >= lo
+        if hi is not None:
+            keep &= x <= hi
+    if exclude is not None:
+        for r in exclude:
+            if len(r) != 2:
+                raise ValueError("Excluded ranges have to be (min, max) pairs")
+            keep &= ~((x >= r[0]) & (x <= r[1]))
+    selection = np.flatnonzero(keep)
+    if (len(selection) > 0) and (selection[-1] - selection[0] + 1 == len(selection)):
+        return slice(int(selection[0]), int(selection[-1]) + 1)
+    return selection
+
+class MixfitCancelledError(Exception):
+    """Raised by Mixfit.fit when cancellation has been requested between two stages"""
+    pass
+
+class _FitBudget:
+    """Wall clock and function evaluation budget shared by all minimizer runs of a single fit"""
+    def __init__(self, maxTime = None, maxNfev = None):
+        self._deadline = None
+        if maxTime is not None:
+            self._deadline = time.monotonic() + maxTime
+        self._nfevLeft = maxNfev
+        self._limit = None
+        self.exhausted = False
+
+    def _iter_cb(self, params, iteration, resid, *args, **kws):
+        # Returning True aborts the running lmfit minimizer
+        if time.monotonic() >= self._deadline:
+            self.exhausted = True
+        return self.exhausted
+
+    def minimize_kws(self):
+        kws = {}
+        self._limit = None
+        if self._nfevLeft is not None:
+            self._limit = max(self._nfevLeft, 1)
+            kws["max_nfev"] = self._limit
+        if self._deadline is not None:
+            kws["iter_cb"] = self._iter_cb
+        return kws
+
+    def consume(self, result):
+        # Returns the number of function evaluations of the minimizer run.
+        # lmfit counts the call that aborts at max_nfev without evaluating
+        # the function
+        nfev = result.nfev
+        if (self._limit is not None) and (nfev > self._limit):
+            nfev = self._limit
+        if self._nfevLeft is not None:
+            self._nfevLeft = self._nfevLeft - nfev
+            if self._nfevLeft <= 0:
+                self.exhausted = True
+        if result.aborted:
+            self.exhausted = True
+        return nfev
+
+    def check(self):
+        if self._deadline is not None:
+            if time.monotonic() >= self._deadline:
+                self.exhausted = True
+        return self.exhausted
 
 class Mixture:
     def __init__(self):
         self._functions = []
         self._params = []
         self._chis = []
+        self._nfev = 0
+        self._budgetExhausted = False
+
+        # Global Parameters of the last refinement and the per function
+        # Parameters objects it corresponds to
+        self._lmparams = None
+        self._lmparamsSource = []
+
+    def _kernel_arrays(self, params):
+        # Shape ids and canonical parameters in case all components are
+        # supported by the kernels, else None. params is either one
+        # Parameters object for all functions or a list with one per function
+        shapes = np.empty((len(self._functions),), dtype = np.int64)
+        kparams = np.empty((len(self._functions), 4))
+        for i_f, f in enumerate(self._functions):
+            if f._kernel is None:
+                return None
+            shapes[i_f] = f._kernel
+            if isinstance(params, list):
+                kparams[i_f] = f._kernel_params(params[i_f])
+            else:
+                kparams[i_f] = f._kernel_params(params)
+        return shapes, kparams
+
+    def _kernel_eval(self, params, x, data, weights = None, loss = None, lossScale = 1.0):
+        # Fused single pass evaluation in case all components are
+        # supported by the kernels
+        arrays = self._kernel_arrays(params)
+        if arrays is None:
+            return None
+        return kernels.evaluate_mixture(*arrays, x, data = data, weights = weights, loss = loss, scale = lossScale)
 
     def __call__(self, x, *, data = None):
         # Evaluate the mixture at the specified points
+        res = self._kernel_eval(self._params, x, data)
+        if res is not None:
+            return res
+
         res = np.zeros((len(x),))
         for i_f, f in enumerate(self._functions):
             res = res + f(self._params[i_f], x)
@@ -26,41 +172,189 @@ class Mixture:
         else:
             return data - res
 
-    def _call2(self, params, x, data = None):
+    def _call2(self, params, x, data = None, weights = None, loss = None, lossScale = 1.0):
+        res = self._kernel_eval(params, x, data, weights, loss, lossScale)
+        if res is not None:
+            return res
+
         res = np.zeros((len(x),))
         for i_f, f in enumerate(self._functions):
             res = res + f(params, x)
         if data is None:
             return res
         else:
-            return data - res
+            return kernels.finish_residual(data - res, weights = weights, loss = loss, scale = lossScale)
+
+    def _has_jacobian(self):
+        return all([ f._has_jacobian() for f in self._functions ])
+
+    def _jacobian2(self, params, x, data = None, weights = None, loss = None, lossScale = 1.0):
+        # Jacobian of the residual of _call2 with respect to the varying
+        # parameters in the order of params (the Dfun of the refinement)
+        cols = {}
+        arrays = self._kernel_arrays(params)
+        if arrays is not None:
+            jac = kernels.mixture_jacobian(*arrays, x)
+            for i_f, f in enumerate(self._functions):
+                for slot, n in enumerate(f._kernel_pnames):
+                    if n is not None:
+                        cols[n] = 4 * i_f + slot
+        else:
+            blocks = []
+            for f in self._functions:
+                for n in f._jacobian_names():
+                    cols[n] = len(cols)
+                blocks.append(f.jacobian(params, x))
+            jac = np.concatenate(blocks, axis = 1)
+        jac = jac[:,[ cols[n] for n, p in params.items() if p.vary ]]
+
+        r = None
+        if loss is not None:
+            r = data - self._call2(params, x)
+        return kernels.residual_jacobian(jac, r, weights = weights, loss = loss, scale = lossScale)
+
+    def _fold_offsets(self, params):
+        # The constant offsets of all components only enter the model as
+        # their sum - the least squares problem is singular (no covariance,
+        # offsets drifting apart) when all of them vary. Only the first
+        # free offset is varied, the other free ones are fixed. Returns the
+        # names of the fixed offsets
+        folded = []
+        first = True
+        for f in self._functions:
+            n = f._offset_name()
+            if (n is None) or (not params[n].vary):
+                continue
+            if (params[n].min != -np.inf) or (params[n].max != np.inf):
+                # Bounded offsets restrict the reachable sums
+                continue
+            if first:
+                first = False
+                continue
+            params[n].vary = False
+            folded.append(n)
+        return folded
+
+    def _refine(self, x, data, *, weights = None, loss = None, lossScale = 1.0, budget = None):
+        from lmfit import Parameters
+
+        if (budget is not None) and budget.exhausted:
+            # Nothing left to refine with, the current parameters are kept
+            self._chis.append(self._chisqr(x, data, weights, loss, lossScale))
+            return
 
-    def _refine(self, x, data):
         # Perform refinment using all functions ...
 
-        # Build global Parameters object ...
-        inParams = Parameters()
-        for p1 in self._params:
-            for p2 in p1:
-                inParams.add(p1[p2])
+        # Build global Parameters object. The result of the previous
+        # refinement is reused as long as the components it has been built
+        # from are unchanged, only newly added components are appended
+        inParams = self._lmparams
+        nknown = len(self._lmparamsSource)
+        if (inParams is None) or (nknown > len(self._params)) or any([ a is not b for a, b in zip(self._lmparamsSource, self._params) ]):
+            inParams = Parameters()
+            nknown = 0
+        for p1 in self._params[nknown:]:
+            inParams.add_many(*p1.values())
 
         # Run minimizer ...
-        globalRes = minimize(
-            self._call2,
-            inParams,
-            args = (x,),
-            kws = { 'data' : data }
-        )
- 
+        minkws = {}
+        if budget is not None:
+            minkws = budget.minimize_kws()
+        dfun = None
+        if self._has_jacobian():
+            dfun = self._jacobian2
+        folded = self._fold_offsets(inParams)
+        try:
+            globalRes = _minimize(
+                self._call2,
+                inParams,
+                dfun,
+                args = (x,),
+                kws = { 'data' : data, 'weights' : weights, 'loss' : loss, 'lossScale' : lossScale },
+                **minkws
+            )
+        finally:
+            # The Parameter objects are shared with the per function
+            # Parameters
+            for n in folded:
+                inParams[n].vary = True
+        for n in folded:
+            # Only the sum of the offsets is determined, its uncertainty
+            # is the one of the varied offset
+            globalRes.params[n].vary = True
+            globalRes.params[n].stderr = None
+        nfev = globalRes.nfev
+        if budget is not None:
+            nfev = budget.consume(globalRes)
+        self._nfev = self._nfev + nfev
+
         # Create local parameters objects again ...
         newParams = []
-        self._chis.append(globalRes.chisqr)
+        if globalRes.aborted:
+            # lmfit does not calculate statistics for aborted fits, the
+            # parameters are the last ones that have been evaluated
+            self._chis.append(np.sum(np.square(self._call2(globalRes.params, x, data, weights, loss, lossScale))))
+        else:
+            self._chis.append(globalRes.chisqr)
 
         for p1 in self._params:
             newParams.append(Parameters())
-            for p2 in p1:
-                newParams[-1].add(globalRes.params[p2])
+            newParams[-1].add_many(*[ globalRes.params[p2] for p2 in p1 ])
         self._params = newParams
+        self._lmparams = globalRes.params
+        self._lmparamsSource = list(newParams)
+
+    def _drop_last(self, params):
+        # Remove the last stage again, params are the per function
+        # Parameters before it has been added. The global Parameters of its
+        # refinement are dropped as well
+        self._chis.pop()
+        self._functions.pop()
+        self._params = params
+        self._lmparams = None
+        self._lmparamsSource = []
+
+    def _chisqr(self, x, data, weights = None, loss = None, lossScale = 1.0):
+        return np.sum(np.square(kernels.finish_residual(self(x, data = data), weights = weights, loss = loss, scale = lossScale)))
+
+    def _add_component(self, fun, params):
+        # Append a component taken from another mixture. The function and
+        # its parameters are renamed to the next free prefix
+        from lmfit import Parameters
+
+        prefix = f"f{len(self._functions)}"
+        newfun = fun._with_prefix(prefix)
+        newfun._ifac = fun._ifac
+
+        newParams = Parameters()
+        newParams.add_many(*[ (f"{prefix}_{fun._pnames[n]}", p.value, p.vary, p.min, p.max) for n, p in params.items() ])
+        for n, p in params.items():
+            newParams[f"{prefix}_{fun._pnames[n]}"].stderr = p.stderr
+
+        self._functions.append(newfun)
+        self._params.append(newParams)
+        return newfun, newParams
+
+    def _warm_start(self, initial, x, data, *, weights = None, loss = None, lossScale = 1.0, budget = None):
+        # Copy the components of another (Compact)Mixture into this empty
+        # mixture and refine them on the data. Returns the number of
+        # components, all of them share the chi^2 of this single stage
+        if not isinstance(initial, Mixture):
+            initial = initial.to_mixture()
+        for fun, params in zip(initial._functions, initial._params):
+            self._add_component(fun, params)
+        n = len(self._functions)
+        if n > 0:
+            self._refine(x, data, weights = weights, loss = loss, lossScale = lossScale, budget = budget)
+            self._chis = self._chis * n
+            if (budget is not None) and budget.exhausted:
+                self._budgetExhausted = True
+        return n
+
+    def compact(self):
+        """Array backed copy of the mixture (see mixfit.compact)"""
+        from mixfit.compact import CompactMixture
+        return CompactMixture.from_mixture(self)
 
     def __repr__(self):
         res = ""
@@ -72,18 +366,110 @@ class Mixture:
 class Mixfit:
     def __init__(
         self,
-        allowed = [
-            MixfitFunctionGaussianFactory(),
-            MixfitFunctionConstantFactory(),
-            MixfitFunctionLinearFactory(),
-            MixfitFunctionDifferentialGaussianFactory(),
-            MixfitFunctionCauchyFactory(),
-            MixfitFunctionDifferentialCauchyFactory()
-        ],
+        allowed = None,
         maxIterations = None,
         minResiduumImprovement = None,
-        stopError = None
+        stopError = None,
+        executor = None,
+        maxWorkers = None,
+        maxPending = None,
+        maxTime = None,
+        maxNfev = None,
+        loss = None,
+        lossScale = 1.0,
+        prescreen = None,
+        prescreenWidths = 12,
+        warmStart = False,
+        warmStartTolerance = 1e-3,
+        acceptance = None,
+        policy = None
     ):
+        """Create a new mixture fitter
+
+        Parameters
+        ----------
+
+        allowed: list, optional
+            List of MixfitFunctionFactory instances or function ids (as
+            registered in mixfitfunctions.registry) that are used as
+            candidate functions. By default all built in functions are used
+        maxIterations: int, optional
+            Maximum number of components that are fit
+        minResiduumImprovement: float, optional
+            Minimum improvement of chi^2 that a new component has to achieve
+        stopError: float, optional
+            Stop as soon as chi^2 drops below this value
+        executor: concurrent.futures.Executor, optional
+            Executor used by fit_async and fit_batch_async. When not supplied
+            a thread pool is created on first use and owned by this fitter
+            (release it with close)
+        maxWorkers: int, optional
+            Number of workers of the owned thread pool. Defaults to the
+            workers of the execution policy
+        maxPending: int, optional
+            Maximum number of asynchronous fits that are queued or running at
+            the same time. Further calls to fit_async wait until a slot is free
+        maxTime: float, optional
+            Wall clock budget of a single fit in seconds
+        maxNfev: int, optional
+            Total number of function evaluations of a single fit, shared by
+            all candidate searches and refinements. Evaluations of the
+            analytic jacobians are not counted
+
+        loss: str, optional
+            Robust loss applied to the (weighted) residuals of all candidate
+            fits and refinements. Either "linear" (default), "huber" or
+            "soft_l1". chi^2 based stop conditions use the robust cost
+        lossScale: float, optional
+            Residual size above which the robust loss reduces the influence
+            of a data point (in units of the weighted residual)
+        prescreen: int, optional
+            Correlate every stage residual with template banks of the peak
+            shapes (see mixfit.prescreen) and only minimize the given number
+            of best matching peak shapes, seeded with the position, width
+            and amplitude found. Functions that cannot be screened are
+            always minimized. Requires equidistant x, else all candidates
+            are minimized
+        prescreenWidths: int, optional
+            Number of widths per shape in the template banks
+        warmStart: bool, optional
+            Keep the optimized parameters of the candidates that have not
+            been selected in a stage. In the next stage a candidate whose
+            support region (center +- a few widths for peak shapes, else
+            all samples) has not changed materially is reused without
+            minimizing it again, all others are minimized starting from
+            the better (lower chi^2) of their previous optimum and their
+            guess
+        warmStartTolerance: float, optional
+            Change of the (weighted) stage residual in the support region
+            of a candidate, relative to the energy of the candidate there,
+            below which the candidate is reused
+        acceptance: str, optional
+            Cheap test of the best candidate of a stage before the whole
+            mixture is refined. The chi^2 of the candidate on the stage
+            input is the chi^2 of the extended mixture before refinement,
+            the refinement only lowers it further. "chi" rejects the
+            candidate (and stops the fit) when this reduction is below
+            minResiduumImprovement (or not positive when that is not set),
+            "bic" when the Bayesian information criterion
+            n ln(chi^2/n) + k ln(n) does not decrease with the k varying
+            parameters of the candidate. Rejected candidates are never
+            refined. By default every best candidate is refined and only
+            checked afterwards
+        policy: mixfit.execution.ExecutionPolicy, optional
+            Split of the cores into pool workers and BLAS threads used by
+            all pools the fitter creates (the owned thread pool of
+            fit_async, fit_segmented, fit_map and bootstrap). When not
+            supplied the owned thread pool gets one worker per core and
+            the process pools pick a policy from the size of their workload
+
+        When maxTime or maxNfev are exhausted the fit stops and returns the
+        best mixture found so far with _budgetExhausted set.
+        """
+        if allowed is None:
+            allowed = registry.default_factories()
+        else:
+            allowed = [ registry.create(a) if isinstance(a, str) else a for a in allowed ]
         for a in allowed:
             if not isinstance(a, MixfitFunctionFactory):
                 raise ValueError(f"{a} is not a MixfitFunctionFactory")
@@ -99,19 +485,498 @@ class Mixfit:
         if stopError is not None:
             if float(stopError) <= 0:
                 raise ValueError("Stop error has to be a positive value")
+        if maxWorkers is not None:
+            if (int(maxWorkers) != maxWorkers) or (maxWorkers < 1):
+                raise ValueError("Number of workers has to be a positive integer")
+        if maxPending is not None:
+            if (int(maxPending) != maxPending) or (maxPending < 1):
+                raise ValueError("Maximum number of pending fits has to be a positive integer")
+        if maxTime is not None:
+            if float(maxTime) <= 0:
+                raise ValueError("Time budget has to be a positive value")
+        if maxNfev is not None:
+            if (int(maxNfev) != maxNfev) or (maxNfev < 1):
+                raise ValueError("Function evaluation budget has to be a positive integer")
+        if loss is not None:
+            if loss not in kernels.LOSSES:
+                raise ValueError(f"Unknown loss {loss}, supported are {', '.join(kernels.LOSSES)}")
+            if loss == "linear":
+                loss = None
+        if float(lossScale) <= 0:
+            raise ValueError("Loss scale has to be a positive value")
+        if prescreen is not None:
+            if (int(prescreen) != prescreen) or (prescreen < 1):
+                raise ValueError("Number of prescreened candidates has to be a positive integer")
+        if (int(prescreenWidths) != prescreenWidths) or (prescreenWidths < 1):
+            raise ValueError("Number of prescreen widths has to be a positive integer")
+        if float(warmStartTolerance) < 0:
+            raise ValueError("Warm start tolerance cannot be negative")
+        if acceptance is not None:
+            if acceptance not in ACCEPTANCE_TESTS:
+                raise ValueError(f"Unknown acceptance test {acceptance}, supported are {', '.join(ACCEPTANCE_TESTS)}")
+        if policy is not None:
+            from mixfit.execution import ExecutionPolicy
+            if not isinstance(policy, ExecutionPolicy):
+                raise ValueError(f"{policy} is not an ExecutionPolicy")
 
         self._factories = allowed
         self._maxIterations = maxIterations
         self._minResiduumImprovement = minResiduumImprovement
         self._stopError = stopError
+        self._maxTime = maxTime
+        self._maxNfev = maxNfev
+        self._loss = loss
+        self._lossScale = lossScale
+        self._prescreen = prescreen
+        self._prescreenWidths = prescreenWidths
+        self._probes = None
+        self._warmStart = bool(warmStart)
+        self._warmStartTolerance = float(warmStartTolerance)
+        self._acceptance = acceptance
+        self._policy = policy
+
+        self._executor = executor
+        self._ownedExecutor = None
+        self._maxWorkers = maxWorkers
+        self._maxPending = maxPending
+        self._pending = None
+        self._pendingLoop = None
+        self._candidateCache = threading.local()
+        self._sharedX = None
+
+    def __getstate__(self):
+        # Executors and asyncio primitives are bound to the current
+        # process and event loop - they are never shipped to workers
+        state = self.__dict__.copy()
+        state["_executor"] = None
+        state["_ownedExecutor"] = None
+        state["_pending"] = None
+        state["_pendingLoop"] = None
+        state["_candidateCache"] = None
+        state["_sharedX"] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._candidateCache = threading.local()
+
+    def _candidate(self, ifac, prefix, guess):
+        # Candidate functions and their lmfit Parameters are created only
+        # once per factory and prefix (and thread). Later stages and fits
+        # just update the parameter values - lmfit minimize never modifies
+        # the Parameters it has been passed
+        cache = getattr(self._candidateCache, "cache", None)
+        if cache is None:
+            cache = {}
+            self._candidateCache.cache = cache
+
+        key = (ifac, prefix)
+        if key not in cache:
+            fun = self._factories[ifac](prefix = prefix)
+            fun._ifac = ifac
+            cache[key] = (fun, fun.lmparams(guess(fun)))
+            return cache[key]
+
+        fun, lmp = cache[key]
+        return fun, fun._lmparams_set(guess(fun), lmp)
+
+    def _prescreen_candidates(self, x, stageInput, xFull = None, selection = None):
+        # Indices of the factories that are minimized in this stage and the
+        # prescreen seeds (kernel slot to value) of the peak shapes
+        allFactories = range(len(self._factories))
+        if self._prescreen is None:
+            return allFactories, {}
+
+        from mixfit import prescreen
+
+        if self._probes is None:
+            self._probes = [ fac() for fac in self._factories ]
+        if selection is not None:
+            # The template banks need the equidistant full grid, masked out
+            # samples are filled with the mean so they do not correlate
+            full = np.full((len(xFull),), np.mean(stageInput))
+            full[selection] = stageInput
+            x, stageInput = xFull, full
+        screened = prescreen.prescreen(x, stageInput, self._probes, self._prescreenWidths)
+        if len(screened) == 0:
+            return allFactories, {}
+
+        seeds = { ifac : seed for _, ifac, seed in screened[:self._prescreen] }
+        return [ ifac for ifac in allFactories if (ifac in seeds) or (not prescreen.screenable(self._probes[ifac])) ], seeds
+
+    def _seeded_guess(self, fun, x, stageInput, seed):
+        guess = fun.guess(x, stageInput)
+        if seed is not None:
+            for slot, value in seed.items():
+                guess[fun._kernel_pnames[slot]] = value
+        return guess
+
+    def _accept(self, chi, candidateChi, k, n):
+        # Acceptance test of the best candidate of a stage. chi is the
+        # chi^2 of the mixture so far, candidateChi the one of the mixture
+        # with the unrefined candidate added, k its varying parameters
+        if self._acceptance == "bic":
+            if candidateChi <= 0:
+                return chi > 0
+            return n * np.log(chi / candidateChi) > k * np.log(n)
+        if self._minResiduumImprovement is not None:
+            return (chi - candidateChi) >= self._minResiduumImprovement
+        return candidateChi < chi
+
+    def _support(self, fun, values, x):
+        # Samples a candidate contributes to: center +- the truncation of
+        # the shape for peak shapes, all samples for everything else
+        from mixfit import prescreen
+
+        if (fun._kernel_names is None) or (fun._kernel_names[1] is None) or (fun._kernel_names[2] is None):
+            return slice(None)
+        c = values[fun._kernel_names[1]]
+        w = abs(values[fun._kernel_names[2]]) * prescreen._TRUNCATION.get(fun._kernel, 5.0)
+        return (x >= c - w) & (x <= c + w)
+
+    def _warm_candidate(self, ifac, prefix, x, delta, previous, guess, weights):
+        # Candidate of a warm started stage. Returns the function, the
+        # initial Parameters and True when the previous optimum can be
+        # reused without running the minimizer. The previous optimum is
+        # only a useful start when the candidate described a feature that
+        # is still present - candidates that competed for the feature the
+        # selected function has taken start from their guess again
+        values, support, energy = previous
+        d = delta[support]
+        if weights is not None:
+            d = d * weights[support]
+        change = np.sum(np.square(d))
+
+        if change > _WARM_START_LIMIT * energy:
+            fun, params = self._candidate(ifac, prefix, guess)
+            return fun, params, False
+        fun, params = self._candidate(ifac, prefix, lambda f: { p : values[n] for p, n in f._pnames.items() })
+        return fun, params, change <= self._warmStartTolerance * energy
+
+    def fit_segmented(
+        self,
+        x,
+        inputData,
+        *,
+        breakpoints = None,
+        minGap = None,
+        threshold = 5.0,
+        weights = None,
+        executor = None,
+        polish = "boundary",
+        polishNfev = None
+    ):
+        """Fit well separated regions of a long sweep independently
+
+        The sweep is split at quiet gaps (or at the supplied breakpoints),
+        every segment is fit as an independent mixture on a worker.
+        Components outside of their segment are removed, the results are
+        stitched into a single mixture that is polished by refining the
+        components of neighbouring segments on their samples (or, with
+        polish = "full", by a global refinement of all parameters). See
+        mixfit.segmented for details.
+        """
+        from mixfit.segmented import fit_segmented
+        return fit_segmented(
+            self,
+            x,
+            inputData,
+            breakpoints = breakpoints,
+            minGap = minGap,
+            threshold = threshold,
+            weights = weights,
+            executor = executor,
+            polish = polish,
+            polishNfev = polishNfev
+        )
+
+    def fit_map(
+        self,
+        x,
+        cube,
+        *,
+        weights = None,
+        seed = None,
+        executor = None,
+        refitRatio = 1.5,
+        warmNfev = None
+    ):
+        """Fit every pixel of a (rows, cols, len(x)) cube, propagating
+        the results from a seed pixel to its neighbours. See mixfit.mapfit
+        for details.
+        """
+        from mixfit.mapfit import fit_map
+        return fit_map(
+            self,
+            x,
+            cube,
+            weights = weights,
+            seed = seed,
+            executor = executor,
+            refitRatio = refitRatio,
+            warmNfev = warmNfev
+        )
+
+    def bootstrap(
+        self,
+        x,
+        inputData,
+        mixture,
+        *,
+        n = 200,
+        weights = None,
+        method = "residual",
+        level = 0.95,
+        seed = None,
+        executor = None,
+        chunks = None
+    ):
+        """Percentile confidence intervals of the parameters of a fitted
+        mixture by refitting its structure to resampled data. See
+        mixfit.bootstrap for details.
+        """
+        from mixfit.bootstrap import bootstrap
+        return bootstrap(
+            self,
+            x,
+            inputData,
+            mixture,
+            n = n,
+            weights = weights,
+            method = method,
+            level = level,
+            seed = seed,
+            executor = executor,
+            chunks = chunks
+        )
+
+    def close(self):
+        """Shut down the thread pool owned by this fitter (if any) and release
+        the shared memory published for process pool workers"""
+        if self._ownedExecutor is not None:
+            self._ownedExecutor.shutdown(wait = True)
+            self._ownedExecutor = None
+        if self._sharedX is not None:
+            self._sharedX.close()
+            self._sharedX = None
+
+    def _shared_x(self, x):
+        # The x grid is published once for all process pool fits and only
+        # replaced when a fit uses a different grid
+        from mixfit import sharedmem
+
+        if (self._sharedX is None) or (not np.array_equal(self._sharedX.array, x)):
+            if self._sharedX is not None:
+                self._sharedX.close()
+            self._sharedX = sharedmem.SharedArray(x, persistent = True)
+        return self._sharedX
+
+    def _get_executor(self):
+        # The owned thread pool runs fits of unknown number and size for
+        # the lifetime of the fitter. It is not sized by the workload but
+        # gets the workers of the policy (one per core by default)
+        if self._executor is not None:
+            return self._executor
+        if self._ownedExecutor is None:
+            policy = self._policy
+            if policy is None:
+                from mixfit.execution import ExecutionPolicy
+                policy = ExecutionPolicy()
+            self._ownedExecutor = policy.thread_pool(maxWorkers = self._maxWorkers)
+        return self._ownedExecutor
+
+    def _execution_policy(self, traceLength, tasks, factories = None):
+        # Policy of a pool running tasks independent fits of traceLength
+        # samples each
+        if self._policy is not None:
+            return self._policy
+        from mixfit.execution import ExecutionPolicy
+        if factories is None:
+            factories = len(self._factories)
+        return ExecutionPolicy.auto(traceLength, tasks, factories)
+
+    def _get_pending(self):
+        # The semaphore is bound to the running loop, recreate it whenever
+        # we are used from a different loop
+        import asyncio
+
+        loop = asyncio.get_running_loop()
+        if (self._pending is None) or (self._pendingLoop is not loop):
+            self._pending = asyncio.Semaphore(self._maxPending)
+            self._pendingLoop = loop
+        return self._pending
+
+    async def fit_async(
+        self,
+        x,
+        inputData,
+        *,
+        weights = None
+    ):
+        """Run fit on the executor without blocking the event loop
+
+        When the awaiting task is cancelled the fit stops at the next
+        stage of the greedy loop (thread pools) or is not started at all
+        in case it is still queued (process pools). In case maxPending has
+        been set the call waits for a free slot before submitting.
+        """
+        import asyncio
+        from concurrent.futures import ProcessPoolExecutor
+
+        loop = asyncio.get_running_loop()
+        executor = self._get_executor()
+
+        pending = None
+        if self._maxPending is not None:
+            pending = self._get_pending()
+            await pending.acquire()
+
+        if isinstance(executor, ProcessPoolExecutor):
+            # Data is passed to the workers in shared memory and the result
+            # comes back as packed arrays, see mixfit.sharedmem
+            from mixfit import sharedmem
+
+            cancel = None
+            shared = [ sharedmem.SharedArray(inputData) ]
+            if weights is not None:
+                shared.append(sharedmem.SharedArray(weights))
+            job = functools.partial(sharedmem.fit_task, self, self._shared_x(x), *shared)
+        else:
+            shared = None
+            cancel = threading.Event()
+            job = functools.partial(self.fit, x, inputData, weights = weights, cancel = cancel)
+
+        try:
+            cfut = executor.submit(job)
+        except BaseException:
+            if pending is not None:
+                pending.release()
+            raise
+
+        if pending is not None:
+            # The slot is only released when the worker really finished, a
+            # cancelled fit keeps it until it reached the next stage
+            def release(_):
+                try:
+                    loop.call_soon_threadsafe(pending.release)
+                except RuntimeError:
+                    pass
+            cfut.add_done_callback(release)
+
+        if shared is not None:
+            cfut.add_done_callback(lambda _: [ s.close() for s in shared ])
+
+        try:
+            res = await asyncio.wrap_future(cfut)
+            if shared is not None:
+                res = sharedmem.unpack_mixture(res, self._factories)
+            return res
+        except asyncio.CancelledError:
+            if cancel is not None:
+                cancel.set()
+            cfut.cancel()
+            raise
+
+    async def fit_batch_async(
+        self,
+        x,
+        inputDatas,
+        *,
+        weights = None
+    ):
+        """Fit multiple data sets sampled at the same x asynchronously
+
+        Returns the list of mixtures in the order of the input data sets.
+        Cancelling the batch cancels all fits that are still running.
+        weights is an optional sequence with one weight array per data set.
+        """
+        import asyncio
+
+        if weights is None:
+            weights = [ None ] * len(inputDatas)
+        if len(weights) != len(inputDatas):
+            raise ValueError("One weight array is required per data set")
+        return list(await asyncio.gather(*[ self.fit_async(x, d, weights = w) for d, w in zip(inputDatas, weights) ]))
 
     def fit(
         self,
         x,
-        inputData
+        inputData,
+        *,
+        weights = None,
+        cancel = None,
+        initial = None,
+        mask = None,
+        roi = None,
+        exclude = None
     ):
+        """Perform the mixture fit
+
+        Parameters
+        ----------
+
+        x: ndarray
+            Sample positions
+        inputData: ndarray
+            Sampled data
+        weights: ndarray, optional
+            Per point weights the residuals are multiplied with (typically
+            1/sigma of every sample)
+        cancel: threading.Event, optional
+            When set the fit raises MixfitCancelledError before starting
+            the next stage
+        initial: Mixture, optional
+            Warm start (for example the result of a neighbouring spectrum,
+            a CompactMixture is accepted as well). Its components are
+            refined on the data first, the greedy search then continues
+            from there with the usual stop conditions
+        mask: ndarray, optional
+            Samples that are fit, either a boolean array (True for used
+            samples) or an array of sample indices
+        roi: tuple, optional
+            Only fit samples with roi[0] <= x <= roi[1] (None for an open
+            end)
+        exclude: list, optional
+            (min, max) ranges on the x axis that are not fit (for example
+            detector artifacts)
+
+        Masked out samples are removed once before the fit, all candidate
+        fits, guesses and refinements only see the selected samples. The
+        resulting mixture can still be evaluated on the full grid.
+        """
+        if weights is not None:
+            weights = np.asarray(weights, dtype = np.float64)
+            if weights.shape != np.shape(inputData):
+                raise ValueError("Weights have to be of the same shape as the input data")
+
+        # Samples that are not selected are dropped once (views of the
+        # input for contiguous selections, else copies of the selected
+        # samples), everything below works on the selected samples only
+        xFull = x
+        selection = _selection(x, len(inputData), mask, roi, exclude)
+        if selection is not None:
+            if (not isinstance(selection, slice)) and (len(selection) == 0):
+                raise ValueError("No samples are left to fit")
+            x = np.asarray(x)[selection]
+            inputData = np.asarray(inputData)[selection]
+            if weights is not None:
+                weights = weights[selection]
+
         res = Mixture()
 
+        budget = None
+        if (self._maxTime is not None) or (self._maxNfev is not None):
+            budget = _FitBudget(self._maxTime, self._maxNfev)
+
+        nInitial = 0
+        if initial is not None:
+            nInitial = res._warm_start(initial, x, inputData, weights = weights, loss = self._loss, lossScale = self._lossScale, budget = budget)
+
+        # Optimized candidates of the previous stage (warm start) by factory
+        # index: unprefixed values, support region and energy there
+        previous = {}
+        prevInput = None
+
         while True:
             # First all of our stop conditions
             # ================================
@@ -119,13 +984,11 @@ class Mixfit:
                 # Check if we have reached the maximum number of iterations
                 if len(res._chis) >= self._maxIterations:
                     break
-            if len(res._chis) > 1:
+            if len(res._chis) > max(nInitial, 1):
                 if res._chis[-2] < res._chis[-1]:
                     # We did not improve on the last step - we always terminate then
                     # and drop the last step
-                    res._chis.pop()
-                    res._functions.pop()
-                    res._params.pop()
+                    res._drop_last(prevParams)
                     break
                 if res._chis[-1] == 0:
                     # We also break if we have a perfect fit of course ...
@@ -133,9 +996,7 @@ class Mixfit:
                 if self._minResiduumImprovement is not None:
                     # Check if we have achived the minimum improvement
                     if (res._chis[-2] - res._chis[-1]) < self._minResiduumImprovement:
-                        res._chis.pop()
-                        res._functions.pop()
-                        res._params.pop()
+                        res._drop_last(prevParams)
                         break
             if len(res._chis) > 0:
                 if self._stopError is not None:
@@ -143,6 +1004,15 @@ class Mixfit:
                     if res._chis[-1] < self._stopError:
                         break
 
+            if cancel is not None:
+                if cancel.is_set():
+                    raise MixfitCancelledError("Fit has been cancelled")
+
+            if budget is not None:
+                if budget.check():
+                    res._budgetExhausted = True
+                    break
+
             # Subtract the previously fitted functions from our
             # input data as our "stage input"
             # =================================================
@@ -153,13 +1023,30 @@ class Mixfit:
             candidates = []
             candidates_params = []
             candidates_chi = []
-            for fac in self._factories:
-                # Create function from factory ...
-                fun = fac(prefix=f"f{len(res._functions)}")
+            minkws = {}
+            reskws = { 'data' : stageInput, 'weights' : weights, 'loss' : self._loss, 'lossScale' : self._lossScale }
+            candidates_reused = []
+            factories, seeds = self._prescreen_candidates(x, stageInput, xFull, selection)
+            for ifac in factories:
+                if budget is not None:
+                    if budget.exhausted:
+                        break
+                    minkws = budget.minimize_kws()
 
-                # Get guess
-                guess = fun.guess(x, stageInput)
-                guessParams = fun.lmparams(guess)
+                # Create function from factory and get guess ...
+                guess = lambda f: self._seeded_guess(f, x, stageInput, seeds.get(ifac))
+                if ifac in previous:
+                    fun, guessParams, reused = self._warm_candidate(ifac, f"f{len(res._functions)}", x, stageInput - prevInput, previous[ifac], guess, weights)
+                    if reused:
+                        # Support region unchanged, only the chi^2 on the
+                        # new stage input is evaluated
+                        candidates.append(fun)
+                        candidates_params.append(guessParams)
+                        candidates_chi.append(np.sum(np.square(fun._residual(guessParams, x, **reskws))))
+                        candidates_reused.append(True)
+                        continue
+                else:
+                    fun, guessParams = self._candidate(ifac, f"f{len(res._functions)}", guess)
 
                 #fig, ax = plt.subplots()
                 #ax.plot(x, stageInput, 'x')
@@ -167,31 +1054,86 @@ class Mixfit:
                 #ax.grid()
                 #plt.show()
                 
-                # Run minimizer on our candidate function
-                singleRes = minimize(
-                    fun,
+                # Run minimizer on our candidate function (with the
+                # analytic jacobian where the function supplies one)
+                dfun = None
+                if fun._has_jacobian():
+                    dfun = fun._residual_jacobian
+                singleRes = _minimize(
+                    fun._residual,
                     guessParams,
+                    dfun,
                     args = (x,),
-                    kws = { 'data' : stageInput }
+                    kws = reskws,
+                    **minkws
                 )
+                nfev = singleRes.nfev
+                if budget is not None:
+                    nfev = budget.consume(singleRes)
+                res._nfev = res._nfev + nfev
 
                 candidates.append(fun)
                 candidates_params.append(singleRes.params)
-                candidates_chi.append(singleRes.chisqr)
+                candidates_reused.append(False)
+                if singleRes.aborted:
+                    candidates_chi.append(np.sum(np.square(fun._residual(singleRes.params, x, **reskws))))
+                else:
+                    candidates_chi.append(singleRes.chisqr)
+
+            if len(candidates) == 0:
+                res._budgetExhausted = True
+                break
 
             # Locate best fit for this stage input
             # ====================================
             candidates_chi = np.asarray(candidates_chi)
             minchi = np.argmin(candidates_chi)
 
+            if self._acceptance is not None:
+                # Reject the candidate before the expensive refinement
+                # in case it clearly does not help
+                if len(res._chis) > 0:
+                    chi = res._chis[-1]
+                else:
+                    chi = np.sum(np.square(kernels.finish_residual(stageInput.copy(), weights = weights, loss = self._loss, scale = self._lossScale)))
+                k = sum([ p.vary for p in candidates_params[minchi].values() ])
+                if not self._accept(chi, candidates_chi[minchi], k, len(x)):
+                    break
+
+            if self._warmStart:
+                previous = {}
+                prevInput = stageInput
+                for ifac, fun, params, reused in zip(factories, candidates, candidates_params, candidates_reused):
+                    values = { fun._pnames[n] : p.value for n, p in params.items() }
+                    support = self._support(fun, values, x)
+                    model = fun(params, x)[support]
+                    if weights is not None:
+                        model = model * weights[support]
+                    previous[ifac] = (values, support, np.sum(np.square(model)))
+
+            prevParams = res._params
             res._functions.append(candidates[minchi])
-            res._params.append(candidates_params[minchi])
+            if candidates_reused[minchi]:
+                # Reused candidates are the cached Parameters objects that
+                # are updated again in the next stage
+                res._params = res._params + [ candidates_params[minchi].copy() ]
+            else:
+                res._params = res._params + [ candidates_params[minchi] ]
 
             # Now preform refinment on the whole function
             # and all parameters of the whole mixture
             # ===========================================
 
-            res._refine(x, inputData)
+            res._refine(x, inputData, weights = weights, loss = self._loss, lossScale = self._lossScale, budget = budget)
+
+            if budget is not None:
+                if budget.exhausted:
+                    # Anytime result: keep the interrupted stage only in
+                    # case it improved on the previous one
+                    res._budgetExhausted = True
+                    if (not np.isfinite(res._chis[-1])) or ((len(res._chis) > 1) and (res._chis[-1] >= res._chis[-2])):
+                        res._drop_last(prevParams)
+                    break
 
 
             # Debug output
@@ -212,6 +1154,12 @@ if __name__ == "__main__":
     import matplotlib.pyplot as plt
     import sys
 
+    from mixfitfunctions.gaussian import MixfitFunctionGaussianFactory
+    from mixfitfunctions.linear import MixfitFunctionLinearFactory
+    from mixfitfunctions.differentialgaussian import MixfitFunctionDifferentialGaussianFactory
+    from mixfitfunctions.cauchy import MixfitFunctionCauchyFactory
+    from mixfitfunctions.differentialcauchy import MixfitFunctionDifferentialCauchyFactory
+
 
     dc = MixfitFunctionCauchyFactory()
     ddc = MixfitFunctionDifferentialCauchyFactory()
@@ -0,0 +1,182 @@
+"""Matched filter prescreen of candidate functions
+
+Instead of running a nonlinear fit of every candidate function to learn
+which shape fits best at which position, the stage residual is correlated
+with a bank of unit templates of every peak shape at a range of widths
+(within the limits of the factory). The offset of the mixture is a single
+constant, so the mean is removed from the residual once and the templates
+are only normalized. The correlation at every position is then the least
+squares amplitude of the normalized template there and its square the
+reduction of chi^2. All correlations of a shape are calculated with a single FFT of the residual
+and one inverse FFT per width.
+
+Template banks only depend on the x grid (which has to be equidistant),
+the shape and the width range, they are cached and reused for all stages
+and all spectra sampled on the same grid.
+"""
+
+import threading
+
+from collections import OrderedDict
+
+import numpy as np
+
+from mixfitfunctions import kernels
+
+# Shapes that can be screened and the number of widths their templates
+# are truncated at
+_TRUNCATION = {
+    kernels.GAUSSIAN : 5.0,
+    kernels.DIFFGAUSSIAN : 5.0,
+    kernels.CAUCHY : 20.0,
+    kernels.DIFFCAUCHY : 20.0
+}
+
+_CACHE_SIZE = 16
+_banks = OrderedDict()
+_banksLock = threading.Lock()
+
+def grid_step(x):
+    """Step of an equidistant grid or None in case x is not equidistant"""
+    x = np.asarray(x, dtype = np.float64)
+    if len(x) < 8:
+        return None
+    dx = (x[-1] - x[0]) / (len(x) - 1)
+    if dx == 0:
+        return None
+    if np.max(np.abs(np.diff(x) - dx)) > 1e-6 * abs(dx):
+        return None
+    return dx
+
+def screenable(fun):
+    """Check if the function is a peak shape supported by the prescreen"""
+    return (fun._kernel in _TRUNCATION) and (fun._kernel_names[1] is not None) and (fun._kernel_names[2] is not None)
+
+class _TemplateBank:
+    """Spectra of the normalized templates of one shape at a set of widths
+    for one grid"""
+    def __init__(self, shape, n, dx, widths):
+        from scipy import fft
+
+        self.widths = widths
+        trunc = _TRUNCATION[shape]
+        halfs = [ min(int(np.ceil(trunc * w / abs(dx))), n - 1) for w in widths ]
+        self.nfft = fft.next_fast_len(n + max(halfs), real = True)
+
+        tt = np.zeros((len(widths), self.nfft))
+        self.norms = np.empty((len(widths),))
+        self.sums = np.empty((len(widths),))
+        for iw, (w, h) in enumerate(zip(widths, halfs)):
+            offsets = np.arange(-h, h + 1) * dx
+            t = kernels.evaluate(shape, offsets, 1.0, 0.0, w, 0.0)
+            self.sums[iw] = np.sum(t)
+            self.norms[iw] = np.sqrt(np.sum(t * t))
+            t = t / self.norms[iw]
+
+            # Template centered at index 0 (negative offsets wrap around)
+            tt[iw,:h+1] = t[h:]
+            if h > 0:
+                tt[iw,-h:] = t[:h]
+        self.spectra = np.conj(fft.rfft(tt, axis = 1))
+
+def _bank(shape, n, dx, wmin, wmax, nWidths):
+    key = (shape, n, dx, wmin, wmax, nWidths)
+    with _banksLock:
+        if key in _banks:
+            _banks.move_to_end(key)
+            return _banks[key]
+
+    bank = _TemplateBank(shape, n, dx, np.geomspace(wmin, wmax, nWidths))
+
+    with _banksLock:
+        _banks[key] = bank
+        while len(_banks) > _CACHE_SIZE:
+            _banks.popitem(last = False)
+    return bank
+
+def _bounds(fun, slot):
+    d = fun._paramsd[fun._kernel_names[slot]]
+    if not d["vary"]:
+        return None, None
+    return d["min"], d["max"]
+
+def prescreen(x, residual, functions, nWidths = 12):
+    """Correlate the residual with the template banks of the supplied
+    functions
+
+    Parameters
+    ----------
+
+    x: ndarray
+        Equidistant sample positions
+    residual: ndarray
+        Stage residual
+    functions: list
+        MixfitFunction instances (only screenable ones are considered)
+    nWidths: int, optional
+        Number of (geometrically spaced) widths per shape
+
+    Returns
+    -------
+
+    A list with one entry per screenable function, sorted by decreasing
+    estimated chi^2 reduction: (score, index into functions, seed) where
+    seed maps the canonical kernel slots (0 amplitude, 1 center, 2 width,
+    3 offset) to initial values
+    """
+    from scipy import fft
+
+    dx = grid_step(x)
+    if dx is None:
+        return []
+    x = np.asarray(x, dtype = np.float64)
+    residual = np.asarray(residual, dtype = np.float64)
+    n = len(x)
+    span = abs(x[-1] - x[0])
+    rmean = np.mean(residual)
+
+    spectra = {}
+    res = []
+    for ifun, fun in enumerate(functions):
+        if not screenable(fun):
+            continue
+
+        wmin, wmax = _bounds(fun, 2)
+        wmin = 2 * abs(dx) if wmin is None else max(wmin, 0.5 * abs(dx))
+        wmax = span / 50 if wmax is None else min(wmax, span)
+        if wmax < wmin:
+            wmax = wmin
+        bank = _bank(fun._kernel, n, dx, float(wmin), float(wmax), nWidths if wmax > wmin else 1)
+
+        if bank.nfft not in spectra:
+            spectra[bank.nfft] = fft.rfft(residual - rmean, n = bank.nfft)
+        corr = fft.irfft(bank.spectra * spectra[bank.nfft][np.newaxis,:], n = bank.nfft, axis = 1)[:,:n]
+
+        # Respect the sign of bounded amplitudes and the center limits
+        amin, amax = _bounds(fun, 0)
+        if (amin is not None) and (amin >= 0):
+            corr = np.maximum(corr, 0)
+        if (amax is not None) and (amax <= 0):
+            corr = np.minimum(corr, 0)
+        score = corr * corr
+        cmin, cmax = _bounds(fun, 1)
+        if (cmin is not None) or (cmax is not None):
+            outside = np.zeros((n,), dtype = bool)
+            if cmin is not None:
+                outside = outside | (x < cmin)
+            if cmax is not None:
+                outside = outside | (x > cmax)
+            score[:,outside] = -1
+
+        iw, ix = np.unravel_index(np.argmax(score), score.shape)
+        if score[iw, ix] < 0:
+            continue
+        amp = corr[iw, ix] / bank.norms[iw]
+
+        seed = { 0 : amp, 1 : x[ix], 2 : bank.widths[iw] }
+        if fun._kernel_names[3] is not None:
+            seed[3] = rmean - amp * bank.sums[iw] / n
+        res.append((score[iw, ix], ifun, seed))
+
+    res.sort(key = lambda r: -r[0])
+    return res
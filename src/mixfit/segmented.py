@@ -0,0 +1,397 @@
+"""Segmented fitting of long sweeps
+
+Wide sweeps often contain groups of lines that are separated by regions
+that only contain the baseline and noise. Instead of fitting the whole
+trace as a single problem (where every new component triggers a
+refinement over all parameters and every candidate is evaluated over all
+samples) the sweep is split at those quiet gaps, each segment is fit as
+an independent mixture and the results are stitched together.
+
+The stitched mixture is polished where the segments interact: by default
+the components of every pair of neighbouring segments are refined on the
+samples of these two segments with all other components held fixed, so
+the cost grows with the size of the segments and not with the size of the
+sweep. A global refinement of all parameters on the full sweep is
+available as well (polish = "full").
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from mixfitfunctions import kernels
+
+from mixfit.mixfit import Mixture, _FitBudget
+from mixfit.sharedmem import SharedArray, fit_task, unpack_mixture
+
+POLISH = ("boundary", "full")
+
+def find_segments(x, data, *, minGap = None, threshold = 5.0):
+    """Locate quiet gaps in the data and split the sweep there
+
+    A sample is considered active when it deviates more than threshold
+    times the noise level from the baseline (median of the data). The
+    noise level is estimated robustly from the first differences. Active
+    regions are widened by half a gap so that line tails stay inside their
+    segment. Every quiet run of at least minGap samples that does not touch
+    the ends of the sweep is split in the middle.
+
+    Parameters
+    ----------
+
+    x: ndarray
+        Sample positions (only used for its length)
+    data: ndarray
+        Sampled data
+    minGap: int, optional
+        Minimum number of quiet samples between two segments. Defaults to
+        1% of the samples (at least 8)
+    threshold: float, optional
+        Threshold in units of the noise level
+
+    Returns
+    -------
+
+    A list of (start, stop) index ranges covering the whole sweep
+    """
+    data = np.asarray(data, dtype = np.float64)
+    n = len(data)
+    if len(x) != n:
+        raise ValueError("x and data have to be of the same length")
+    if minGap is None:
+        minGap = max(n // 100, 8)
+    if (int(minGap) != minGap) or (minGap < 1):
+        raise ValueError("Minimum gap has to be a positive integer")
+    if float(threshold) <= 0:
+        raise ValueError("Threshold has to be a positive value")
+    if n < 2:
+        return [ (0, n) ]
+
+    noise = 1.4826 * np.median(np.abs(np.diff(data))) / np.sqrt(2.0)
+    active = np.abs(data - np.median(data)) > (threshold * noise)
+    if not np.any(active):
+        return [ (0, n) ]
+
+    # Widen active regions using a running window sum
+    half = int(minGap) // 2
+    if half > 0:
+        c = np.concatenate(([ 0 ], np.cumsum(active)))
+        idx = np.arange(n)
+        active = (c[np.minimum(idx + half + 1, n)] - c[np.maximum(idx - half, 0)]) > 0
+
+    quiet = np.diff(np.concatenate(([ 0 ], (~active).astype(np.int8), [ 0 ])))
+    starts = np.flatnonzero(quiet == 1)
+    stops = np.flatnonzero(quiet == -1)
+
+    cuts = [ int((a + b) // 2) for a, b in zip(starts, stops) if ((b - a) >= minGap) and (a > 0) and (b < n) ]
+    bounds = [ 0 ] + cuts + [ n ]
+    return [ (bounds[i], bounds[i+1]) for i in range(len(bounds) - 1) ]
+
+def segments_from_breakpoints(x, breakpoints):
+    """Convert user supplied breakpoints (positions on the x axis) into
+    (start, stop) index ranges covering the whole sweep"""
+    x = np.asarray(x)
+    n = len(x)
+    if x[-1] >= x[0]:
+        cuts = np.searchsorted(x, breakpoints)
+    else:
+        cuts = np.searchsorted(-x, -np.asarray(breakpoints))
+    bounds = [ 0 ] + sorted(set([ int(c) for c in cuts if 0 < c < n ])) + [ n ]
+    return [ (bounds[i], bounds[i+1]) for i in range(len(bounds) - 1) ]
+
+def _energy(fun, params, x, weights = None):
+    # Energy of a component without its constant offset
+    model = fun(params, x)
+    n = fun._offset_name()
+    if n is not None:
+        model = model - params[n].value
+    if weights is not None:
+        model = model * weights
+    return np.sum(np.square(model))
+
+def confine(mixture, x, start, stop, *, weights = None):
+    """Remove the components of a segment mixture that lie outside of their
+    segment
+
+    A segment fit only sees its own samples, broad components (wide lines
+    describing a baseline, slopes) and lines placed next to the segment are
+    free to take any value outside. Components with more (weighted) energy
+    outside of the samples start to stop than inside are removed unless
+    that energy is below the chi^2 of the segment fit.
+
+    Returns the confined mixture and the number of removed components
+    """
+    n = len(x)
+    inside = np.zeros((n,), dtype = bool)
+    inside[start:stop] = True
+    limit = 0.0
+    if len(mixture._chis) > 0:
+        limit = mixture._chis[-1]
+
+    res = Mixture()
+    res._nfev = mixture._nfev
+    res._budgetExhausted = mixture._budgetExhausted
+    removed = 0
+    for fun, params in zip(mixture._functions, mixture._params):
+        outer = _energy(fun, params, x[~inside], None if weights is None else weights[~inside])
+        inner = _energy(fun, params, x[inside], None if weights is None else weights[inside])
+        if not (outer <= max(inner, limit)):
+            removed = removed + 1
+            continue
+        res._add_component(fun, params)
+    return res, removed
+
+def stitch(mixtures):
+    """Combine the mixtures of independent segments into one mixture
+
+    Every component carries its own constant offset, the offsets of each
+    segment add up to that segments baseline. They are shifted so that the
+    offsets of the stitched mixture add up to the mean baseline of all
+    segments instead of the sum of all baselines.
+    """
+    res = Mixture()
+
+    baselines = []
+    for m in mixtures:
+        res._nfev = res._nfev + m._nfev
+        res._budgetExhausted = res._budgetExhausted or m._budgetExhausted
+
+        offsets = []
+        for fun, params in zip(m._functions, m._params):
+            newfun, newParams = res._add_component(fun, params)
+            n = newfun._offset_name()
+            if n is not None:
+                offsets.append(newParams[n])
+        if len(offsets) > 0:
+            baselines.append((offsets, np.sum([ p.value for p in offsets ])))
+
+    if len(baselines) > 0:
+        target = np.mean([ b for _, b in baselines ]) / len(baselines)
+        for offsets, baseline in baselines:
+            for p in offsets:
+                p.value = p.value - baseline / len(offsets) + target / len(offsets)
+
+    return res
+
+def _cost(residual, weights, loss, lossScale):
+    return np.sum(np.square(kernels.finish_residual(residual.copy(), weights = weights, loss = loss, scale = lossScale)))
+
+def _polish_boundaries(mixture, owners, segments, x, data, *, weights = None, loss = None, lossScale = 1.0, budget = None):
+    # Refine the components of every pair of neighbouring segments on the
+    # samples of the two segments, the other components are held fixed.
+    # The constant offsets are held fixed as well, they shift the baseline
+    # of the full sweep. A refinement is only kept when it lowers the chi^2
+    # of the full sweep (refined components may widen into other
+    # segments). owners are the segment indices of the components of the
+    # mixture. Returns the chi^2 of the polished mixture
+    owners = np.asarray(owners)
+    residual = mixture(x, data = data)
+    chi = _cost(residual, weights, loss, lossScale)
+    for i in range(len(segments) - 1):
+        if (budget is not None) and budget.exhausted:
+            break
+        idx = np.flatnonzero((owners == i) | (owners == i + 1))
+        if len(idx) == 0:
+            continue
+        start, stop = segments[i][0], segments[i+1][1]
+        xs = x[start:stop]
+
+        local = Mixture()
+        for j in idx:
+            fun, params = local._add_component(mixture._functions[j], mixture._params[j])
+            n = fun._offset_name()
+            if n is not None:
+                params[n].vary = False
+        before = local(x)
+        local._refine(
+            xs,
+            residual[start:stop] + before[start:stop],
+            weights = None if weights is None else weights[start:stop],
+            loss = loss,
+            lossScale = lossScale,
+            budget = budget
+        )
+        mixture._nfev = mixture._nfev + local._nfev
+
+        candidate = residual + before - local(x)
+        candidateChi = _cost(candidate, weights, loss, lossScale)
+        if not (candidateChi < chi):
+            continue
+        residual = candidate
+        chi = candidateChi
+        for j, params in zip(idx, local._params):
+            for p, refined in zip(mixture._params[j].values(), params.values()):
+                p.value = refined.value
+                p.stderr = refined.stderr
+    return chi
+
+def fit_segmented(
+    mixfit,
+    x,
+    inputData,
+    *,
+    breakpoints = None,
+    minGap = None,
+    threshold = 5.0,
+    weights = None,
+    executor = None,
+    polish = "boundary",
+    polishNfev = None
+):
+    """Split the sweep into independent segments, fit them in parallel and
+    stitch the results
+
+    Parameters
+    ----------
+
+    mixfit: Mixfit
+        The configured mixture fitter used for every segment
+    x: ndarray
+        Sample positions
+    inputData: ndarray
+        Sampled data
+    breakpoints: list, optional
+        Positions on the x axis at which the sweep is split. When not
+        supplied quiet gaps are detected by find_segments
+    minGap: int, optional
+        Passed to find_segments
+    threshold: float, optional
+        Passed to find_segments
+    weights: ndarray, optional
+        Per point weights
+    executor: concurrent.futures.Executor, optional
+        Executor the segments are fit on. When not supplied a process pool
+        with at most one worker per segment is created by the execution
+        policy of the fitter (see mixfit.execution)
+    polish: str or bool, optional
+        "boundary" (default) refines the components of every pair of
+        neighbouring segments on the samples of these segments, holding
+        all other components fixed. Its cost grows with the size of the
+        segments, not with the size of the sweep. "full" refines all
+        parameters of the stitched mixture on the full sweep, which gets
+        expensive for long sweeps with many components. False skips the
+        polishing, True is the same as "boundary"
+    polishNfev: int, optional
+        Limit of the function evaluations of all polishing refinements
+        together. By default every refinement runs until it converged
+
+    Returns
+    -------
+
+    The stitched Mixture. All components are added in a single stage, the
+    chi^2 history repeats the chi^2 of the stitched (and polished, if that
+    improved it) mixture once per component like for warm started fits
+    """
+    x = np.asarray(x)
+    inputData = np.asarray(inputData)
+    if len(x) != len(inputData):
+        raise ValueError("x and data have to be of the same length")
+    if weights is not None:
+        weights = np.asarray(weights, dtype = np.float64)
+        if weights.shape != inputData.shape:
+            raise ValueError("Weights have to be of the same shape as the input data")
+    if polish is True:
+        polish = "boundary"
+    if (polish is not False) and (polish is not None) and (polish not in POLISH):
+        raise ValueError(f"Unknown polishing {polish}, supported are {', '.join(POLISH)}")
+    if polishNfev is not None:
+        if (int(polishNfev) != polishNfev) or (polishNfev < 1):
+            raise ValueError("Polishing function evaluations have to be a positive integer")
+
+    if breakpoints is not None:
+        segments = segments_from_breakpoints(x, breakpoints)
+    else:
+        segments = find_segments(x, inputData, minGap = minGap, threshold = threshold)
+
+    if len(segments) == 1:
+        results = [ mixfit.fit(x, inputData, weights = weights) ]
+    else:
+        ownedExecutor = None
+        if executor is None:
+            ownedExecutor = mixfit._execution_policy(len(x) // len(segments), len(segments)).process_pool(len(segments))
+            executor = ownedExecutor
+        shared = None
+        try:
+            if isinstance(executor, ProcessPoolExecutor):
+                # The whole trace is published once, every task only
+                # transfers its index range and returns packed arrays
+                shared = [ SharedArray(a, persistent = True) for a in (x, inputData, weights) if a is not None ]
+                if weights is None:
+                    shared.append(None)
+                futures = [ executor.submit(fit_task, mixfit, *shared, start, stop) for start, stop in segments ]
+                results = [ unpack_mixture(f.result(), mixfit._factories) for f in futures ]
+            else:
+                futures = [ executor.submit(mixfit.fit, x[start:stop], inputData[start:stop], weights = None if weights is None else weights[start:stop]) for start, stop in segments ]
+                results = [ f.result() for f in futures ]
+        finally:
+            if ownedExecutor is not None:
+                ownedExecutor.shutdown()
+            if shared is not None:
+                for s in shared:
+                    if s is not None:
+                        s.close()
+
+    if len(results) == 1:
+        return results[0]
+
+    # Components outside of their segment are not constrained by the
+    # samples of the other segments, they are removed and the remaining
+    # components of their segment are refined to take over. That may move
+    # further components out of the segment
+    confined = []
+    for (start, stop), m in zip(segments, results):
+        m, removed = confine(m, x, start, stop, weights = weights)
+        while (removed > 0) and (len(m._functions) > 0):
+            m._refine(
+                x[start:stop],
+                inputData[start:stop],
+                weights = None if weights is None else weights[start:stop],
+                loss = mixfit._loss,
+                lossScale = mixfit._lossScale
+            )
+            m, removed = confine(m, x, start, stop, weights = weights)
+        confined.append(m)
+
+    res = stitch(confined)
+    chi = res._chisqr(x, inputData, weights, mixfit._loss, mixfit._lossScale)
+
+    if polish and (len(res._functions) > 0):
+        budget = None
+        if polishNfev is not None:
+            budget = _FitBudget(maxNfev = int(polishNfev))
+        stitchedParams = res._params
+        if polish == "full":
+            res._refine(
+                x,
+                inputData,
+                weights = weights,
+                loss = mixfit._loss,
+                lossScale = mixfit._lossScale,
+                budget = budget
+            )
+            polished = res._chis[-1]
+        else:
+            # The refined values are written back into the Parameters of
+            # the mixture, keep copies of the stitched ones
+            res._params = [ p.copy() for p in stitchedParams ]
+            res._lmparams = None
+            res._lmparamsSource = []
+            owners = [ i for i, m in enumerate(confined) for _ in m._functions ]
+            polished = _polish_boundaries(
+                res,
+                owners,
+                segments,
+                x,
+                inputData,
+                weights = weights,
+                loss = mixfit._loss,
+                lossScale = mixfit._lossScale,
+                budget = budget
+            )
+        if polished < chi:
+            chi = polished
+        else:
+            res._params = stitchedParams
+
+    res._chis = [ chi ] * len(res._functions)
+    return res
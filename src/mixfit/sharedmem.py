@@ -0,0 +1,206 @@
+"""Shared memory transport for process pools
+
+Arrays handed to process pool workers are published once into
+multiprocessing.shared_memory blocks. Only a small descriptor (block name,
+shape, dtype) is pickled per task, the workers map the blocks and use them
+without copying. Blocks that are used by many tasks (the x grid, a trace
+split into segments) stay mapped in the workers between tasks.
+
+Results are returned as compact arrays (factory index per component,
+parameter values and standard errors) instead of pickled lmfit Parameters
+and reconstructed in the parent using the factories of the fitter.
+"""
+
+import weakref
+
+from collections import OrderedDict
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from mixfit.mixfit import Mixture
+
+# Number of persistent blocks a worker keeps mapped
+_CACHE_SIZE = 8
+
+_attached = OrderedDict()
+
+def _release(shm):
+    shm.close()
+    try:
+        shm.unlink()
+    except FileNotFoundError:
+        pass
+
+class SharedArray:
+    """A copy of an array published in a shared memory block
+
+    The block is released when close is called or the SharedArray is
+    garbage collected. Pickling a SharedArray only transfers its descriptor,
+    workers access the data using attach.
+
+    Parameters
+    ----------
+
+    a: ndarray
+        Array to publish
+    persistent: bool, optional
+        Keep the block mapped in workers after a task finished. Use this for
+        arrays that are shared by many tasks
+    """
+    def __init__(self, a, *, persistent = False):
+        a = np.ascontiguousarray(a)
+        self._shm = shared_memory.SharedMemory(create = True, size = max(a.nbytes, 1))
+        np.ndarray(a.shape, dtype = a.dtype, buffer = self._shm.buf)[...] = a
+        self.descriptor = (self._shm.name, a.shape, a.dtype.str, persistent)
+        self._finalizer = weakref.finalize(self, _release, self._shm)
+
+    @property
+    def array(self):
+        """The published data (valid until close)"""
+        name, shape, dtype, persistent = self.descriptor
+        return np.ndarray(shape, dtype = np.dtype(dtype), buffer = self._shm.buf)
+
+    def close(self):
+        self._finalizer()
+
+    def __reduce__(self):
+        return (_SharedArrayRef, (self.descriptor,))
+
+class _SharedArrayRef:
+    """Worker side of a SharedArray - only the descriptor"""
+    def __init__(self, descriptor):
+        self.descriptor = descriptor
+
+def _open(name):
+    try:
+        # Python 3.13+: workers must not register the block with the
+        # resource tracker, it is owned by the publishing process
+        return shared_memory.SharedMemory(name = name, track = False)
+    except TypeError:
+        return shared_memory.SharedMemory(name = name)
+
+def attach(ref):
+    """Map a published array in a worker. Returns the array and a release
+    function that has to be called when the array is no longer used"""
+    name, shape, dtype, persistent = ref.descriptor
+
+    if persistent and (name in _attached):
+        _attached.move_to_end(name)
+        return _attached[name][1], lambda: None
+
+    shm = _open(name)
+    a = np.ndarray(shape, dtype = np.dtype(dtype), buffer = shm.buf)
+    a.flags.writeable = False
+
+    if not persistent:
+        def release():
+            nonlocal a
+            del a
+            try:
+                shm.close()
+            except BufferError:
+                # Still referenced somewhere, the mapping is released when
+                # the last view is garbage collected
+                pass
+        return a, release
+
+    _attached[name] = (shm, a)
+    while len(_attached) > _CACHE_SIZE:
+        _, (oldshm, olda) = _attached.popitem(last = False)
+        del olda
+        try:
+            oldshm.close()
+        except BufferError:
+            pass
+    return a, lambda: None
+
+# Compact results
+# ===============
+
+def _factory_index(fun, factories):
+    ifac = fun._ifac
+    if (ifac is not None) and (ifac < len(factories)) and (factories[ifac]._fid == fun._fid):
+        return ifac
+    candidates = [ i for i, f in enumerate(factories) if f._fid == fun._fid ]
+    if len(candidates) == 0:
+        raise ValueError(f"No factory for function {fun._fid}")
+    for i in candidates:
+        if factories[i]._get_template() == fun._paramsd:
+            return i
+    return candidates[0]
+
+def pack_mixture(mixture, factories):
+    """Convert a fitted mixture into plain arrays
+
+    Every component is identified by the index of the factory that
+    produced it. Components that have not been created by a fitter with
+    these factories use the first factory with the same function id and
+    parameter template (limits). Parameter values and standard errors (NaN
+    when not available) are stored in the order of the parameter templates.
+    """
+    indices = np.empty((len(mixture._functions),), dtype = np.int32)
+    values = []
+    stderrs = []
+    for i, (fun, params) in enumerate(zip(mixture._functions, mixture._params)):
+        indices[i] = _factory_index(fun, factories)
+        for n in fun._pnames:
+            values.append(params[n].value)
+            stderrs.append(np.nan if params[n].stderr is None else params[n].stderr)
+    return (
+        indices,
+        np.asarray(values, dtype = np.float64),
+        np.asarray(stderrs, dtype = np.float64),
+        np.asarray(mixture._chis, dtype = np.float64),
+        int(mixture._nfev),
+        bool(mixture._budgetExhausted)
+    )
+
+def unpack_mixture(packed, factories):
+    """Rebuild a Mixture from the output of pack_mixture using the same
+    factories"""
+    indices, values, stderrs, chis, nfev, exhausted = packed
+
+    res = Mixture()
+    offset = 0
+    for i, ifac in enumerate(indices):
+        fun = factories[ifac](prefix = f"f{i}")
+        fun._ifac = int(ifac)
+        names = list(fun._pnames)
+        n = len(names)
+        params = fun.lmparams({ name : values[offset + k] for k, name in enumerate(names) })
+        for k, name in enumerate(names):
+            if not np.isnan(stderrs[offset + k]):
+                params[name].stderr = float(stderrs[offset + k])
+        offset = offset + n
+
+        res._functions.append(fun)
+        res._params.append(params)
+
+    res._chis = [ np.float64(c) for c in chis ]
+    res._nfev = nfev
+    res._budgetExhausted = exhausted
+    return res
+
+def fit_task(mixfit, x, data, weights = None, start = None, stop = None):
+    """Process pool task: fit data[start:stop] sampled at x[start:stop]
+    where x, data and weights are SharedArray references and return the
+    packed mixture"""
+    arrays = []
+    releases = []
+    try:
+        for ref in (x, data, weights):
+            if ref is None:
+                arrays.append(None)
+                continue
+            a, release = attach(ref)
+            releases.append(release)
+            arrays.append(a[start:stop])
+            a = None
+        res = mixfit.fit(arrays[0], arrays[1], weights = arrays[2])
+    finally:
+        # All views have to be gone before the blocks can be unmapped
+        arrays = None
+        for release in releases:
+            release()
+    return pack_mixture(res, mixfit._factories)
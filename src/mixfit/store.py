@@ -0,0 +1,262 @@
+"""SQLite backed store of fit results
+
+Every fitted component is stored as one row with its function id, the stage
+that added it, the chi^2 after that stage and one column per parameter
+value (v_<name>) and standard error (e_<name>). Stage and chi^2 are NULL
+for mixtures that have not been built one component per stage (warm
+started and stitched fits add several components in one stage). Parameter columns are added when
+a parameter name is seen for the first time and are indexed together with
+the function id, so range queries like
+
+    store.query(fid = "GAUSSIAN", mu = (100, 200), sigma = (None, 3))
+
+are answered from the indexes without touching the stored mixtures. Fits
+(one row per mixture) carry a free text source and their creation time.
+"""
+
+import sqlite3
+import time
+
+import numpy as np
+
+def mixture_record(mixture):
+    """JSON serializable description of a fitted mixture"""
+    components = []
+    for fun, params in zip(mixture._functions, mixture._params):
+        components.append({
+            "fid" : fun._fid,
+            "params" : { fun._pnames[n] : { "value" : float(p.value), "stderr" : None if p.stderr is None else float(p.stderr) } for n, p in params.items() }
+        })
+    return {
+        "components" : components,
+        "chis" : [ float(c) for c in mixture._chis ],
+        "nfev" : int(mixture._nfev),
+        "budgetExhausted" : bool(mixture._budgetExhausted)
+    }
+
+_FIXED = ("fit_id", "idx", "fid", "stage", "chisqr")
+
+def _component_stages(chis, ncomponents):
+    # Stage index of every component or None where it is not known. Greedy
+    # fits add one component per stage with a strictly decreasing chi^2,
+    # stages that add several components (warm starts, stitching) repeat
+    # their chi^2 once per component
+    if (len(chis) != ncomponents) or any([ not (b < a) for a, b in zip(chis[:-1], chis[1:]) ]):
+        return [ None ] * ncomponents
+    return list(range(ncomponents))
+
+class ResultStore:
+    def __init__(self, path = ":memory:", *, indexParams = None):
+        """Open (or create) a result store
+
+        Parameters
+        ----------
+
+        path: str, optional
+            SQLite database file. By default an in memory database is used
+        indexParams: list, optional
+            Names of the parameters that are indexed (together with the
+            function id). By default every parameter column is indexed
+        """
+        self._db = sqlite3.connect(path)
+        self._db.execute("PRAGMA journal_mode = WAL")
+        self._db.execute("PRAGMA synchronous = NORMAL")
+        self._indexParams = None if indexParams is None else set(indexParams)
+
+        with self._db:
+            self._db.execute("CREATE TABLE IF NOT EXISTS fits (fit_id INTEGER PRIMARY KEY, source TEXT, created REAL, ncomponents INTEGER, chisqr REAL, nfev INTEGER, budget_exhausted INTEGER)")
+            self._db.execute("CREATE TABLE IF NOT EXISTS components (fit_id INTEGER NOT NULL REFERENCES fits(fit_id), idx INTEGER NOT NULL, fid TEXT NOT NULL, stage INTEGER, chisqr REAL, PRIMARY KEY (fit_id, idx))")
+            self._db.execute("CREATE INDEX IF NOT EXISTS fits_source ON fits (source)")
+            self._db.execute("CREATE INDEX IF NOT EXISTS fits_created ON fits (created)")
+            self._db.execute("CREATE INDEX IF NOT EXISTS components_fid ON components (fid)")
+
+        self._pcolumns = [ r[1][2:] for r in self._db.execute("PRAGMA table_info(components)") if r[1].startswith("v_") ]
+
+    def close(self):
+        self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def parameters(self):
+        """Names of all parameters that have columns in the store"""
+        return list(self._pcolumns)
+
+    def _ensure_columns(self, names):
+        for n in names:
+            if n in self._pcolumns:
+                continue
+            if not n.isidentifier():
+                raise ValueError(f"Parameter name {n} cannot be stored")
+            self._db.execute(f'ALTER TABLE components ADD COLUMN "v_{n}" REAL')
+            self._db.execute(f'ALTER TABLE components ADD COLUMN "e_{n}" REAL')
+            if (self._indexParams is None) or (n in self._indexParams):
+                self._db.execute(f'CREATE INDEX IF NOT EXISTS "components_{n}" ON components (fid, "v_{n}")')
+            self._pcolumns.append(n)
+
+    def add(self, mixture, *, source = None, created = None, replace = False):
+        """Store a single Mixture (or a record as written by mixture_record)
+        and return its fit id"""
+        return self.add_many([ mixture ], sources = [ source ], created = created, replace = replace)[0]
+
+    def add_many(self, mixtures, *, sources = None, created = None, replace = False):
+        """Store many mixtures in a single transaction
+
+        Parameters
+        ----------
+
+        mixtures: list
+            Mixture objects or records as written by mixture_record (and the
+            mixfit command line tool)
+        sources: list, optional
+            One source description per mixture (for example file and array)
+        created: float, optional
+            Creation time (seconds since the epoch), defaults to now
+        replace: bool, optional
+            Delete previously stored fits with the same source
+
+        Returns
+        -------
+
+        The list of fit ids
+        """
+        if sources is None:
+            sources = [ None ] * len(mixtures)
+        if len(sources) != len(mixtures):
+            raise ValueError("One source is required per mixture")
+        if created is None:
+            created = time.time()
+
+        records = [ m if isinstance(m, dict) else mixture_record(m) for m in mixtures ]
+        names = []
+        for rec in records:
+            for comp in rec["components"]:
+                for n in comp["params"]:
+                    if n not in names:
+                        names.append(n)
+
+        fitIds = []
+        with self._db:
+            self._ensure_columns(names)
+            if replace:
+                old = [ (s,) for s in set(sources) if s is not None ]
+                self._db.executemany("DELETE FROM components WHERE fit_id IN (SELECT fit_id FROM fits WHERE source = ?)", old)
+                self._db.executemany("DELETE FROM fits WHERE source = ?", old)
+
+            rows = {}
+            for rec, source in zip(records, sources):
+                chis = rec["chis"]
+                cur = self._db.execute(
+                    "INSERT INTO fits (source, created, ncomponents, chisqr, nfev, budget_exhausted) VALUES (?, ?, ?, ?, ?, ?)",
+                    (source, created, len(rec["components"]), chis[-1] if len(chis) > 0 else None, rec["nfev"], int(rec["budgetExhausted"]))
+                )
+                fitId = cur.lastrowid
+                fitIds.append(fitId)
+
+                # Components are grouped by their parameter names so every
+                # group is inserted by a single executemany
+                stages = _component_stages(chis, len(rec["components"]))
+                for idx, (comp, stage) in enumerate(zip(rec["components"], stages)):
+                    pnames = tuple(comp["params"])
+                    row = [ fitId, idx, comp["fid"], stage, None if stage is None else chis[stage] ]
+                    for n in pnames:
+                        row.append(comp["params"][n]["value"])
+                        row.append(comp["params"][n]["stderr"])
+                    rows.setdefault(pnames, []).append(row)
+
+            for pnames, prows in rows.items():
+                cols = list(_FIXED) + [ f'"{p}{n}"' for n in pnames for p in ("v_", "e_") ]
+                self._db.executemany(f"INSERT INTO components ({', '.join(cols)}) VALUES ({', '.join(['?'] * len(cols))})", prows)
+
+        return fitIds
+
+    def query(self, *, fid = None, source = None, since = None, until = None, fitIds = None, **ranges):
+        """Select components by function id, fit source, creation time and
+        parameter ranges
+
+        Parameter ranges are given as keyword arguments name = (min, max)
+        (inclusive, None for an open end). Returns a dictionary of NumPy
+        arrays (one per column): fit_id, idx, fid, stage (-1 if not known),
+        chisqr (NaN if not known), source, created and for every parameter
+        its value (name) and standard error (name_stderr, NaN if not
+        available)
+        """
+        where = []
+        args = []
+        if fid is not None:
+            if isinstance(fid, str):
+                where.append("c.fid = ?")
+                args.append(fid)
+            else:
+                where.append(f"c.fid IN ({', '.join(['?'] * len(fid))})")
+                args = args + list(fid)
+        for n, (lo, hi) in ranges.items():
+            if n not in self._pcolumns:
+                raise ValueError(f"Unknown parameter {n}")
+            if lo is not None:
+                where.append(f'c."v_{n}" >= ?')
+                args.append(lo)
+            if hi is not None:
+                where.append(f'c."v_{n}" <= ?')
+                args.append(hi)
+        if source is not None:
+            where.append("f.source = ?")
+            args.append(source)
+        if since is not None:
+            where.append("f.created >= ?")
+            args.append(since)
+        if until is not None:
+            where.append("f.created <= ?")
+            args.append(until)
+        if fitIds is not None:
+            where.append(f"c.fit_id IN ({', '.join(['?'] * len(fitIds))})")
+            args = args + list(fitIds)
+
+        cols = [ f"c.{c}" for c in _FIXED ] + [ "f.source", "f.created" ] + [ f'c."{p}{n}"' for n in self._pcolumns for p in ("v_", "e_") ]
+        sql = f"SELECT {', '.join(cols)} FROM components c JOIN fits f ON f.fit_id = c.fit_id"
+        if len(where) > 0:
+            sql = sql + " WHERE " + " AND ".join(where)
+        sql = sql + " ORDER BY c.fit_id, c.idx"
+        rows = self._db.execute(sql, args).fetchall()
+
+        res = {}
+        columns = list(zip(*rows)) if len(rows) > 0 else [ () ] * len(cols)
+        res["fit_id"] = np.asarray(columns[0], dtype = np.int64)
+        res["idx"] = np.asarray(columns[1], dtype = np.int64)
+        res["fid"] = np.asarray(columns[2], dtype = object)
+        res["stage"] = np.asarray([ -1 if st is None else st for st in columns[3] ], dtype = np.int64)
+        res["chisqr"] = np.asarray(columns[4], dtype = np.float64)
+        res["source"] = np.asarray(columns[5], dtype = object)
+        res["created"] = np.asarray(columns[6], dtype = np.float64)
+        for i, n in enumerate(self._pcolumns):
+            # None (no such parameter or no stderr) becomes NaN
+            res[n] = np.asarray(columns[7 + 2*i], dtype = np.float64)
+            res[f"{n}_stderr"] = np.asarray(columns[8 + 2*i], dtype = np.float64)
+        return res
+
+    def fits(self, *, source = None, since = None, until = None):
+        """List stored fits as a dictionary of NumPy arrays (fit_id, source,
+        created, ncomponents, chisqr, nfev, budget_exhausted)"""
+        where = []
+        args = []
+        for cond, val in (("source = ?", source), ("created >= ?", since), ("created <= ?", until)):
+            if val is not None:
+                where.append(cond)
+                args.append(val)
+        sql = "SELECT fit_id, source, created, ncomponents, chisqr, nfev, budget_exhausted FROM fits"
+        if len(where) > 0:
+            sql = sql + " WHERE " + " AND ".join(where)
+        rows = self._db.execute(sql + " ORDER BY fit_id", args).fetchall()
+        columns = list(zip(*rows)) if len(rows) > 0 else [ () ] * 7
+        return {
+            "fit_id" : np.asarray(columns[0], dtype = np.int64),
+            "source" : np.asarray(columns[1], dtype = object),
+            "created" : np.asarray(columns[2], dtype = np.float64),
+            "ncomponents" : np.asarray(columns[3], dtype = np.int64),
+            "chisqr" : np.asarray(columns[4], dtype = np.float64),
+            "nfev" : np.asarray(columns[5], dtype = np.int64),
+            "budget_exhausted" : np.asarray(columns[6], dtype = bool)
+        }
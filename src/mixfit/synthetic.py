@@ -0,0 +1,247 @@
+"""Synthetic spectra with known ground truth
+
+Generates batches of random mixtures of the built in peak shapes (on a
+common x grid) for load, scaling and accuracy tests. All random numbers of
+a batch are drawn at once and every shape is evaluated for all of its
+components of the whole batch in one broadcast kernel call (in blocks that
+bound the memory of temporaries), the per spectrum sums are formed with
+np.add.reduceat.
+
+    batch = generate(1000, np.linspace(0, 1000, 100000), components = (5, 20), seed = 1)
+    res = Mixfit().fit(batch.x, batch.data[0])
+    print(batch.truth(0), batch.recovered(0, res))
+"""
+
+import numpy as np
+
+from mixfitfunctions import kernels, registry
+
+PEAKS = ("GAUSSIAN", "CAUCHY", "DIFFGAUSSIAN", "DIFFERENTIALCAUCHY")
+
+# Upper bound of the number of elements of temporaries during evaluation
+_BLOCK_ELEMENTS = 1 << 22
+
+def _range(v, name):
+    if np.isscalar(v):
+        return float(v), float(v)
+    if len(v) != 2:
+        raise ValueError(f"{name} has to be a value or a (min, max) pair")
+    if v[0] > v[1]:
+        raise ValueError(f"{name} range is not valid, minimum larger than maximum")
+    return float(v[0]), float(v[1])
+
+class SyntheticBatch:
+    """A batch of synthetic spectra and their ground truth
+
+    Attributes
+    ----------
+
+    x: ndarray
+        Common sample positions
+    data: ndarray
+        Spectra, shape (number of spectra, len(x))
+    fids: tuple
+        Function ids of the shapes used
+    shapes: ndarray
+        Index into fids for every component slot (-1 for unused slots),
+        shape (number of spectra, maximum number of components)
+    params: ndarray
+        Amplitude, center and width of every component slot, shape
+        (number of spectra, maximum number of components, 3)
+    ncomponents: ndarray
+        Number of components per spectrum
+    offset: ndarray
+        Constant baseline per spectrum
+    noise: ndarray
+        Standard deviation of the added Gaussian noise per spectrum
+    """
+    def __init__(self, x, data, fids, shapes, params, ncomponents, offset, noise):
+        self.x = x
+        self.data = data
+        self.fids = fids
+        self.shapes = shapes
+        self.params = params
+        self.ncomponents = ncomponents
+        self.offset = offset
+        self.noise = noise
+
+        self._names = {}
+        for fid in fids:
+            self._names[fid] = registry.create(fid)()._kernel_names
+
+    def __len__(self):
+        return len(self.data)
+
+    def truth(self, i):
+        """Components of spectrum i sorted by center, with the parameters
+        named like the parameters of the corresponding functions. The
+        baseline is not distributed to the components"""
+        res = []
+        for j in np.argsort(self.params[i,:,1]):
+            if self.shapes[i,j] < 0:
+                continue
+            fid = self.fids[self.shapes[i,j]]
+            names = self._names[fid]
+            p = { names[0] : self.params[i,j,0], names[1] : self.params[i,j,1], names[2] : self.params[i,j,2] }
+            if names[3] is not None:
+                p[names[3]] = 0.0
+            res.append({ "fid" : fid, "params" : p })
+        return res
+
+    def recovered(self, i, mixture, tolerance = 0.5):
+        """Check which true components of spectrum i have been found
+
+        A true component counts as recovered when the mixture contains a
+        component of the same function id whose center is closer than
+        tolerance times the true width. Returns a boolean array in the
+        order of truth(i)
+        """
+        found = []
+        for fun, params in zip(mixture._functions, mixture._params):
+            if (fun._kernel_names is None) or (fun._kernel_pnames[1] is None):
+                continue
+            found.append((fun._fid, params[fun._kernel_pnames[1]].value))
+
+        res = []
+        for comp in self.truth(i):
+            names = self._names[comp["fid"]]
+            c, w = comp["params"][names[1]], comp["params"][names[2]]
+            res.append(any([ (fid == comp["fid"]) and (abs(fc - c) < tolerance * w) for fid, fc in found ]))
+        return np.asarray(res, dtype = bool)
+
+def generate(
+    nSpectra,
+    x = None,
+    *,
+    components = (1, 5),
+    shapes = PEAKS,
+    amplitude = (0.1, 1.0),
+    width = None,
+    separation = None,
+    offset = 0.0,
+    noise = 0.01,
+    seed = None,
+    dtype = np.float64
+):
+    """Generate a batch of random mixtures
+
+    Parameters
+    ----------
+
+    nSpectra: int
+        Number of spectra
+    x: ndarray, optional
+        Common sample positions, by default 1000 points in [0, 1000]
+    components: int or (min, max), optional
+        Number of components per spectrum (inclusive range)
+    shapes: list, optional
+        Function ids of the peak shapes to draw from (Gaussian, Cauchy and
+        their derivatives)
+    amplitude: float or (min, max), optional
+        Range of the amplitudes. Use a negative minimum for dips
+    width: float or (min, max), optional
+        Range of the widths (drawn log uniformly). Defaults to 2 to 20 grid
+        steps
+    separation: float, optional
+        Minimum distance of neighbouring centers in units of the sum of
+        their widths. When not set centers are uniformly distributed and
+        may overlap arbitrarily
+    offset: float or (min, max), optional
+        Constant baseline of every spectrum
+    noise: float or (min, max), optional
+        Standard deviation of the added white Gaussian noise
+    seed: int or numpy.random.SeedSequence, optional
+        Seed of the random generator, the same seed reproduces the batch
+    dtype: numpy dtype, optional
+        Data type of the spectra (float32 halves the memory of large
+        batches)
+
+    Returns
+    -------
+
+    A SyntheticBatch
+    """
+    if (int(nSpectra) != nSpectra) or (nSpectra < 1):
+        raise ValueError("Number of spectra has to be a positive integer")
+    if x is None:
+        x = np.linspace(0, 1000, 1000)
+    x = np.asarray(x, dtype = np.float64)
+    if (x.ndim != 1) or (len(x) < 2):
+        raise ValueError("x has to be a one dimensional array of at least two samples")
+    cmin, cmax = _range(components, "Number of components")
+    cmin, cmax = int(cmin), int(cmax)
+    if cmin < 0:
+        raise ValueError("Number of components cannot be negative")
+    fids = tuple(shapes)
+    kshapes = []
+    for fid in fids:
+        fun = registry.create(fid)()
+        if (fun._kernel is None) or (fun._kernel_names[1] is None) or (fun._kernel_names[2] is None):
+            raise ValueError(f"Function {fid} is not a peak shape")
+        kshapes.append(fun._kernel)
+    amin, amax = _range(amplitude, "Amplitude")
+    xmin, xmax = np.min(x), np.max(x)
+    step = (xmax - xmin) / (len(x) - 1)
+    if width is None:
+        width = (2 * step, 20 * step)
+    wmin, wmax = _range(width, "Width")
+    if wmin <= 0:
+        raise ValueError("Widths have to be positive")
+    omin, omax = _range(offset, "Offset")
+    nmin, nmax = _range(noise, "Noise")
+    if nmin < 0:
+        raise ValueError("Noise cannot be negative")
+
+    rng = np.random.default_rng(seed)
+    nS = int(nSpectra)
+
+    # Ground truth of all spectra
+    # ===========================
+
+    ncomp = rng.integers(cmin, cmax + 1, nS)
+    active = np.arange(cmax)[np.newaxis,:] < ncomp[:,np.newaxis]
+    shapeIdx = rng.integers(0, len(fids), (nS, cmax))
+    shapeIdx[~active] = -1
+    params = np.empty((nS, cmax, 3))
+    params[:,:,0] = rng.uniform(amin, amax, (nS, cmax))
+    params[:,:,2] = np.exp(rng.uniform(np.log(wmin), np.log(wmax), (nS, cmax)))
+
+    if separation is None:
+        params[:,:,1] = rng.uniform(xmin, xmax, (nS, cmax))
+    else:
+        # Minimum gaps between neighbours plus randomly distributed slack
+        # (exponential spacings normalized to the free length)
+        w = np.where(active, params[:,:,2], 0.0)
+        gaps = np.zeros((nS, cmax))
+        gaps[:,1:] = np.where(active[:,1:], separation * (w[:,:-1] + w[:,1:]), 0.0)
+        slack = (xmax - xmin) - np.sum(gaps, axis = 1)
+        if np.any(slack < 0):
+            raise ValueError("Components do not fit into the x range with the requested separation")
+        e = rng.exponential(size = (nS, cmax + 1))
+        e[:,:-1][~active] = 0.0
+        e = e / np.sum(e, axis = 1)[:,np.newaxis]
+        params[:,:,1] = xmin + np.cumsum(gaps + e[:,:-1] * slack[:,np.newaxis], axis = 1)
+    params[~active] = np.nan
+
+    offs = rng.uniform(omin, omax, nS)
+    sigma = rng.uniform(nmin, nmax, nS)
+
+    # Spectra
+    # =======
+
+    data = rng.standard_normal((nS, len(x)), dtype = np.float64 if np.dtype(dtype) == np.float64 else np.float32)
+    data *= sigma.astype(data.dtype)[:,np.newaxis]
+    data += offs.astype(data.dtype)[:,np.newaxis]
+
+    block = max(1, _BLOCK_ELEMENTS // len(x))
+    xb = x[np.newaxis,:]
+    for ishape, kshape in enumerate(kshapes):
+        rows, cols = np.nonzero(shapeIdx == ishape)
+        for b in range(0, len(rows), block):
+            r, c = rows[b:b+block], cols[b:b+block]
+            vals = kernels.evaluate(kshape, xb, params[r,c,0][:,np.newaxis], params[r,c,1][:,np.newaxis], params[r,c,2][:,np.newaxis], 0.0)
+            # rows are sorted, sum all components of a spectrum at once
+            urows, starts = np.unique(r, return_index = True)
+            data[urows] += np.add.reduceat(vals, starts, axis = 0).astype(data.dtype, copy = False)
+
+    return SyntheticBatch(x, data.astype(dtype, copy = False), fids, shapeIdx, params, ncomp, offs, sigma)
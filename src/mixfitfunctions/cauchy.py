@@ -1,4 +1,5 @@
 from mixfitfunctions.mixfitfunction import MixfitFunction, MixfitFunctionFactory
+from mixfitfunctions import kernels
 
 import numpy as np
 
@@ -21,9 +22,12 @@ class MixfitFunctionCauchyFactory(MixfitFunctionFactory):
             self._limits = None
 
     def __call__(self, *args, **kwargs):
-        return MixfitFunctionCauchy(*args, limits = self._limits, **kwargs)
+        return MixfitFunctionCauchy(*args, limits = self._limits, template = self._get_template(), **kwargs)
 
 class MixfitFunctionCauchy(MixfitFunction):
+    _kernel = kernels.CAUCHY
+    _kernel_names = ("amp", "x0", "gamma", "offset")
+
     def __init__(self, *args, **kwargs):
         super().__init__(
             "CAUCHY",
@@ -64,11 +68,7 @@ class MixfitFunctionCauchy(MixfitFunction):
 
     def __call__(self, pars, x, *, data = None):
         amp, x0, gamma, offs = self._parse_pparms(pars)
-        val = amp * gamma / np.pi * 1.0 / ((x - x0)**2.0 + gamma**2.0) + offs
-        if data is None:
-            return val
-        else:
-            return data - val
+        return kernels.evaluate(kernels.CAUCHY, x, amp, x0, gamma, offs, data = data)
 
     def guess(self, x, data):
         pfx = ""
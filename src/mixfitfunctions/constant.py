@@ -1,4 +1,5 @@
 from mixfitfunctions.mixfitfunction import MixfitFunction, MixfitFunctionFactory
+from mixfitfunctions import kernels
 
 import numpy as np
 
@@ -18,9 +19,12 @@ class MixfitFunctionConstantFactory(MixfitFunctionFactory):
             self._limits = None
 
     def __call__(self, *args, **kwargs):
-        return MixfitFunctionConstant(*args, limits = self._limits, **kwargs)
+        return MixfitFunctionConstant(*args, limits = self._limits, template = self._get_template(), **kwargs)
 
 class MixfitFunctionConstant(MixfitFunction):
+    _kernel = kernels.CONSTANT
+    _kernel_names = (None, None, None, "offset")
+
     def __init__(self, *args, **kwargs):
         super().__init__(
             "CONSTANT",
@@ -52,11 +56,7 @@ class MixfitFunctionConstant(MixfitFunction):
 
     def __call__(self, pars, x, *, data = None):
         offs = self._parse_pparms(pars)
-        val = np.full((len(x),), offs)
-        if data is None:
-            return val
-        else:
-            return data - val
+        return kernels.evaluate(kernels.CONSTANT, x, 0, 0, 0, offs, data = data)
 
     def guess(self, x, data):
         pfx = ""
@@ -1,4 +1,5 @@
 from mixfitfunctions.mixfitfunction import MixfitFunction, MixfitFunctionFactory
+from mixfitfunctions import kernels
 
 import numpy as np
 
@@ -21,9 +22,12 @@ class MixfitFunctionDifferentialGaussianFactory(MixfitFunctionFactory):
             self._limits = None
 
     def __call__(self, *args, **kwargs):
-        return MixfitFunctionDifferentialGaussian(*args, limits = self._limits, **kwargs)
+        return MixfitFunctionDifferentialGaussian(*args, limits = self._limits, template = self._get_template(), **kwargs)
 
 class MixfitFunctionDifferentialGaussian(MixfitFunction):
+    _kernel = kernels.DIFFGAUSSIAN
+    _kernel_names = ("amp", "mu", "sigma", "offset")
+
     def __init__(self, *args, **kwargs):
         super().__init__(
             "DIFFGAUSSIAN",
@@ -64,11 +68,7 @@ class MixfitFunctionDifferentialGaussian(MixfitFunction):
 
     def __call__(self, pars, x, *, data = None):
         amp, mu, sig, offs = self._parse_pparms(pars)
-        val = -1.0 * amp / sig * (x - mu) / sig * np.exp(-0.5 * np.power((x - mu) / sig, 2)) + offs
-        if data is None:
-            return val
-        else:
-            return data - val
+        return kernels.evaluate(kernels.DIFFGAUSSIAN, x, amp, mu, sig, offs, data = data)
 
     def guess(self, x, data):
         pfx = ""
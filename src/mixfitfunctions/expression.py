@@ -0,0 +1,436 @@
+"""Line shapes defined by a formula
+
+A shape is described by a formula string in the variable x and the
+parameters, for example
+
+    factory = ExpressionFunctionFactory(
+        "SECH2",
+        "Squared hyperbolic secant",
+        "Squared hyperbolic secant line",
+        "amp / cosh((x - x0) / w)**2 + offset",
+        [
+            { "name" : "amp", "desc" : "Amplitude", "init" : 1 },
+            { "name" : "x0", "desc" : "Center" },
+            { "name" : "w", "desc" : "Width", "init" : 1 },
+            { "name" : "offset", "desc" : "Constant offset", "init" : 0 }
+        ]
+    )
+
+The formula is parsed and validated once, the derivatives with respect to
+all parameters are derived symbolically and both are compiled into
+vectorized NumPy functions (with common subexpressions shared between the
+model and all derivatives) so evaluating the shape does not interpret the
+formula again.
+
+Supported are numbers, + - * / ** and the functions listed in FUNCTIONS.
+The constants pi and e can be used by name.
+"""
+
+import ast
+
+import numpy as np
+
+from mixfitfunctions.mixfitfunction import MixfitFunction, MixfitFunctionFactory
+
+FUNCTIONS = ("exp", "log", "sqrt", "sin", "cos", "tan", "arctan", "sinh", "cosh", "tanh", "abs")
+CONSTANTS = { "pi" : np.pi, "e" : np.e }
+
+# Expression trees
+# ================
+#
+# Nodes are nested tuples so they can be hashed and compared which is used
+# to share common subexpressions: ("num", value), ("x",), ("par", index),
+# ("add", a, b), ("sub", a, b), ("mul", a, b), ("div", a, b), ("pow", a, b),
+# ("neg", a) and ("call", name, a)
+
+_ZERO = ("num", 0.0)
+_ONE = ("num", 1.0)
+
+def _isnum(a, v = None):
+    return (a[0] == "num") and ((v is None) or (a[1] == v))
+
+def _add(a, b):
+    if _isnum(a) and _isnum(b):
+        return ("num", a[1] + b[1])
+    if _isnum(a, 0):
+        return b
+    if _isnum(b, 0):
+        return a
+    return ("add", a, b)
+
+def _sub(a, b):
+    if _isnum(a) and _isnum(b):
+        return ("num", a[1] - b[1])
+    if _isnum(b, 0):
+        return a
+    if _isnum(a, 0):
+        return _neg(b)
+    if a == b:
+        return _ZERO
+    return ("sub", a, b)
+
+def _mul(a, b):
+    if _isnum(a) and _isnum(b):
+        return ("num", a[1] * b[1])
+    if _isnum(a, 0) or _isnum(b, 0):
+        return _ZERO
+    if _isnum(a, 1):
+        return b
+    if _isnum(b, 1):
+        return a
+    if _isnum(a, -1):
+        return _neg(b)
+    if _isnum(b, -1):
+        return _neg(a)
+    return ("mul", a, b)
+
+def _div(a, b):
+    if _isnum(b, 1):
+        return a
+    if _isnum(a, 0) and not _isnum(b, 0):
+        return _ZERO
+    if _isnum(a) and _isnum(b) and (b[1] != 0):
+        return ("num", a[1] / b[1])
+    return ("div", a, b)
+
+def _pow(a, b):
+    if _isnum(b, 0):
+        return _ONE
+    if _isnum(b, 1):
+        return a
+    if _isnum(a) and _isnum(b):
+        return ("num", a[1] ** b[1])
+    return ("pow", a, b)
+
+def _neg(a):
+    if _isnum(a):
+        return ("num", -a[1])
+    if a[0] == "neg":
+        return a[1]
+    return ("neg", a)
+
+def _call(name, a):
+    return ("call", name, a)
+
+def _parse(expression, names):
+    """Parse the formula into an expression tree, names are the parameter
+    names in descriptor order"""
+    try:
+        tree = ast.parse(expression.strip(), mode = "eval")
+    except SyntaxError as e:
+        raise ValueError(f"Invalid expression {expression}: {e.msg}")
+
+    binops = { ast.Add : _add, ast.Sub : _sub, ast.Mult : _mul, ast.Div : _div, ast.Pow : _pow }
+
+    def conv(node):
+        if isinstance(node, ast.Constant):
+            if isinstance(node.value, bool) or not isinstance(node.value, (int, float)):
+                raise ValueError(f"Unsupported constant {node.value!r} in expression")
+            return ("num", float(node.value))
+        if isinstance(node, ast.Name):
+            if node.id == "x":
+                return ("x",)
+            if node.id in names:
+                return ("par", names.index(node.id))
+            if node.id in CONSTANTS:
+                return ("num", float(CONSTANTS[node.id]))
+            raise ValueError(f"Unknown name {node.id} in expression")
+        if isinstance(node, ast.BinOp):
+            if type(node.op) not in binops:
+                raise ValueError(f"Unsupported operator {type(node.op).__name__} in expression")
+            return binops[type(node.op)](conv(node.left), conv(node.right))
+        if isinstance(node, ast.UnaryOp):
+            if isinstance(node.op, ast.USub):
+                return _neg(conv(node.operand))
+            if isinstance(node.op, ast.UAdd):
+                return conv(node.operand)
+            raise ValueError(f"Unsupported operator {type(node.op).__name__} in expression")
+        if isinstance(node, ast.Call):
+            if (not isinstance(node.func, ast.Name)) or (node.func.id not in FUNCTIONS):
+                raise ValueError(f"Unsupported function in expression, supported are {', '.join(FUNCTIONS)}")
+            if (len(node.args) != 1) or (len(node.keywords) != 0):
+                raise ValueError(f"Function {node.func.id} takes exactly one argument")
+            return _call(node.func.id, conv(node.args[0]))
+        raise ValueError(f"Unsupported syntax {type(node).__name__} in expression")
+
+    return conv(tree.body)
+
+def _derive(a, ip):
+    """Derivative of the expression tree a with respect to parameter ip"""
+    kind = a[0]
+    if kind in ("num", "x"):
+        return _ZERO
+    if kind == "par":
+        return _ONE if a[1] == ip else _ZERO
+    if kind == "neg":
+        return _neg(_derive(a[1], ip))
+    if kind in ("add", "sub"):
+        da, db = _derive(a[1], ip), _derive(a[2], ip)
+        return _add(da, db) if kind == "add" else _sub(da, db)
+    if kind == "mul":
+        return _add(_mul(_derive(a[1], ip), a[2]), _mul(a[1], _derive(a[2], ip)))
+    if kind == "div":
+        da, db = _derive(a[1], ip), _derive(a[2], ip)
+        if _isnum(db, 0):
+            return _div(da, a[2])
+        return _div(_sub(_mul(da, a[2]), _mul(a[1], db)), _pow(a[2], ("num", 2.0)))
+    if kind == "pow":
+        base, ex = a[1], a[2]
+        db, de = _derive(base, ip), _derive(ex, ip)
+        res = _ZERO
+        if not _isnum(db, 0):
+            res = _mul(_mul(ex, _pow(base, _sub(ex, _ONE))), db)
+        if not _isnum(de, 0):
+            res = _add(res, _mul(_mul(a, _call("log", base)), de))
+        return res
+    if kind == "call":
+        name, u = a[1], a[2]
+        du = _derive(u, ip)
+        if _isnum(du, 0):
+            return _ZERO
+        if name == "exp":
+            outer = a
+        elif name == "log":
+            return _div(du, u)
+        elif name == "sqrt":
+            return _div(du, _mul(("num", 2.0), a))
+        elif name == "sin":
+            outer = _call("cos", u)
+        elif name == "cos":
+            outer = _neg(_call("sin", u))
+        elif name == "tan":
+            outer = _div(_ONE, _pow(_call("cos", u), ("num", 2.0)))
+        elif name == "arctan":
+            return _div(du, _add(_ONE, _pow(u, ("num", 2.0))))
+        elif name == "sinh":
+            outer = _call("cosh", u)
+        elif name == "cosh":
+            outer = _call("sinh", u)
+        elif name == "tanh":
+            outer = _sub(_ONE, _pow(a, ("num", 2.0)))
+        elif name == "abs":
+            outer = _call("sign", u)
+        return _mul(outer, du)
+    raise ValueError(f"Cannot derive {kind}")
+
+def _depends_on_x(a):
+    if a[0] == "x":
+        return True
+    return any([ _depends_on_x(c) for c in a[1:] if isinstance(c, tuple) ])
+
+# Code generation
+# ===============
+
+_OPS = { "add" : "+", "sub" : "-", "mul" : "*", "div" : "/", "pow" : "**" }
+
+def _codegen(outputs):
+    """Generate statements computing all output trees. Subexpressions that
+    occur more than once are computed only once into temporaries. Returns
+    the statements and the code of every output"""
+    counts = {}
+    def count(a):
+        if a[0] in ("num", "x", "par"):
+            return
+        counts[a] = counts.get(a, 0) + 1
+        if counts[a] == 1:
+            for c in a[1:]:
+                if isinstance(c, tuple):
+                    count(c)
+    for o in outputs:
+        count(o)
+
+    lines = []
+    temps = {}
+    def gen(a):
+        kind = a[0]
+        if kind == "num":
+            return repr(a[1])
+        if kind == "x":
+            return "x"
+        if kind == "par":
+            return f"p{a[1]}"
+        if a in temps:
+            return temps[a]
+        if kind == "neg":
+            code = f"(-{gen(a[1])})"
+        elif kind == "call":
+            code = f"np.{a[1]}({gen(a[2])})"
+        else:
+            code = f"({gen(a[1])} {_OPS[kind]} {gen(a[2])})"
+        if counts.get(a, 0) > 1:
+            temps[a] = f"t{len(temps)}"
+            lines.append(f"    {temps[a]} = {code}")
+            return temps[a]
+        return code
+
+    return lines, [ gen(o) for o in outputs ]
+
+_compiled = {}
+
+class _ExpressionDefinition:
+    """Parsed formula with its compiled model, residual and jacobian. Only
+    the formula and the parameter names are pickled, the code is generated
+    again (once per process) when unpickling"""
+
+    def __init__(self, expression, names):
+        if not isinstance(expression, str):
+            raise ValueError("Expression has to be a string")
+        names = tuple(names)
+        for n in names:
+            if (not n.isidentifier()) or (n == "x") or (n in CONSTANTS) or (n in FUNCTIONS):
+                raise ValueError(f"Parameter name {n} cannot be used in expressions")
+
+        self.expression = expression
+        self.names = names
+
+        key = (expression, names)
+        if key not in _compiled:
+            _compiled[key] = self._compile()
+        self.model, self.residual, self.jacobian = _compiled[key]
+
+    def _compile(self):
+        tree = _parse(self.expression, list(self.names))
+        derivatives = [ _derive(tree, ip) for ip in range(len(self.names)) ]
+        args = ", ".join([ "x" ] + [ f"p{i}" for i in range(len(self.names)) ])
+
+        src = []
+        lines, (code,) = _codegen([ tree ])
+        if not _depends_on_x(tree):
+            code = f"np.full(np.shape(x), {code})"
+        src = src + [ f"def model({args}):" ] + lines + [ f"    return {code}" ]
+        src = src + [ f"def residual(data, {args}):" ] + lines + [ f"    return data - {code}" ]
+
+        lines, codes = _codegen(derivatives)
+        src = src + [ f"def jacobian({args}):", "    out = np.empty((len(x), " + str(len(self.names)) + "))" ] + lines
+        for ip, c in enumerate(codes):
+            src.append(f"    out[:,{ip}] = {c}")
+        src.append("    return out")
+
+        namespace = { "np" : np }
+        exec(compile("\n".join(src), f"<mixfit expression {self.expression}>", "exec"), namespace)
+        return namespace["model"], namespace["residual"], namespace["jacobian"]
+
+    def __reduce__(self):
+        return (_ExpressionDefinition, (self.expression, self.names))
+
+def _check_descriptors(params):
+    if not isinstance(params, list):
+        raise ValueError("Parameter descriptors have to be a list of dictionaries")
+    for p in params:
+        if not isinstance(p, dict):
+            raise ValueError("Each parameter has to be described by a dictionary")
+        if ("name" not in p) or ("desc" not in p):
+            raise ValueError("Name and description are required for each parameter")
+
+class ExpressionFunctionFactory(MixfitFunctionFactory):
+    def __init__(
+        self,
+        fid,
+        title,
+        description,
+        expression,
+        params,
+        *,
+        guess = None,
+        limits = None
+    ):
+        """Create a factory for a shape defined by a formula
+
+        Parameters
+        ----------
+
+        fid: str
+            The function ID
+        title: str
+            A human readable title of the function
+        description: str
+            A human readable description of the function
+        expression: str
+            Formula in x and the parameter names
+        params: list
+            Parameter descriptors as for all other functions. An optional
+            "init" entry specifies the initial value used by the default
+            guess (1 if not specified)
+        guess: callable, optional
+            guess(x, data) returning a dictionary of initial values by
+            (unprefixed) parameter name. Has to be a module level function
+            in case the fitter is used with process pools
+        limits: dict, optional
+            Limits of the parameters
+        """
+        _check_descriptors(params)
+        super().__init__(fid, title, description, params)
+        if (guess is not None) and (not callable(guess)):
+            raise ValueError("Guess has to be callable")
+
+        self._definition = _ExpressionDefinition(expression, [ p["name"] for p in params ])
+        self._guess = guess
+        self._limits = limits
+
+    def __call__(self, *args, **kwargs):
+        return ExpressionFunction(
+            self._definition,
+            self._fid,
+            self._title,
+            self._description,
+            self._params,
+            *args,
+            guess = self._guess,
+            limits = self._limits,
+            template = self._get_template(),
+            **kwargs
+        )
+
+class ExpressionFunction(MixfitFunction):
+    def __init__(
+        self,
+        definition,
+        fid,
+        title,
+        description,
+        params,
+        prefix = None,
+        limits = None,
+        template = None,
+        guess = None
+    ):
+        super().__init__(fid, title, description, params, prefix = prefix, limits = limits, template = template)
+        self._definition = definition
+        self._guess = guess
+        if prefix is None:
+            self._lmnames = definition.names
+        else:
+            self._lmnames = tuple([ f"{prefix}_{n}" for n in definition.names ])
+
+    def _values(self, pars):
+        return [ float(pars[n]) for n in self._lmnames ]
+
+    def __call__(self, pars, x, *, data = None):
+        if data is None:
+            return self._definition.model(x, *self._values(pars))
+        return self._definition.residual(data, x, *self._values(pars))
+
+    def jacobian(self, pars, x):
+        return self._definition.jacobian(np.asarray(x, dtype = np.float64), *self._values(pars))
+
+    def guess(self, x, data):
+        if self._guess is not None:
+            values = self._guess(x, data)
+        else:
+            values = { p["name"] : p.get("init", 1.0) for p in self._params }
+        return { lmn : values[n] for lmn, n in zip(self._lmnames, self._definition.names) }
+
+    def _with_prefix(self, prefix):
+        return ExpressionFunction(
+            self._definition,
+            self._fid,
+            self._title,
+            self._description,
+            self._params,
+            prefix = prefix,
+            template = self._paramsd,
+            guess = self._guess
+        )
+
+    def _p_repr(self, params):
+        return f"{self._title}(" + ", ".join([ f"{n}={params[lmn].value}+-{params[lmn].stderr}" for n, lmn in zip(self._definition.names, self._lmnames) ]) + ")"
@@ -1,4 +1,5 @@
 from mixfitfunctions.mixfitfunction import MixfitFunction, MixfitFunctionFactory
+from mixfitfunctions import kernels
 
 import numpy as np
 
@@ -21,9 +22,12 @@ class MixfitFunctionGaussianFactory(MixfitFunctionFactory):
             self._limits = None
 
     def __call__(self, *args, **kwargs):
-        return MixfitFunctionGaussian(*args, limits = self._limits, **kwargs)
+        return MixfitFunctionGaussian(*args, limits = self._limits, template = self._get_template(), **kwargs)
 
 class MixfitFunctionGaussian(MixfitFunction):
+    _kernel = kernels.GAUSSIAN
+    _kernel_names = ("amp", "mu", "sigma", "offset")
+
     def __init__(self, *args, **kwargs):
         super().__init__(
             "GAUSSIAN",
@@ -64,11 +68,7 @@ class MixfitFunctionGaussian(MixfitFunction):
 
     def __call__(self, pars, x, *, data = None):
         amp, mu, sig, offs = self._parse_pparms(pars)
-        val = amp * np.exp(-np.power(x - mu, 2.0) / (2 * np.power(sig, 2.0))) + offs
-        if data is None:
-            return val
-        else:
-            return data - val
+        return kernels.evaluate(kernels.GAUSSIAN, x, amp, mu, sig, offs, data = data)
 
     def guess(self, x, data):
         pfx = ""
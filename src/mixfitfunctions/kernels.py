@@ -0,0 +1,445 @@
+"""Fused evaluation kernels for the built in line shapes
+
+All kernels work on the canonical parameter tuple (amp, center, width,
+offset). Shapes that do not use a slot simply ignore it. The kernels
+evaluate a single shape or a whole mixture (optionally already as residual
+data - model) in one pass over x and supply the derivatives with respect
+to the canonical parameters.
+
+The in-place NumPy implementations are used by default. Compiled numba
+loops are opt-in (use_backend("numba") or the environment variable
+MIXFIT_BACKEND=numba, which is inherited by worker processes) - they sum in
+a different order so results differ in the last digits. The backend is
+resolved on first use so importing this module stays cheap.
+"""
+
+import os
+
+import numpy as np
+
+CONSTANT = 0
+LINEAR = 1
+GAUSSIAN = 2
+CAUCHY = 3
+DIFFGAUSSIAN = 4
+DIFFCAUCHY = 5
+
+# Robust loss functions that can be applied to residuals. The residual r is
+# replaced by sign(r) * scale * sqrt(rho((r/scale)^2)) so that the sum of
+# squares minimized by least squares solvers equals the robust cost
+LOSSES = {
+    "linear" : 0,
+    "huber" : 1,
+    "soft_l1" : 2
+}
+
+_backend = None
+
+def use_backend(name = None):
+    """Select the kernel backend
+
+    Parameters
+    ----------
+
+    name: str, optional
+        Either "numba" or "numpy". When None the backend named by the
+        environment variable MIXFIT_BACKEND is selected, numpy if it is
+        not set
+    """
+    global _backend
+
+    if name is None:
+        name = os.environ.get("MIXFIT_BACKEND") or "numpy"
+    if name == "numba":
+        _compile_numba()
+        _backend = "numba"
+    elif name == "numpy":
+        _backend = "numpy"
+    else:
+        raise ValueError(f"Unknown kernel backend {name}")
+
+def backend():
+    """Return the name of the active backend"""
+    if _backend is None:
+        use_backend()
+    return _backend
+
+_scalartypes = (float, int, np.floating, np.integer)
+
+def _scalar(v):
+    # lmfit Parameter objects carry their value in .value
+    return getattr(v, "value", v)
+
+# Pure NumPy implementations
+# ==========================
+#
+# Those work with broadcasting parameters too and try to keep the number of
+# temporaries small by operating in place.
+
+def _np_shape(shape, x, amp, c, w, offs):
+    if shape == CONSTANT:
+        return np.full(np.broadcast(x, offs).shape, offs, dtype = np.float64)
+    if shape == LINEAR:
+        return x * amp + offs
+
+    u = x - c
+    if shape == GAUSSIAN:
+        u *= u
+        u *= -1.0 / (2.0 * np.square(w))
+        np.exp(u, out = u)
+        u *= amp
+    elif shape == DIFFGAUSSIAN:
+        t = u / w
+        t *= t
+        t *= -0.5
+        np.exp(t, out = t)
+        u *= t
+        u *= -1.0 * amp / np.square(w)
+    elif shape == CAUCHY:
+        u *= u
+        u += np.square(w)
+        np.divide(amp * w / np.pi, u, out = u)
+    elif shape == DIFFCAUCHY:
+        t = u * u
+        t += np.square(w)
+        t *= t
+        u /= t
+        u *= -2.0 * amp * w / np.pi
+    else:
+        raise ValueError(f"Unknown kernel shape {shape}")
+    u += offs
+    return u
+
+def _np_shape_jacobian(shape, x, amp, c, w, offs):
+    jac = np.zeros((len(x), 4))
+    jac[:,3] = 1.0
+    if shape == CONSTANT:
+        return jac
+    if shape == LINEAR:
+        jac[:,0] = x
+        return jac
+
+    u = x - c
+    if shape == GAUSSIAN:
+        g = np.exp(-u * u / (2.0 * w * w))
+        jac[:,0] = g
+        jac[:,1] = amp * g * u / (w * w)
+        jac[:,2] = amp * g * u * u / (w * w * w)
+    elif shape == DIFFGAUSSIAN:
+        g = np.exp(-0.5 * u * u / (w * w))
+        jac[:,0] = -u / (w * w) * g
+        jac[:,1] = amp / (w * w) * g * (1.0 - u * u / (w * w))
+        jac[:,2] = -amp * u * g * (u * u / w**5 - 2.0 / w**3)
+    elif shape == CAUCHY:
+        d = u * u + w * w
+        jac[:,0] = w / np.pi / d
+        jac[:,1] = amp * w / np.pi * 2.0 * u / (d * d)
+        jac[:,2] = amp / np.pi * (u * u - w * w) / (d * d)
+    elif shape == DIFFCAUCHY:
+        d = u * u + w * w
+        d3 = d * d * d
+        jac[:,0] = -2.0 * w / np.pi * u / (d * d)
+        jac[:,1] = 2.0 * amp * w / np.pi * (d - 4.0 * u * u) / d3
+        jac[:,2] = -2.0 * amp * u / np.pi * (d - 4.0 * w * w) / d3
+    else:
+        raise ValueError(f"Unknown kernel shape {shape}")
+    return jac
+
+def _np_loss(r, loss, scale):
+    # Transform the residual r in place
+    if loss == 1:
+        a = np.abs(r)
+        m = a > scale
+        r[m] = np.copysign(np.sqrt(scale * (2.0 * a[m] - scale)), r[m])
+    elif loss == 2:
+        t = r / scale
+        t *= t
+        t += 1.0
+        np.sqrt(t, out = t)
+        t -= 1.0
+        t *= 2.0
+        np.sqrt(t, out = t)
+        t *= scale
+        np.copysign(t, r, out = r)
+    return r
+
+def _np_loss_derivative(r, loss, scale):
+    # Derivative of the transformed residual (see _np_loss) with respect
+    # to the residual r
+    d = np.ones_like(r)
+    if loss == 1:
+        a = np.abs(r)
+        m = a > scale
+        d[m] = np.sqrt(scale / (2.0 * a[m] - scale))
+    elif loss == 2:
+        # sqrt((g+1)/2)/g with g = sqrt(1 + (r/scale)^2), free of the
+        # cancellation in g - 1 for small residuals
+        g = r / scale
+        g *= g
+        g += 1.0
+        np.sqrt(g, out = g)
+        d += g
+        d *= 0.5
+        np.sqrt(d, out = d)
+        d /= g
+    return d
+
+def _np_mixture(shapes, params, x, data, weights, loss, scale):
+    res = np.zeros((len(x),))
+    for i in range(len(shapes)):
+        res += _np_shape(shapes[i], x, params[i,0], params[i,1], params[i,2], params[i,3])
+    if data is not None:
+        np.subtract(data, res, out = res)
+        if weights is not None:
+            res *= weights
+        if loss != 0:
+            _np_loss(res, loss, scale)
+    return res
+
+def _np_mixture_jacobian(shapes, params, x):
+    jac = np.empty((len(x), 4 * len(shapes)))
+    for i in range(len(shapes)):
+        jac[:,4*i:4*i+4] = _np_shape_jacobian(shapes[i], x, params[i,0], params[i,1], params[i,2], params[i,3])
+    return jac
+
+# numba implementations
+# =====================
+
+_nb_mixture = None
+_nb_mixture_jacobian = None
+
+def _compile_numba():
+    global _nb_mixture, _nb_mixture_jacobian
+
+    if _nb_mixture is not None:
+        return
+
+    import math
+    import numba
+
+    @numba.njit(cache = True, nogil = True)
+    def nb_mixture(shapes, params, x, data, subtract, weights, weighted, loss, scale, out):
+        for j in range(x.shape[0]):
+            xj = x[j]
+            acc = 0.0
+            for i in range(shapes.shape[0]):
+                amp = params[i,0]
+                c = params[i,1]
+                w = params[i,2]
+                s = shapes[i]
+                # Summation order matches the NumPy backend - shape and
+                # offset of every component are added first
+                if s == LINEAR:
+                    v = amp * xj
+                elif s == GAUSSIAN:
+                    u = xj - c
+                    v = amp * np.exp(-u * u / (2.0 * w * w))
+                elif s == CAUCHY:
+                    u = xj - c
+                    v = amp * w / np.pi / (u * u + w * w)
+                elif s == DIFFGAUSSIAN:
+                    u = xj - c
+                    v = -amp * u / (w * w) * np.exp(-0.5 * u * u / (w * w))
+                elif s == DIFFCAUCHY:
+                    u = xj - c
+                    d = u * u + w * w
+                    v = -2.0 * amp * w / np.pi * u / (d * d)
+                else:
+                    v = 0.0
+                acc += v + params[i,3]
+            if subtract:
+                r = data[j] - acc
+                if weighted:
+                    r = r * weights[j]
+                if loss == 1:
+                    a = abs(r)
+                    if a > scale:
+                        r = math.copysign(math.sqrt(scale * (2.0 * a - scale)), r)
+                elif loss == 2:
+                    z = r / scale
+                    r = math.copysign(scale * math.sqrt(2.0 * (math.sqrt(1.0 + z * z) - 1.0)), r)
+                out[j] = r
+            else:
+                out[j] = acc
+        return out
+
+    @numba.njit(cache = True, nogil = True)
+    def nb_mixture_jacobian(shapes, params, x, out):
+        for j in range(x.shape[0]):
+            xj = x[j]
+            for i in range(shapes.shape[0]):
+                amp = params[i,0]
+                c = params[i,1]
+                w = params[i,2]
+                s = shapes[i]
+                k = 4 * i
+                out[j,k+3] = 1.0
+                if s == CONSTANT:
+                    out[j,k] = 0.0
+                    out[j,k+1] = 0.0
+                    out[j,k+2] = 0.0
+                elif s == LINEAR:
+                    out[j,k] = xj
+                    out[j,k+1] = 0.0
+                    out[j,k+2] = 0.0
+                elif s == GAUSSIAN:
+                    u = xj - c
+                    g = np.exp(-u * u / (2.0 * w * w))
+                    out[j,k] = g
+                    out[j,k+1] = amp * g * u / (w * w)
+                    out[j,k+2] = amp * g * u * u / (w * w * w)
+                elif s == DIFFGAUSSIAN:
+                    u = xj - c
+                    g = np.exp(-0.5 * u * u / (w * w))
+                    out[j,k] = -u / (w * w) * g
+                    out[j,k+1] = amp / (w * w) * g * (1.0 - u * u / (w * w))
+                    out[j,k+2] = -amp * u * g * (u * u / w**5 - 2.0 / w**3)
+                elif s == CAUCHY:
+                    u = xj - c
+                    d = u * u + w * w
+                    out[j,k] = w / np.pi / d
+                    out[j,k+1] = amp * w / np.pi * 2.0 * u / (d * d)
+                    out[j,k+2] = amp / np.pi * (u * u - w * w) / (d * d)
+                elif s == DIFFCAUCHY:
+                    u = xj - c
+                    d = u * u + w * w
+                    d3 = d * d * d
+                    out[j,k] = -2.0 * w / np.pi * u / (d * d)
+                    out[j,k+1] = 2.0 * amp * w / np.pi * (d - 4.0 * u * u) / d3
+                    out[j,k+2] = -2.0 * amp * u / np.pi * (d - 4.0 * w * w) / d3
+        return out
+
+    _nb_mixture = nb_mixture
+    _nb_mixture_jacobian = nb_mixture_jacobian
+
+# Public entry points
+# ===================
+
+def _loss_id(loss):
+    if loss is None:
+        return 0
+    if loss not in LOSSES:
+        raise ValueError(f"Unknown loss function {loss}")
+    return LOSSES[loss]
+
+def finish_residual(r, *, weights = None, loss = None, scale = 1.0):
+    """Apply weights and a robust loss in place to a plain residual data - model
+
+    This is used for shapes that are not supported by the kernels.
+    """
+    if weights is not None:
+        r *= weights
+    return _np_loss(r, _loss_id(loss), scale)
+
+def residual_jacobian(jac, r = None, *, weights = None, loss = None, scale = 1.0):
+    """Turn the jacobian of a model (one row per sample) in place into the
+    jacobian of the residual finish_residual(data - model)
+
+    r is the plain residual data - model, it is only required for robust
+    losses.
+    """
+    lossid = _loss_id(loss)
+    if (weights is None) and (lossid == 0):
+        np.negative(jac, out = jac)
+        return jac
+
+    if weights is None:
+        f = np.full((jac.shape[0],), -1.0)
+    else:
+        f = -np.asarray(weights, dtype = np.float64)
+    if lossid != 0:
+        r = np.asarray(r, dtype = np.float64)
+        if weights is not None:
+            r = r * weights
+        f = f * _np_loss_derivative(r, lossid, scale)
+    jac *= f[:,np.newaxis]
+    return jac
+
+def evaluate(shape, x, amp, c, w, offs, *, data = None, weights = None, loss = None, scale = 1.0):
+    """Evaluate a single shape (or the residual data - shape)
+
+    Parameters may be scalars, lmfit Parameter objects or arrays that
+    broadcast against x. Only scalar parameters use the compiled backend.
+    Residuals are optionally multiplied by per point weights and
+    transformed by a robust loss (see LOSSES) with the given scale.
+    """
+    amp, c, w, offs = _scalar(amp), _scalar(c), _scalar(w), _scalar(offs)
+    x = np.asarray(x, dtype = np.float64)
+
+    if (backend() == "numba") and (x.ndim == 1) and all([ isinstance(v, _scalartypes) for v in (amp, c, w, offs) ]):
+        return evaluate_mixture(np.asarray([ shape ]), np.asarray([[ amp, c, w, offs ]], dtype = np.float64), x, data = data, weights = weights, loss = loss, scale = scale)
+
+    val = _np_shape(shape, x, amp, c, w, offs)
+    if data is None:
+        return val
+    if np.shape(data) == val.shape:
+        np.subtract(data, val, out = val)
+    else:
+        val = data - val
+    if (weights is None) and (loss is None):
+        return val
+    return finish_residual(val, weights = weights, loss = loss, scale = scale)
+
+def jacobian(shape, x, amp, c, w, offs):
+    """Derivatives of a single shape with respect to (amp, center, width, offset)
+
+    Returns an array of shape (len(x), 4)
+    """
+    p = np.asarray([ _scalar(amp), _scalar(c), _scalar(w), _scalar(offs) ], dtype = np.float64)
+    return mixture_jacobian(np.asarray([ shape ]), p.reshape((1, 4)), x)
+
+def evaluate_mixture(shapes, params, x, *, data = None, weights = None, loss = None, scale = 1.0):
+    """Evaluate the sum of multiple shapes in a single pass
+
+    Parameters
+    ----------
+
+    shapes: ndarray
+        Integer shape identifiers, one per component
+    params: ndarray
+        Array of shape (len(shapes), 4) containing the canonical parameters
+        (amp, center, width, offset) of each component
+    x: ndarray
+        Sample positions
+    data: ndarray, optional
+        When supplied the residual data - model is returned
+    weights: ndarray, optional
+        Per point weights the residual is multiplied with
+    loss: str, optional
+        Robust loss applied to the (weighted) residual, one of LOSSES
+    scale: float, optional
+        Residual scale at which the robust loss starts to deviate from
+        the plain least squares cost
+    """
+    x = np.asarray(x, dtype = np.float64)
+    shapes = np.asarray(shapes, dtype = np.int64)
+    params = np.asarray(params, dtype = np.float64)
+    lossid = _loss_id(loss)
+
+    if (backend() == "numba") and (x.ndim == 1):
+        out = np.empty(x.shape)
+        if data is None:
+            return _nb_mixture(shapes, params, x, x, False, x, False, 0, 1.0, out)
+        data = np.asarray(data, dtype = np.float64)
+        if weights is not None:
+            weights = np.asarray(weights, dtype = np.float64)
+        if (data.shape == x.shape) and ((weights is None) or (weights.shape == x.shape)):
+            if weights is None:
+                return _nb_mixture(shapes, params, x, data, True, x, False, lossid, float(scale), out)
+            return _nb_mixture(shapes, params, x, data, True, weights, True, lossid, float(scale), out)
+
+    return _np_mixture(shapes, params, x, data, weights, lossid, scale)
+
+def mixture_jacobian(shapes, params, x):
+    """Derivatives of a mixture with respect to all canonical parameters
+
+    Returns an array of shape (len(x), 4*len(shapes)), the columns of
+    component i are located at 4*i ... 4*i+3
+    """
+    x = np.asarray(x, dtype = np.float64)
+    shapes = np.asarray(shapes, dtype = np.int64)
+    params = np.asarray(params, dtype = np.float64)
+
+    if (backend() == "numba") and (x.ndim == 1):
+        return _nb_mixture_jacobian(shapes, params, x, np.empty((len(x), 4 * len(shapes))))
+    return _np_mixture_jacobian(shapes, params, x)
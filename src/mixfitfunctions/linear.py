@@ -1,4 +1,5 @@
 from mixfitfunctions.mixfitfunction import MixfitFunction, MixfitFunctionFactory
+from mixfitfunctions import kernels
 
 import numpy as np
 
@@ -19,9 +20,12 @@ class MixfitFunctionLinearFactory(MixfitFunctionFactory):
             self._limits = None
 
     def __call__(self, *args, **kwargs):
-        return MixfitFunctionLinear(*args, limits = self._limits, **kwargs)
+        return MixfitFunctionLinear(*args, limits = self._limits, template = self._get_template(), **kwargs)
 
 class MixfitFunctionLinear(MixfitFunction):
+    _kernel = kernels.LINEAR
+    _kernel_names = ("slope", None, None, "intercept")
+
     def __init__(self, *args, **kwargs):
         super().__init__(
             "LINEAR",
@@ -56,11 +60,7 @@ class MixfitFunctionLinear(MixfitFunction):
 
     def __call__(self, pars, x, *, data = None):
         slope, intercept = self._parse_pparms(pars)
-        val = x * slope + intercept
-        if data is None:
-            return val
-        else:
-            return data - val
+        return kernels.evaluate(kernels.LINEAR, x, slope, 0, 0, intercept, data = data)
 
     def guess(self, x, data):
         pfx = ""
@@ -1,4 +1,70 @@
-from lmfit import Parameters
+import numpy as np
+
+from mixfitfunctions import kernels
+
+class _FrozenDict(dict):
+    """Read only dictionary used for parameter templates shared by many functions"""
+    def _readonly(self, *args, **kwargs):
+        raise TypeError("Parameter templates are read only")
+
+    __setitem__ = _readonly
+    __delitem__ = _readonly
+    clear = _readonly
+    pop = _readonly
+    popitem = _readonly
+    setdefault = _readonly
+    update = _readonly
+
+    def __reduce__(self):
+        return (_FrozenDict, (dict(self),))
+
+def _parameter_template(params, limits):
+    """Validate parameter descriptors and limits and build the read only
+    per parameter metadata (desc, vary, min, max)"""
+
+    if limits is not None:
+        if not isinstance(limits, dict):
+            raise ValueError("Limits field has to be a dictionary or none")
+
+    for p in params:
+        if not isinstance(p, dict):
+            raise ValueError("Each parameter has to be described by a dictionary")
+        if ("name" not in p) or ("desc" not in p):
+            raise ValueError("Name and description are required for each parameter")
+
+    paramsd = {}
+    for p in params:
+        vary, mn, mx = True, None, None
+        if "vary" in p:
+            vary = p["vary"]
+        if "min" in p:
+            mn = p["min"]
+        if "max" in p:
+            mx = p["max"]
+
+        paramsd[p["name"]] = {
+            "desc" : p["desc"],
+            "vary" : vary,
+            "min" : mn,
+            "max" : mx
+        }
+
+    if limits is not None:
+        for l in limits:
+            if l not in paramsd:
+                raise ValueError(f"Limit specified for parameter {l} that's not specified in parameter list")
+
+            if len(limits[l]) != 2:
+                raise ValueError(f"Limit for parameter {l} is not a 2-list or 2-tuple!")
+            if limits[l][0] == limits[l][1]:
+                paramsd[l]["vary"] = False
+            else:
+                if limits[l][0] > limits[l][1]:
+                    raise ValueError(f"Limit for parameter {l} is not valid, minimum larger than maximum")
+                paramsd[l]["min"] = limits[l][0]
+                paramsd[l]["max"] = limits[l][1]
+
+    return _FrozenDict({ n : _FrozenDict(d) for n, d in paramsd.items() })
 
 class MixfitFunctionFactory:
     """A simple base class for function factories. Those generate function instances"""
@@ -51,6 +117,14 @@ class MixfitFunctionFactory:
         self._title = title
         self._description = description
         self._params = params
+        self._template = None
+
+    def _get_template(self):
+        # Parameter metadata including our limits is validated and built
+        # only once and shared (read only) by all created functions
+        if self._template is None:
+            self._template = _parameter_template(self._params, getattr(self, "_limits", None))
+        return self._template
 
     def __call__(self):
         raise NotImplementedError()
@@ -59,6 +133,17 @@ class MixfitFunctionFactory:
 
 class MixfitFunction:
     """Wrapper for all mixture fit candidate methods. This is an abstract base class"""
+
+    # Shapes that are supported by mixfitfunctions.kernels set the kernel
+    # shape id and the parameter names for the canonical (amp, center,
+    # width, offset) slots (None for unused slots)
+    _kernel = None
+    _kernel_names = None
+
+    # Index of the factory (in the factory list of the fitter) that created
+    # the function, None for functions created outside of a fitter
+    _ifac = None
+
     def __init__(
         self,
         fid,
@@ -66,7 +151,8 @@ class MixfitFunction:
         description,
         params,
         prefix = None,
-        limits = None
+        limits = None,
+        template = None
     ):
         """Initialize function base information
 
@@ -95,25 +181,22 @@ class MixfitFunction:
             An optional dictionary that includes min and max values for
             different parameters. The parameter names have to match the
             name field in parameter
+        template: mapping, optional
+            Precomputed parameter metadata as returned by the factories
+            _get_template. When supplied params and limits are assumed to
+            have been validated already
         """
 
-        if not isinstance(params, list):
-            raise ValueError("Parameter descriptors have to be a list of dictionaries")
-        if limits is not None:
-            if not isinstance(limits, dict):
-                raise ValueError("Limits field has to be a dictionary or none")
-        if not isinstance(title, str):
-            raise ValueError("Title has to be a string")
-        if not isinstance(fid, str):
-            raise ValueError("Function Id has to be a unique string")
-        if not isinstance(description, str):
-            raise ValueError("Function description has to be a string")
-
-        for p in params:
-            if not isinstance(p, dict):
-                raise ValueError("Each parameter has to be described by a dictionary")
-            if ("name" not in p) or ("desc" not in p):
-                raise ValueError("Name and description are required for each parameter")
+        if template is None:
+            if not isinstance(params, list):
+                raise ValueError("Parameter descriptors have to be a list of dictionaries")
+            if not isinstance(title, str):
+                raise ValueError("Title has to be a string")
+            if not isinstance(fid, str):
+                raise ValueError("Function Id has to be a unique string")
+            if not isinstance(description, str):
+                raise ValueError("Function description has to be a string")
+            template = _parameter_template(params, limits)
         if prefix is not None:
             if not isinstance(prefix, str):
                 raise ValueError("Parameter name prefix has to be a string")
@@ -123,38 +206,15 @@ class MixfitFunction:
         self._description = description
         self._params = params
         self._prefix = prefix
+        self._paramsd = template
 
-        self._paramsd = {}
-        for p in params:
-            vary, mn, mx = True, None, None
-            if "vary" in p:
-                vary = p["vary"]
-            if "min" in p:
-                mn = p["min"]
-            if "max" in p:
-                mx = p["max"]
-            
-            self._paramsd[p["name"]] = {
-                "desc" : p["desc"],
-                "vary" : vary,
-                "min" : mn,
-                "max" : mx
-            }
-
-        if limits is not None:
-            for l in limits:
-                if l not in self._paramsd:
-                    raise ValueError(f"Limit specified for parameter {l} that's not specified in parameter list")
-    
-                if len(limits[l]) != 2:
-                    raise ValueError(f"Limit for parameter {l} is not a 2-list or 2-tuple!")
-                if limits[l][0] == limits[l][1]:
-                    self._paramsd[l]["vary"] = False
-                else:
-                    if limits[l][0] > limits[l][1]:
-                        raise ValueError(f"Limit for parameter {l} is not valid, minimum larger than maximum")
-                    self._paramsd[l]["min"] = limits[l][0]
-                    self._paramsd[l]["max"] = limits[l][1]
+        # Map of (prefixed) lmfit parameter names to our parameter names
+        if prefix is None:
+            self._pnames = { n : n for n in template }
+        else:
+            self._pnames = { f"{prefix}_{n}" : n for n in template }
+        if self._kernel_names is not None:
+            self._kernel_pnames = tuple([ None if n is None else (n if prefix is None else f"{prefix}_{n}") for n in self._kernel_names ])
 
     def __call__(self, pars, x, *, data = None):
         raise NotImplementedError()
@@ -162,16 +222,81 @@ class MixfitFunction:
     def guess(self, x, data):
         raise NotImplementedError()
 
+    def _kernel_params(self, pars):
+        return [ 0.0 if n is None else kernels._scalar(pars[n]) for n in self._kernel_pnames ]
+
+    def _residual(self, pars, x, data, weights = None, loss = None, lossScale = 1.0):
+        # Weighted and robust residual, computed by the kernels in the same
+        # pass as the model where possible
+        if (weights is None) and (loss is None):
+            return self(pars, x, data = data)
+        if self._kernel is not None:
+            return kernels.evaluate(self._kernel, x, *self._kernel_params(pars), data = data, weights = weights, loss = loss, scale = lossScale)
+        res = self(pars, x, data = data)
+        return kernels.finish_residual(np.asarray(res, dtype = np.float64), weights = weights, loss = loss, scale = lossScale)
+
+    def jacobian(self, pars, x):
+        """Derivatives of the function with respect to its parameters
+
+        Returns an array of shape (len(x), number of parameters). The columns
+        are ordered like the parameter descriptors.
+        """
+        if self._kernel is None:
+            raise NotImplementedError()
+        kjac = kernels.jacobian(self._kernel, x, *self._kernel_params(pars))
+        res = np.empty((kjac.shape[0], len(self._params)))
+        for ip, p in enumerate(self._params):
+            res[:,ip] = kjac[:,self._kernel_names.index(p["name"])]
+        return res
+
+    def _has_jacobian(self):
+        return (self._kernel is not None) or (type(self).jacobian is not MixfitFunction.jacobian)
+
+    def _jacobian_names(self):
+        # lmfit parameter names of the columns returned by jacobian
+        if self._prefix is None:
+            return [ p["name"] for p in self._params ]
+        return [ f"{self._prefix}_{p['name']}" for p in self._params ]
+
+    def _offset_name(self):
+        # lmfit name of the constant offset (None if there is none). The
+        # offsets of all components of a mixture are degenerate
+        if self._kernel_names is not None:
+            return self._kernel_pnames[3]
+        for n, pn in self._pnames.items():
+            if pn == "offset":
+                return n
+        return None
+
+    def _residual_jacobian(self, pars, x, data, weights = None, loss = None, lossScale = 1.0):
+        # Jacobian of _residual with respect to the varying parameters in
+        # the order of pars (the Dfun of the candidate fits)
+        jac = self.jacobian(pars, x)
+        cols = { n : i for i, n in enumerate(self._jacobian_names()) }
+        jac = jac[:,[ cols[n] for n, p in pars.items() if p.vary ]]
+        r = None
+        if loss is not None:
+            r = self(pars, x, data = data)
+        return kernels.residual_jacobian(jac, r, weights = weights, loss = loss, scale = lossScale)
+
     def lmparams(self, params, *, lmp = None):
         if lmp is None:
+            from lmfit import Parameters
             lmp = Parameters()
 
-        addp = []
-        for p in params:
-            if self._prefix is None:
-                pname = p
-            else:
-                pname = p[len(self._prefix)+1:]
-            lmp.add(p, value = params[p], min = self._paramsd[pname]["min"], max = self._paramsd[pname]["max"], vary = self._paramsd[pname]["vary"])
+        pnames = self._pnames
+        paramsd = self._paramsd
+        lmp.add_many(*[ (p, params[p], paramsd[pnames[p]]["vary"], paramsd[pnames[p]]["min"], paramsd[pnames[p]]["max"]) for p in params ])
+
+        return lmp
+
+    def _with_prefix(self, prefix):
+        # Same function (sharing the parameter template) with another prefix
+        return type(self)(prefix = prefix, template = self._paramsd)
 
+    def _lmparams_set(self, params, lmp):
+        # Update the values of a Parameters object that has been created by
+        # lmparams of this function before - bounds and vary are unchanged
+        for p in params:
+            lmp[p].value = params[p]
         return lmp
@@ -0,0 +1,201 @@
+from mixfitfunctions.mixfitfunction import MixfitFunction, MixfitFunctionFactory
+from mixfitfunctions.voigt import _line_guess, _scale_guess
+
+import numpy as np
+
+# The pseudo Voigt profile approximates the Voigt profile by a linear
+# combination of a Gaussian and a Cauchy distribution of the same full width
+# at half maximum fwhm, both normalized to unit area:
+#
+#   PV(x) = eta * L(x) + (1 - eta) * G(x)
+#   G(x) = sqrt(4 ln2 / pi) / fwhm * exp(-4 ln2 (x - x0)^2 / fwhm^2)
+#   L(x) = 2 / (pi fwhm) / (1 + 4 (x - x0)^2 / fwhm^2)
+#
+# It only needs elementary functions and the mixing parameter eta (limited
+# to [0, 1]) directly describes the line shape. The width is used by
+# absolute value so it can stay unbounded like the widths of the other
+# shapes.
+
+_LN2 = np.log(2.0)
+_TINY = 1e-300
+
+def _parts(x, x0, fwhm):
+    f = max(abs(float(fwhm)), _TINY)
+    u = np.asarray(x, dtype = np.float64) - x0
+    a = 4.0 * _LN2 / (f * f)
+    b = 4.0 / (f * f)
+    g = np.exp(-a * u * u)
+    g *= np.sqrt(a / np.pi)
+    q = 1.0 + b * u * u
+    l = 2.0 / (np.pi * f) / q
+    return u, f, a, b, g, q, l
+
+def pseudo_voigt(x, amp, x0, fwhm, eta, offset = 0.0):
+    """Pseudo Voigt line of area amp"""
+    u, f, a, b, g, q, l = _parts(x, x0, fwhm)
+    return amp * (eta * l + (1.0 - eta) * g) + offset
+
+def differential_pseudo_voigt(x, amp, x0, fwhm, eta, offset = 0.0):
+    """Derivative (with respect to x) of the pseudo Voigt line of area amp"""
+    u, f, a, b, g, q, l = _parts(x, x0, fwhm)
+    dg = -2.0 * a * u * g
+    dl = -2.0 * b * u / q * l
+    return amp * (eta * dl + (1.0 - eta) * dg) + offset
+
+def _pseudo_voigt_jacobian(x, amp, x0, fwhm, eta, differential):
+    # Columns: amp, x0, fwhm, eta, offset
+    u, f, a, b, g, q, l = _parts(x, x0, fwhm)
+    sgf = -1.0 if fwhm < 0 else 1.0
+    jac = np.empty((len(u), 5))
+    jac[:,4] = 1.0
+
+    dg = -2.0 * a * u * g
+    dl = -2.0 * b * u / q * l
+    if not differential:
+        # Shape, derivative with respect to x and to the width of both parts
+        sg, sl = g, l
+        dsg, dsl = dg, dl
+        fg = g * (2.0 * a * u * u - 1.0) / f
+        fl = l * (2.0 * b * u * u / q - 1.0) / f
+    else:
+        sg, sl = dg, dl
+        dsg = (4.0 * a * a * u * u - 2.0 * a) * g
+        dsl = -4.0 * b / (np.pi * f) * (1.0 - 3.0 * b * u * u) / (q * q * q)
+        fg = dg * (2.0 * a * u * u - 3.0) / f
+        fl = dl * (4.0 * b * u * u / q - 3.0) / f
+
+    jac[:,0] = eta * sl + (1.0 - eta) * sg
+    jac[:,1] = -amp * (eta * dsl + (1.0 - eta) * dsg)
+    jac[:,2] = sgf * amp * (eta * fl + (1.0 - eta) * fg)
+    jac[:,3] = amp * (sl - sg)
+    return jac
+
+class MixfitFunctionPseudoVoigtFactory(MixfitFunctionFactory):
+    def __init__(self, *args, **kwargs):
+        super().__init__(
+            "PSEUDOVOIGT",
+            "Pseudo Voigt",
+            "Pseudo Voigt profile (mixture of Gaussian and Cauchy of equal width)",
+            [
+                { "name" : "x0", "desc" : "Center", "vary" : True, "min" : None, "max" : None },
+                { "name" : "fwhm", "desc" : "Full width at half maximum", "vary" : True, "min" : None, "max" : None },
+                { "name" : "eta", "desc" : "Fraction of the Cauchy part", "vary" : True, "min" : 0.0, "max" : 1.0 },
+                { "name" : "amp", "desc" : "Area", "vary" : True, "min" : None, "max" : None },
+                { "name" : "offset", "desc" : "Constant offset", "vary" : True, "min" : None, "max" : None }
+            ]
+        )
+        if "limits" in kwargs:
+            self._limits = kwargs["limits"]
+        else:
+            self._limits = None
+
+    def __call__(self, *args, **kwargs):
+        return MixfitFunctionPseudoVoigt(*args, limits = self._limits, template = self._get_template(), **kwargs)
+
+class MixfitFunctionDifferentialPseudoVoigtFactory(MixfitFunctionFactory):
+    def __init__(self, *args, **kwargs):
+        super().__init__(
+            "DIFFPSEUDOVOIGT",
+            "Differential Pseudo Voigt",
+            "Derivative of the pseudo Voigt profile",
+            [
+                { "name" : "x0", "desc" : "Center", "vary" : True, "min" : None, "max" : None },
+                { "name" : "fwhm", "desc" : "Full width at half maximum", "vary" : True, "min" : None, "max" : None },
+                { "name" : "eta", "desc" : "Fraction of the Cauchy part", "vary" : True, "min" : 0.0, "max" : 1.0 },
+                { "name" : "amp", "desc" : "Area of the integrated line", "vary" : True, "min" : None, "max" : None },
+                { "name" : "offset", "desc" : "Constant offset", "vary" : True, "min" : None, "max" : None }
+            ]
+        )
+        if "limits" in kwargs:
+            self._limits = kwargs["limits"]
+        else:
+            self._limits = None
+
+    def __call__(self, *args, **kwargs):
+        return MixfitFunctionDifferentialPseudoVoigt(*args, limits = self._limits, template = self._get_template(), **kwargs)
+
+class MixfitFunctionPseudoVoigt(MixfitFunction):
+    _differential = False
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(
+            "PSEUDOVOIGT",
+            "Pseudo Voigt",
+            "Pseudo Voigt profile (mixture of Gaussian and Cauchy of equal width)",
+            [
+                { "name" : "x0", "desc" : "Center", "vary" : True, "min" : None, "max" : None },
+                { "name" : "fwhm", "desc" : "Full width at half maximum", "vary" : True, "min" : None, "max" : None },
+                { "name" : "eta", "desc" : "Fraction of the Cauchy part", "vary" : True, "min" : 0.0, "max" : 1.0 },
+                { "name" : "amp", "desc" : "Area", "vary" : True, "min" : None, "max" : None },
+                { "name" : "offset", "desc" : "Constant offset", "vary" : True, "min" : None, "max" : None }
+            ],
+            *args,
+            **kwargs
+        )
+
+    def _parse_pparms(self, ppars):
+        if self._prefix is not None:
+            pfx = f"{self._prefix}_"
+        else:
+            pfx = ""
+        return ppars[f"{pfx}amp"], ppars[f"{pfx}x0"], ppars[f"{pfx}fwhm"], ppars[f"{pfx}eta"], ppars[f"{pfx}offset"]
+
+    def _values(self, pars):
+        return [ float(getattr(v, "value", v)) for v in self._parse_pparms(pars) ]
+
+    def __call__(self, pars, x, *, data = None):
+        amp, x0, fwhm, eta, offs = self._values(pars)
+        if self._differential:
+            res = differential_pseudo_voigt(x, amp, x0, fwhm, eta, offs)
+        else:
+            res = pseudo_voigt(x, amp, x0, fwhm, eta, offs)
+        if data is None:
+            return res
+        return data - res
+
+    def jacobian(self, pars, x):
+        amp, x0, fwhm, eta, offs = self._values(pars)
+        jac = _pseudo_voigt_jacobian(x, amp, x0, fwhm, eta, self._differential)
+        # Columns in the order of the parameter descriptors
+        return jac[:,[ 1, 2, 3, 0, 4 ]]
+
+    def guess(self, x, data):
+        pfx = ""
+        if self._prefix is not None:
+            pfx = f"{self._prefix}_"
+        x0, sign, height, fwhm, offs = _line_guess(x, data, self._differential)
+
+        eta = 0.5
+        unit = differential_pseudo_voigt if self._differential else pseudo_voigt
+        amp = _scale_guess(lambda xx: unit(xx, 1.0, x0, fwhm, eta), x, x0, sign, height, self._differential)
+        return {
+            f"{pfx}amp" : amp,
+            f"{pfx}x0" : x0,
+            f"{pfx}fwhm" : fwhm,
+            f"{pfx}eta" : eta,
+            f"{pfx}offset" : offs
+        }
+
+    def _p_repr(self, params):
+        amp, x0, fwhm, eta, offs = self._parse_pparms(params)
+        return f"{self._title.replace(' ', '')}(amp={amp.value}+-{amp.stderr}, x0={x0.value}+-{x0.stderr}, fwhm={fwhm.value}+-{fwhm.stderr}, eta={eta.value}+-{eta.stderr}, offset={offs.value}+-{offs.stderr})"
+
+class MixfitFunctionDifferentialPseudoVoigt(MixfitFunctionPseudoVoigt):
+    _differential = True
+
+    def __init__(self, *args, **kwargs):
+        MixfitFunction.__init__(
+            self,
+            "DIFFPSEUDOVOIGT",
+            "Differential Pseudo Voigt",
+            "Derivative of the pseudo Voigt profile",
+            [
+                { "name" : "x0", "desc" : "Center", "vary" : True, "min" : None, "max" : None },
+                { "name" : "fwhm", "desc" : "Full width at half maximum", "vary" : True, "min" : None, "max" : None },
+                { "name" : "eta", "desc" : "Fraction of the Cauchy part", "vary" : True, "min" : 0.0, "max" : 1.0 },
+                { "name" : "amp", "desc" : "Area of the integrated line", "vary" : True, "min" : None, "max" : None },
+                { "name" : "offset", "desc" : "Constant offset", "vary" : True, "min" : None, "max" : None }
+            ],
+            *args,
+            **kwargs
+        )
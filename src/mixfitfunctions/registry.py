@@ -0,0 +1,131 @@
+"""Registry of function factories by function id
+
+Factories are registered as "module:attribute" references and the module
+is only imported when the factory is requested for the first time. This
+keeps importing mixfit cheap - the line shape modules (and lmfit) are only
+loaded when a fit is actually set up.
+
+Third party packages can supply additional shapes via the entry point
+group pymixfit.functions. The entry point name is the function id, the
+value references the factory class:
+
+    [options.entry_points]
+    pymixfit.functions =
+        MYSHAPE = mypackage.myshape:MyShapeFactory
+
+Entry points are only scanned when a function id is requested that is not
+registered already or when all available ids are listed.
+"""
+
+import importlib
+import threading
+
+ENTRY_POINT_GROUP = "pymixfit.functions"
+
+# Built in factories in the order they are tried by default
+_BUILTIN = [
+    ("GAUSSIAN", "mixfitfunctions.gaussian:MixfitFunctionGaussianFactory"),
+    ("CONSTANT", "mixfitfunctions.constant:MixfitFunctionConstantFactory"),
+    ("LINEAR", "mixfitfunctions.linear:MixfitFunctionLinearFactory"),
+    ("DIFFGAUSSIAN", "mixfitfunctions.differentialgaussian:MixfitFunctionDifferentialGaussianFactory"),
+    ("CAUCHY", "mixfitfunctions.cauchy:MixfitFunctionCauchyFactory"),
+    ("DIFFERENTIALCAUCHY", "mixfitfunctions.differentialcauchy:MixfitFunctionDifferentialCauchyFactory"),
+    ("VOIGT", "mixfitfunctions.voigt:MixfitFunctionVoigtFactory"),
+    ("DIFFVOIGT", "mixfitfunctions.voigt:MixfitFunctionDifferentialVoigtFactory"),
+    ("PSEUDOVOIGT", "mixfitfunctions.pseudovoigt:MixfitFunctionPseudoVoigtFactory"),
+    ("DIFFPSEUDOVOIGT", "mixfitfunctions.pseudovoigt:MixfitFunctionDifferentialPseudoVoigtFactory")
+]
+
+# The (pseudo) Voigt shapes are not tried by default, every candidate adds a
+# nonlinear fit to each stage. Select them using allowed
+DEFAULT = tuple([ fid for fid, _ in _BUILTIN[:6] ])
+
+_lock = threading.Lock()
+_references = dict(_BUILTIN)
+_loaded = {}
+_entryPointsScanned = False
+
+def register(fid, factory):
+    """Register a factory under a function id
+
+    Parameters
+    ----------
+
+    fid: str
+        Function id the factory is registered for
+    factory: str or class
+        Either the factory class or a "module:attribute" reference that is
+        imported on first use
+    """
+    if not isinstance(fid, str):
+        raise ValueError("Function Id has to be a unique string")
+    if isinstance(factory, str):
+        if ":" not in factory:
+            raise ValueError("Factory reference has to be of the form module:attribute")
+    elif not callable(factory):
+        raise ValueError("Factory has to be a class or a module:attribute reference")
+
+    with _lock:
+        _references[fid] = factory
+        _loaded.pop(fid, None)
+
+def _scan_entry_points():
+    global _entryPointsScanned
+
+    if _entryPointsScanned:
+        return
+    from importlib.metadata import entry_points
+
+    try:
+        eps = entry_points(group = ENTRY_POINT_GROUP)
+    except TypeError:
+        # Python < 3.10 returns a dictionary of groups
+        eps = entry_points().get(ENTRY_POINT_GROUP, [])
+
+    with _lock:
+        for ep in eps:
+            if ep.name not in _references:
+                _references[ep.name] = ep.value
+        _entryPointsScanned = True
+
+def _resolve(reference):
+    if not isinstance(reference, str):
+        return reference
+    modname, attr = reference.split(":", 1)
+    obj = importlib.import_module(modname.strip())
+    for a in attr.strip().split("."):
+        obj = getattr(obj, a)
+    return obj
+
+def get(fid):
+    """Return the factory class registered for a function id, importing its
+    module on first use"""
+    factory = _loaded.get(fid)
+    if factory is not None:
+        return factory
+
+    if fid not in _references:
+        _scan_entry_points()
+    if fid not in _references:
+        raise ValueError(f"Unknown function {fid}, available are {', '.join(available())}")
+
+    factory = _resolve(_references[fid])
+    with _lock:
+        _loaded[fid] = factory
+    return factory
+
+def create(fid, **kwargs):
+    """Create a factory instance for a function id. Keyword arguments (for
+    example limits) are passed to the factory"""
+    return get(fid)(**kwargs)
+
+def available():
+    """List all registered function ids including the ones supplied by entry
+    points (without importing any of them)"""
+    _scan_entry_points()
+    return list(_references)
+
+def default_factories():
+    """Factory instances of all built in functions as used by Mixfit when no
+    allowed functions are specified"""
+    return [ create(fid) for fid in DEFAULT ]
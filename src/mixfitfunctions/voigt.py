@@ -0,0 +1,239 @@
+from mixfitfunctions.mixfitfunction import MixfitFunction, MixfitFunctionFactory
+
+import numpy as np
+
+from scipy.special import wofz
+
+# The Voigt profile (convolution of a Gaussian of standard deviation sigma
+# and a Cauchy distribution of half width gamma) is evaluated using the
+# Faddeeva function w(z), z = (x - x0 + i gamma) / (sigma sqrt(2)):
+#
+#   V(x) = Re[w(z)] / (sigma sqrt(2 pi))
+#
+# It is normalized to unit area like the Cauchy distribution, amp is the
+# area of the line. w'(z) = -2 z w(z) + 2i / sqrt(pi) gives the derivative
+# with respect to x (the differential Voigt line) and all parameter
+# derivatives. The profile only depends on |sigma| and |gamma|, the widths
+# are used by absolute value so they can stay unbounded like the widths of
+# the other shapes.
+
+_SQRT2 = np.sqrt(2.0)
+_SQRTPI = np.sqrt(np.pi)
+_TINY = 1e-300
+
+def _z(x, x0, sigma, gamma):
+    s = max(abs(float(sigma)), _TINY)
+    z = np.asarray(x, dtype = np.float64) - x0
+    z = z + 1j * abs(float(gamma))
+    z /= s * _SQRT2
+    return z, s
+
+def _dwofz(z, w):
+    return -2.0 * z * w + 2j / _SQRTPI
+
+def voigt(x, amp, x0, sigma, gamma, offset = 0.0):
+    """Voigt line of area amp"""
+    z, s = _z(x, x0, sigma, gamma)
+    return amp * wofz(z).real / (s * _SQRT2 * _SQRTPI) + offset
+
+def differential_voigt(x, amp, x0, sigma, gamma, offset = 0.0):
+    """Derivative (with respect to x) of the Voigt line of area amp"""
+    z, s = _z(x, x0, sigma, gamma)
+    return -amp * (z * wofz(z)).real / (s * s * _SQRTPI) + offset
+
+def _voigt_jacobian(x, amp, x0, sigma, gamma, differential):
+    # Columns: amp, x0, sigma, gamma, offset. d/dx0 = -dz/dx * d/dz,
+    # d/dgamma = i * dz/dx * d/dz (times the sign of gamma), d/dsigma =
+    # -z/sigma * d/dz plus the derivative of the prefactor (times the
+    # sign of sigma)
+    z, s = _z(x, x0, sigma, gamma)
+    w = wofz(z)
+    dzdx = 1.0 / (s * _SQRT2)
+    sgs = -1.0 if sigma < 0 else 1.0
+    sgg = -1.0 if gamma < 0 else 1.0
+    jac = np.empty((len(z), 5))
+    jac[:,4] = 1.0
+
+    if not differential:
+        c = 1.0 / (s * _SQRT2 * _SQRTPI)
+        f, df = w, _dwofz(z, w)
+        p = 1
+    else:
+        c = -1.0 / (s * s * _SQRTPI)
+        f = z * w
+        df = w + z * _dwofz(z, w)
+        p = 2
+
+    jac[:,0] = c * f.real
+    jac[:,1] = -amp * c * dzdx * df.real
+    jac[:,2] = sgs * amp * c * ((-z / s * df).real - p / s * f.real)
+    jac[:,3] = sgg * amp * c * dzdx * (1j * df).real
+    return jac
+
+def _line_guess(x, data, differential):
+    # Position, sign, height, full width at half maximum and baseline of
+    # the dominant line (of the dominant derivative line)
+    x = np.asarray(x, dtype = np.float64)
+    data = np.asarray(data, dtype = np.float64)
+    imax, imin = np.argmax(data), np.argmin(data)
+    dx = abs(x[-1] - x[0]) / max(len(x) - 1, 1)
+
+    if differential:
+        offs = np.median(data)
+        x0 = 0.5 * (x[imax] + x[imin])
+        # Peak to peak distance of a derivative line is about 0.6 FWHM
+        fwhm = max(abs(x[imax] - x[imin]) / 0.6, 2 * dx)
+        height = data[imax] - data[imin]
+        sign = 1.0 if x[imax] < x[imin] else -1.0
+        return x0, sign, height, fwhm, offs
+
+    if (np.max(data) - np.mean(data)) > (np.mean(data) - np.min(data)):
+        sign, ipk, offs = 1.0, imax, np.min(data)
+    else:
+        sign, ipk, offs = -1.0, imin, np.max(data)
+    height = abs(data[ipk] - offs)
+    above = np.abs(data - offs) >= 0.5 * height
+    fwhm = max(np.count_nonzero(above) * dx, 2 * dx)
+    return x[ipk], sign, height, fwhm, offs
+
+def _scale_guess(unit, x, x0, sign, height, differential):
+    # Amplitude that reproduces the observed height (or peak to peak
+    # height of derivative lines) with the guessed widths
+    u = unit(x)
+    uh = (np.max(u) - np.min(u)) if differential else np.max(np.abs(u))
+    if (not np.isfinite(uh)) or (uh <= 0):
+        return sign * height
+    return sign * height / uh
+
+class MixfitFunctionVoigtFactory(MixfitFunctionFactory):
+    def __init__(self, *args, **kwargs):
+        super().__init__(
+            "VOIGT",
+            "Voigt",
+            "Voigt profile",
+            [
+                { "name" : "x0", "desc" : "Center", "vary" : True, "min" : None, "max" : None },
+                { "name" : "sigma", "desc" : "Standard deviation of the Gaussian part", "vary" : True, "min" : None, "max" : None },
+                { "name" : "gamma", "desc" : "Half width of the Cauchy part", "vary" : True, "min" : None, "max" : None },
+                { "name" : "amp", "desc" : "Area", "vary" : True, "min" : None, "max" : None },
+                { "name" : "offset", "desc" : "Constant offset", "vary" : True, "min" : None, "max" : None }
+            ]
+        )
+        if "limits" in kwargs:
+            self._limits = kwargs["limits"]
+        else:
+            self._limits = None
+
+    def __call__(self, *args, **kwargs):
+        return MixfitFunctionVoigt(*args, limits = self._limits, template = self._get_template(), **kwargs)
+
+class MixfitFunctionDifferentialVoigtFactory(MixfitFunctionFactory):
+    def __init__(self, *args, **kwargs):
+        super().__init__(
+            "DIFFVOIGT",
+            "Differential Voigt",
+            "Derivative of the Voigt profile",
+            [
+                { "name" : "x0", "desc" : "Center", "vary" : True, "min" : None, "max" : None },
+                { "name" : "sigma", "desc" : "Standard deviation of the Gaussian part", "vary" : True, "min" : None, "max" : None },
+                { "name" : "gamma", "desc" : "Half width of the Cauchy part", "vary" : True, "min" : None, "max" : None },
+                { "name" : "amp", "desc" : "Area of the integrated line", "vary" : True, "min" : None, "max" : None },
+                { "name" : "offset", "desc" : "Constant offset", "vary" : True, "min" : None, "max" : None }
+            ]
+        )
+        if "limits" in kwargs:
+            self._limits = kwargs["limits"]
+        else:
+            self._limits = None
+
+    def __call__(self, *args, **kwargs):
+        return MixfitFunctionDifferentialVoigt(*args, limits = self._limits, template = self._get_template(), **kwargs)
+
+class MixfitFunctionVoigt(MixfitFunction):
+    _differential = False
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(
+            "VOIGT",
+            "Voigt",
+            "Voigt profile",
+            [
+                { "name" : "x0", "desc" : "Center", "vary" : True, "min" : None, "max" : None },
+                { "name" : "sigma", "desc" : "Standard deviation of the Gaussian part", "vary" : True, "min" : None, "max" : None },
+                { "name" : "gamma", "desc" : "Half width of the Cauchy part", "vary" : True, "min" : None, "max" : None },
+                { "name" : "amp", "desc" : "Area", "vary" : True, "min" : None, "max" : None },
+                { "name" : "offset", "desc" : "Constant offset", "vary" : True, "min" : None, "max" : None }
+            ],
+            *args,
+            **kwargs
+        )
+
+    def _parse_pparms(self, ppars):
+        if self._prefix is not None:
+            pfx = f"{self._prefix}_"
+        else:
+            pfx = ""
+        return ppars[f"{pfx}amp"], ppars[f"{pfx}x0"], ppars[f"{pfx}sigma"], ppars[f"{pfx}gamma"], ppars[f"{pfx}offset"]
+
+    def _values(self, pars):
+        return [ float(getattr(v, "value", v)) for v in self._parse_pparms(pars) ]
+
+    def __call__(self, pars, x, *, data = None):
+        amp, x0, sigma, gamma, offs = self._values(pars)
+        if self._differential:
+            res = differential_voigt(x, amp, x0, sigma, gamma, offs)
+        else:
+            res = voigt(x, amp, x0, sigma, gamma, offs)
+        if data is None:
+            return res
+        return data - res
+
+    def jacobian(self, pars, x):
+        amp, x0, sigma, gamma, offs = self._values(pars)
+        jac = _voigt_jacobian(x, amp, x0, sigma, gamma, self._differential)
+        # Columns in the order of the parameter descriptors
+        return jac[:,[ 1, 2, 3, 0, 4 ]]
+
+    def guess(self, x, data):
+        pfx = ""
+        if self._prefix is not None:
+            pfx = f"{self._prefix}_"
+        x0, sign, height, fwhm, offs = _line_guess(x, data, self._differential)
+
+        # Equal Gaussian and Cauchy widths: the FWHM of the Voigt line is
+        # about 1.64 times the FWHM of each part
+        sigma = fwhm / (1.6376 * 2.0 * np.sqrt(2.0 * np.log(2.0)))
+        gamma = fwhm / (1.6376 * 2.0)
+        unit = differential_voigt if self._differential else voigt
+        amp = _scale_guess(lambda xx: unit(xx, 1.0, x0, sigma, gamma), x, x0, sign, height, self._differential)
+        return {
+            f"{pfx}amp" : amp,
+            f"{pfx}x0" : x0,
+            f"{pfx}sigma" : sigma,
+            f"{pfx}gamma" : gamma,
+            f"{pfx}offset" : offs
+        }
+
+    def _p_repr(self, params):
+        amp, x0, sigma, gamma, offs = self._parse_pparms(params)
+        return f"{self._title.replace(' ', '')}(amp={amp.value}+-{amp.stderr}, x0={x0.value}+-{x0.stderr}, sigma={sigma.value}+-{sigma.stderr}, gamma={gamma.value}+-{gamma.stderr}, offset={offs.value}+-{offs.stderr})"
+
+class MixfitFunctionDifferentialVoigt(MixfitFunctionVoigt):
+    _differential = True
+
+    def __init__(self, *args, **kwargs):
+        MixfitFunction.__init__(
+            self,
+            "DIFFVOIGT",
+            "Differential Voigt",
+            "Derivative of the Voigt profile",
+            [
+                { "name" : "x0", "desc" : "Center", "vary" : True, "min" : None, "max" : None },
+                { "name" : "sigma", "desc" : "Standard deviation of the Gaussian part", "vary" : True, "min" : None, "max" : None },
+                { "name" : "gamma", "desc" : "Half width of the Cauchy part", "vary" : True, "min" : None, "max" : None },
+                { "name" : "amp", "desc" : "Area of the integrated line", "vary" : True, "min" : None, "max" : None },
+                { "name" : "offset", "desc" : "Constant offset", "vary" : True, "min" : None, "max" : None }
+            ],
+            *args,
+            **kwargs
+        )
@@ -0,0 +1,56 @@
+import numpy as np
+import pytest
+
+from mixfit.mixfit import Mixfit
+from mixfitfunctions import kernels
+
+def _spectrum(noise = 0.01):
+    x = np.linspace(0, 100, 800)
+    rng = np.random.default_rng(2)
+    data = kernels.evaluate(kernels.GAUSSIAN, x, 2.0, 30, 2.0, 0.0) + kernels.evaluate(kernels.CAUCHY, x, 3.0, 65, 3.0, 0.0)
+    return x, data + noise * rng.standard_normal(len(x))
+
+def test_unknown_acceptance_test():
+    with pytest.raises(ValueError):
+        Mixfit(acceptance = "aic")
+
+@pytest.mark.parametrize("chi, candidateChi, expected", [ (10.0, 9.0, True), (10.0, 10.0, False), (10.0, 11.0, False) ])
+def test_chi_without_threshold(chi, candidateChi, expected):
+    assert Mixfit(acceptance = "chi")._accept(chi, candidateChi, 4, 100) == expected
+
+def test_chi_with_threshold():
+    mf = Mixfit(acceptance = "chi", minResiduumImprovement = 0.5)
+    assert mf._accept(10.0, 9.4, 4, 100)
+    assert not mf._accept(10.0, 9.6, 4, 100)
+
+def test_bic():
+    mf = Mixfit(acceptance = "bic")
+    n, k = 1000, 4
+    # n ln(chi / candidateChi) has to exceed k ln(n) = 27.6
+    assert mf._accept(1.0, np.exp(-0.03), k, n)
+    assert not mf._accept(1.0, np.exp(-0.02), k, n)
+    assert mf._accept(1.0, 0.0, k, n)
+    assert not mf._accept(0.0, 0.0, k, n)
+
+def test_bic_stops_at_noise():
+    x, data = _spectrum()
+    res = Mixfit(allowed = [ "GAUSSIAN", "CAUCHY" ], acceptance = "bic", maxIterations = 8).fit(x, data)
+    assert len(res._functions) == 2
+
+def test_rejected_candidate_is_not_refined():
+    x, data = _spectrum()
+    res = Mixfit(allowed = [ "GAUSSIAN", "CAUCHY" ], acceptance = "chi", minResiduumImprovement = 1e6).fit(x, data)
+    assert len(res._functions) == 0
+    assert len(res._chis) == 0
+
+@pytest.mark.parametrize("loss", [ None, "huber" ])
+def test_acceptance_keeps_stage_input(loss):
+    # Accepted stages have to give the same mixture as without the test,
+    # also for warm started fits reusing the previous stage input
+    x, data = _spectrum()
+    weights = np.linspace(0.5, 1.5, len(x))
+    kws = { "allowed" : [ "GAUSSIAN", "CAUCHY" ], "maxIterations" : 2, "warmStart" : True, "loss" : loss, "lossScale" : 0.05 }
+    ref = Mixfit(**kws).fit(x, data, weights = weights)
+    res = Mixfit(acceptance = "chi", **kws).fit(x, data, weights = weights)
+    assert [ f._fid for f in res._functions ] == [ f._fid for f in ref._functions ]
+    assert np.allclose(res._chis, ref._chis)
@@ -0,0 +1,147 @@
+import asyncio
+import threading
+import time
+
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+import pytest
+
+from mixfit.mixfit import Mixfit, MixfitCancelledError, Mixture
+from mixfitfunctions import kernels
+
+def _spectra(count = 2):
+    x = np.linspace(0, 100, 1001)
+    rng = np.random.default_rng(10)
+    res = []
+    for i in range(count):
+        data = kernels.evaluate(kernels.GAUSSIAN, x, 2.0, 30 + i, 2.0, 0.0) + kernels.evaluate(kernels.CAUCHY, x, 1.0, 70 - i, 3.0, 0.0)
+        res.append(data + 0.01 * rng.standard_normal(len(x)))
+    return x, res
+
+class _RecordingExecutor(ThreadPoolExecutor):
+    """Thread pool that keeps the submitted futures and the largest number
+    of unfinished ones"""
+    def __init__(self, maxWorkers):
+        super().__init__(max_workers = maxWorkers)
+        self.futures = []
+        self.inFlight = 0
+        self.maxInFlight = 0
+        self._lock = threading.Lock()
+
+    def submit(self, fn, *args, **kwargs):
+        with self._lock:
+            self.inFlight = self.inFlight + 1
+            self.maxInFlight = max(self.maxInFlight, self.inFlight)
+        f = super().submit(fn, *args, **kwargs)
+        self.futures.append(f)
+        f.add_done_callback(self._done)
+        return f
+
+    def _done(self, _):
+        with self._lock:
+            self.inFlight = self.inFlight - 1
+
+@pytest.fixture
+def slow_stages(monkeypatch):
+    # Every refinement takes at least 50 ms so fits can be cancelled while
+    # they are running
+    refine = Mixture._refine
+    def slow(self, *args, **kwargs):
+        time.sleep(0.05)
+        return refine(self, *args, **kwargs)
+    monkeypatch.setattr(Mixture, "_refine", slow)
+
+def _assert_same_fit(a, b):
+    assert [ f._fid for f in a._functions ] == [ f._fid for f in b._functions ]
+    assert np.allclose(a._chis, b._chis)
+
+@pytest.mark.parametrize("pool", [ ThreadPoolExecutor, ProcessPoolExecutor ])
+def test_batch_matches_fit(pool):
+    x, spectra = _spectra()
+    with pool(2) as executor:
+        mf = Mixfit(allowed = [ "GAUSSIAN", "CAUCHY" ], maxIterations = 2, executor = executor)
+        results = asyncio.run(mf.fit_batch_async(x, spectra))
+    for res, data in zip(results, spectra):
+        _assert_same_fit(res, mf.fit(x, data))
+
+def test_owned_pool():
+    x, spectra = _spectra(1)
+    mf = Mixfit(allowed = [ "GAUSSIAN", "CAUCHY" ], maxIterations = 2)
+    try:
+        res = asyncio.run(mf.fit_async(x, spectra[0]))
+    finally:
+        mf.close()
+    _assert_same_fit(res, mf.fit(x, spectra[0]))
+
+def test_cancel_running_fit(slow_stages):
+    x, spectra = _spectra(1)
+    with _RecordingExecutor(1) as executor:
+        mf = Mixfit(allowed = [ "GAUSSIAN", "CAUCHY" ], maxIterations = 20, minResiduumImprovement = None, executor = executor)
+
+        async def run():
+            task = asyncio.ensure_future(mf.fit_async(x, spectra[0]))
+            await asyncio.sleep(0.2)
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+        asyncio.run(run())
+
+        # The worker stops at the next stage instead of finishing the fit
+        with pytest.raises(MixfitCancelledError):
+            executor.futures[0].result(timeout = 5)
+
+def test_cancel_queued_fit(slow_stages):
+    x, spectra = _spectra(2)
+    with _RecordingExecutor(1) as executor:
+        mf = Mixfit(allowed = [ "GAUSSIAN", "CAUCHY" ], maxIterations = 2, executor = executor)
+
+        async def run():
+            first = asyncio.ensure_future(mf.fit_async(x, spectra[0]))
+            queued = asyncio.ensure_future(mf.fit_async(x, spectra[1]))
+            await asyncio.sleep(0.01)
+            queued.cancel()
+            res = await first
+            with pytest.raises(asyncio.CancelledError):
+                await queued
+            return res
+        res = asyncio.run(run())
+
+    assert len(res._functions) == 2
+    assert executor.futures[1].cancelled()
+
+def test_cancel_batch(slow_stages):
+    x, spectra = _spectra(3)
+    with _RecordingExecutor(3) as executor:
+        mf = Mixfit(allowed = [ "GAUSSIAN", "CAUCHY" ], maxIterations = 20, minResiduumImprovement = None, executor = executor)
+
+        async def run():
+            task = asyncio.ensure_future(mf.fit_batch_async(x, spectra))
+            await asyncio.sleep(0.2)
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+        asyncio.run(run())
+
+        for f in executor.futures:
+            with pytest.raises(MixfitCancelledError):
+                f.result(timeout = 5)
+
+def test_max_pending_backpressure():
+    x, spectra = _spectra(6)
+    with _RecordingExecutor(4) as executor:
+        mf = Mixfit(allowed = [ "GAUSSIAN", "CAUCHY" ], maxIterations = 2, executor = executor, maxPending = 2)
+        results = asyncio.run(mf.fit_batch_async(x, spectra))
+
+    assert len(results) == 6
+    assert len(executor.futures) == 6
+    assert executor.maxInFlight == 2
+    for res, data in zip(results, spectra):
+        _assert_same_fit(res, mf.fit(x, data))
+
+def test_weights_per_data_set():
+    x, spectra = _spectra(2)
+    with ThreadPoolExecutor(1) as executor:
+        mf = Mixfit(maxIterations = 1, executor = executor)
+        with pytest.raises(ValueError):
+            asyncio.run(mf.fit_batch_async(x, spectra, weights = [ None ]))
@@ -0,0 +1,80 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+
+from mixfit import bootstrap
+from mixfit.execution import ExecutionPolicy
+from mixfit.mixfit import Mixfit, Mixture
+from mixfitfunctions import kernels, registry
+
+def _spectrum():
+    x = np.linspace(0, 100, 500)
+    rng = np.random.default_rng(9)
+    data = 0.5 + 2e-3 * x + kernels.evaluate(kernels.GAUSSIAN, x, 2.0, 40, 3.0, 0.0)
+    return x, data + 0.01 * rng.standard_normal(len(x))
+
+@pytest.fixture(scope = "module")
+def fitted():
+    # The offset of the line and the intercept of the slope are degenerate
+    x, data = _spectrum()
+    res = Mixture()
+    for i, (fid, values) in enumerate([
+        ("GAUSSIAN", { "amp" : 1.5, "mu" : 41, "sigma" : 2.0, "offset" : 0.3 }),
+        ("LINEAR", { "slope" : 0.0, "intercept" : 0.2 })
+    ]):
+        fun = registry.create(fid)(prefix = f"f{i}")
+        res._functions.append(fun)
+        res._params.append(fun.lmparams({ f"f{i}_{n}" : v for n, v in values.items() }))
+    res._refine(x, data)
+    return Mixfit(allowed = [ "GAUSSIAN", "LINEAR" ], maxIterations = 2), x, data, res
+
+def test_offset_names_include_intercepts(fitted):
+    mf, x, data, res = fitted
+    names = bootstrap._offset_names(res)
+    assert len(names) == 2
+    assert any([ n.endswith("_intercept") for n in names ])
+
+@pytest.mark.parametrize("method", bootstrap.METHODS)
+def test_offset_interval_with_linear_component(fitted, method):
+    mf, x, data, res = fitted
+    with ThreadPoolExecutor(1) as executor:
+        bs = mf.bootstrap(x, data, res, n = 20, method = method, seed = 1, executor = executor)
+
+    assert bs.samples.shape == (20, len(bs.names))
+    assert not np.any(np.isnan(bs.samples))
+    low, high = bs.interval("offset")
+    assert np.isfinite(low) and np.isfinite(high)
+    # The baseline at x = 0 is 0.5, it is determined to about the noise
+    assert high - low < 0.05
+    assert low - 0.02 < 0.5 < high + 0.02
+    low, high = bs.interval([ n for n in bs.names if n.endswith("_mu") ][0])
+    assert low < 40 < high
+    assert high - low < 0.1
+
+def test_seed_reproduces_result(fitted):
+    mf, x, data, res = fitted
+    with ThreadPoolExecutor(2) as executor:
+        a = mf.bootstrap(x, data, res, n = 8, seed = 3, executor = executor, chunks = 2)
+        b = mf.bootstrap(x, data, res.compact(), n = 8, seed = 3, executor = executor, chunks = 2)
+    assert np.array_equal(a.samples, b.samples)
+
+def test_default_chunks_follow_policy(fitted, monkeypatch):
+    mf, x, data, res = fitted
+    counts = []
+    refit = bootstrap.refit_task
+    def spy(*args):
+        counts.append(args[6])
+        return refit(*args)
+    monkeypatch.setattr(bootstrap, "refit_task", spy)
+
+    mf = Mixfit(allowed = [ "GAUSSIAN", "LINEAR" ], maxIterations = 2, policy = ExecutionPolicy(cores = 2))
+    with ThreadPoolExecutor(1) as executor:
+        mf.bootstrap(x, data, res, n = 16, seed = 1, executor = executor)
+    assert counts == [ 2 ] * 8
+
+@pytest.mark.parametrize("kwargs", [ { "n" : 1 }, { "method" : "jackknife" }, { "level" : 1.0 }, { "chunks" : 0 } ])
+def test_invalid_arguments(fitted, kwargs):
+    mf, x, data, res = fitted
+    with pytest.raises(ValueError):
+        mf.bootstrap(x, data, res, **kwargs)
@@ -0,0 +1,63 @@
+import time
+
+import numpy as np
+import pytest
+
+from mixfit.mixfit import Mixfit, Mixture
+from mixfitfunctions import kernels
+
+def _spectrum():
+    x = np.linspace(0, 100, 1000)
+    rng = np.random.default_rng(11)
+    data = np.sum([ kernels.evaluate(kernels.GAUSSIAN, x, 1.0 + i, 15 + 15 * i, 2.0, 0.0) for i in range(5) ], axis = 0)
+    return x, data + 0.01 * rng.standard_normal(len(x))
+
+def _mixfit(**kwargs):
+    return Mixfit(allowed = [ "GAUSSIAN", "CAUCHY" ], maxIterations = 5, **kwargs)
+
+def _assert_anytime_result(res, x, data):
+    # The returned mixture is the best one found so far, its chi^2 history
+    # ends with its own chi^2 and only contains improving stages
+    assert res._budgetExhausted
+    assert len(res._chis) == len(res._functions)
+    if len(res._chis) > 0:
+        assert np.isclose(res._chis[-1], res._chisqr(x, data))
+        assert np.all(np.diff(res._chis) < 0)
+
+def test_unlimited_fit():
+    x, data = _spectrum()
+    res = _mixfit(maxNfev = 10000).fit(x, data)
+    assert not res._budgetExhausted
+    assert len(res._functions) == 5
+
+@pytest.mark.parametrize("maxNfev", [ 5, 20, 60, 100 ])
+def test_nfev_budget(maxNfev):
+    x, data = _spectrum()
+    full = _mixfit().fit(x, data)
+    res = _mixfit(maxNfev = maxNfev).fit(x, data)
+
+    _assert_anytime_result(res, x, data)
+    assert res._nfev <= maxNfev
+    assert res._nfev < full._nfev
+    if len(res._chis) > 0:
+        assert res._chis[-1] >= full._chis[-1]
+
+def test_time_budget(monkeypatch):
+    refine = Mixture._refine
+    def slow(self, *args, **kwargs):
+        time.sleep(0.1)
+        return refine(self, *args, **kwargs)
+    monkeypatch.setattr(Mixture, "_refine", slow)
+
+    x, data = _spectrum()
+    start = time.monotonic()
+    res = _mixfit(maxTime = 0.25).fit(x, data)
+    assert time.monotonic() - start < 2.0
+
+    _assert_anytime_result(res, x, data)
+    assert 1 <= len(res._functions) < 5
+
+@pytest.mark.parametrize("kwargs", [ { "maxTime" : 0 }, { "maxTime" : -1.0 }, { "maxNfev" : 0 }, { "maxNfev" : 1.5 } ])
+def test_invalid_budgets(kwargs):
+    with pytest.raises(ValueError):
+        Mixfit(**kwargs)
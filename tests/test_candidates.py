@@ -0,0 +1,62 @@
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+
+from mixfit.mixfit import Mixfit
+from mixfitfunctions import kernels
+
+def _spectrum(shift):
+    x = np.linspace(0, 100, 1001)
+    rng = np.random.default_rng(12)
+    data = kernels.evaluate(kernels.GAUSSIAN, x, 2.0, 30 + shift, 2.0, 0.0) + kernels.evaluate(kernels.CAUCHY, x, 1.0, 70 - shift, 3.0, 0.0)
+    return x, data + 0.01 * rng.standard_normal(len(x))
+
+def _snapshot(res):
+    return [ [ (n, p.value, p.stderr, p.vary, p.min, p.max) for n, p in params.items() ] for params in res._params ], list(res._chis), res._nfev
+
+def _cached(mf):
+    return list(getattr(mf._candidateCache, "cache", {}).values())
+
+@pytest.mark.parametrize("warmStart", [ False, True ])
+def test_cached_parameters_give_identical_fits(warmStart):
+    kws = { "allowed" : [ "GAUSSIAN", "CAUCHY", "LINEAR" ], "maxIterations" : 3, "warmStart" : warmStart }
+    mf = Mixfit(**kws)
+    mf.fit(*_spectrum(0))
+    assert len(_cached(mf)) > 0
+
+    # The second fit runs on the cached Parameters of the first one
+    x, data = _spectrum(5)
+    assert _snapshot(mf.fit(x, data)) == _snapshot(Mixfit(**kws).fit(x, data))
+
+@pytest.mark.parametrize("warmStart", [ False, True ])
+def test_results_do_not_share_cached_parameters(warmStart):
+    mf = Mixfit(allowed = [ "GAUSSIAN", "CAUCHY" ], maxIterations = 2, warmStart = warmStart)
+    first = mf.fit(*_spectrum(0))
+    before = _snapshot(first)
+    second = mf.fit(*_spectrum(5))
+
+    # Later fits neither modify earlier results nor hand out the cached objects
+    assert _snapshot(first) == before
+    cached = [ id(lmp) for _, lmp in _cached(mf) ]
+    for res in (first, second):
+        for params in res._params:
+            assert id(params) not in cached
+
+def test_cache_per_thread():
+    mf = Mixfit(allowed = [ "GAUSSIAN", "CAUCHY" ], maxIterations = 2)
+    spectra = [ _spectrum(s) for s in (0, 3, 5, 7) ]
+    expected = [ _snapshot(Mixfit(allowed = [ "GAUSSIAN", "CAUCHY" ], maxIterations = 2).fit(x, d)) for x, d in spectra ]
+
+    caches = set()
+    def fit(x, data):
+        res = mf.fit(x, data)
+        caches.add((threading.get_ident(), id(mf._candidateCache.cache)))
+        return _snapshot(res)
+    with ThreadPoolExecutor(2) as executor:
+        results = list(executor.map(lambda s: fit(*s), spectra))
+
+    assert results == expected
+    assert len(set([ c for _, c in caches ])) == len(set([ t for t, _ in caches ]))
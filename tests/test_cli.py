@@ -0,0 +1,84 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+from mixfit import cli
+from mixfit.store import ResultStore
+from mixfitfunctions import kernels
+
+@pytest.fixture
+def batch(tmp_path):
+    x = np.linspace(0, 100, 501)
+    for i in range(2):
+        y = kernels.evaluate(kernels.GAUSSIAN, x, 2.0, 40 + 10 * i, 3.0, 0.0)
+        np.savez(tmp_path / f"run{i}.npz", f = x, I = y)
+    config = tmp_path / "config.json"
+    config.write_text(json.dumps({ "x" : "f", "y" : "I", "maxIterations" : 1, "allowed" : [ "GAUSSIAN" ] }))
+    return tmp_path, str(config)
+
+@pytest.fixture
+def closed(monkeypatch):
+    calls = []
+    close = ResultStore.close
+    def spy(self):
+        calls.append(self)
+        close(self)
+    monkeypatch.setattr(ResultStore, "close", spy)
+    return calls
+
+def test_run_and_resume(batch, closed):
+    path, config = batch
+    out = str(path / "results.jsonl")
+    store = str(path / "results.sqlite")
+    argv = [ "-q", "-j", "1", "-c", config, "-o", out, "-s", store, str(path) ]
+
+    assert cli.main(argv) == 0
+    records = [ json.loads(l) for l in open(out) ]
+    assert sorted([ r["status"] for r in records ]) == [ "ok", "ok" ]
+    assert len(closed) == 1
+    with ResultStore(store) as s:
+        assert len(s.fits()["fit_id"]) == 2
+
+    # Everything is done already
+    assert cli.main(argv) == 0
+    assert len(open(out).readlines()) == 2
+
+def test_interrupt_closes_store(batch, closed, monkeypatch):
+    path, config = batch
+    def interrupt(*args, **kwargs):
+        raise KeyboardInterrupt()
+    monkeypatch.setattr(cli, "wait", interrupt)
+
+    out = path / "results.jsonl"
+    assert cli.main([ "-q", "-j", "1", "-c", config, "-o", str(out), "-s", str(path / "results.sqlite"), str(path) ]) == 130
+    assert len(closed) == 1
+    assert out.read_text() == ""
+
+def _killed(path, xkey, ykey, meanAxis):
+    # Worker process that dies like one killed when running out of memory
+    os._exit(1)
+
+def test_broken_pool(batch, monkeypatch):
+    path, config = batch
+    x = np.linspace(0, 100, 501)
+    for i in range(2, 5):
+        np.savez(path / f"run{i}.npz", f = x, I = kernels.evaluate(kernels.GAUSSIAN, x, 2.0, 40, 3.0, 0.0))
+    out = path / "results.jsonl"
+    argv = [ "-q", "-j", "1", "-c", config, "-o", str(out), str(path) ]
+
+    monkeypatch.setattr(cli, "_fit_unit", _killed)
+    assert cli.main(argv) == 1
+    records = [ json.loads(l) for l in open(out) ]
+    assert sorted([ os.path.basename(r["file"]) for r in records ]) == [ f"run{i}.npz" for i in range(5) ]
+    assert all([ (r["status"] == "error") and r["error"].startswith("BrokenProcessPool") for r in records ])
+
+    # Failed fits are run again on restart
+    monkeypatch.undo()
+    assert cli.main(argv) == 0
+    records = [ json.loads(l) for l in open(out) ]
+    assert [ r["status"] for r in records ].count("ok") == 5
+
+def test_missing_keys(tmp_path):
+    assert cli.main([ "-q", "-o", str(tmp_path / "out.jsonl"), str(tmp_path) ]) == 2
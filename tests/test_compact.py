@@ -0,0 +1,82 @@
+import pickle
+
+import numpy as np
+import pytest
+
+from mixfit.compact import CompactMixture
+from mixfit.mixfit import Mixfit
+from mixfitfunctions import kernels
+
+def _spectrum():
+    x = np.linspace(0, 100, 1001)
+    rng = np.random.default_rng(8)
+    data = 0.1 + 1e-3 * x + kernels.evaluate(kernels.GAUSSIAN, x, 2.0, 30, 2.0, 0.0) + kernels.evaluate(kernels.CAUCHY, x, 3.0, 70, 3.0, 0.0)
+    return x, data + 0.01 * rng.standard_normal(len(x))
+
+@pytest.fixture(scope = "module")
+def fitted():
+    x, data = _spectrum()
+    return x, data, Mixfit(allowed = [ "GAUSSIAN", "CAUCHY", "LINEAR" ], maxIterations = 3).fit(x, data)
+
+def _assert_same(a, b):
+    assert [ f._fid for f in a._functions ] == [ f._fid for f in b._functions ]
+    for pa, pb in zip(a._params, b._params):
+        assert sorted(pa) == sorted(pb)
+        for n in pa:
+            assert pa[n].value == pb[n].value
+            assert (pa[n].min, pa[n].max, pa[n].vary) == (pb[n].min, pb[n].max, pb[n].vary)
+            assert (pa[n].stderr is None) == (pb[n].stderr is None)
+            if pa[n].stderr is not None:
+                assert pa[n].stderr == pb[n].stderr
+    assert list(a._chis) == list(b._chis)
+    assert a._nfev == b._nfev
+    assert a._budgetExhausted == b._budgetExhausted
+
+def test_round_trip(fitted):
+    x, data, res = fitted
+    compact = res.compact()
+    assert len(compact) == len(res._functions)
+    assert compact.fids() == [ f._fid for f in res._functions ]
+    _assert_same(compact.to_mixture(), res)
+
+    fun, params = res._functions[0], res._params[0]
+    for n, p in params.items():
+        value, stderr = compact.params(0)[fun._pnames[n]]
+        assert value == p.value
+        assert np.isnan(stderr) if p.stderr is None else (stderr == p.stderr)
+
+def test_evaluation_matches_mixture(fitted):
+    x, data, res = fitted
+    compact = res.compact()
+    assert np.allclose(compact(x), res(x))
+    assert np.allclose(compact(x, data = data), res(x, data = data))
+
+def test_evaluation_without_kernels():
+    x, data = _spectrum()
+    res = Mixfit(allowed = [ "VOIGT", "GAUSSIAN" ], maxIterations = 2).fit(x, data)
+    compact = CompactMixture.from_mixture(res)
+    assert any([ t.kernel is None for t in compact._types ])
+    assert np.allclose(compact(x), res(x))
+    _assert_same(compact.to_mixture(), res)
+
+def test_pickle_round_trip(fitted):
+    x, data, res = fitted
+    compact = res.compact()
+    back = pickle.loads(pickle.dumps(compact))
+    # Component types are interned again when unpickled
+    assert all([ a is b for a, b in zip(back._types, compact._types) ])
+    assert np.array_equal(back._values, compact._values)
+    assert np.array_equal(back._stderr, compact._stderr, equal_nan = True)
+    _assert_same(back.to_mixture(), res)
+
+def test_shared_types(fitted):
+    x, data, res = fitted
+    a = res.compact()
+    b = res.compact()
+    assert all([ ta is tb for ta, tb in zip(a._types, b._types) ])
+
+def test_value_count_mismatch(fitted):
+    x, data, res = fitted
+    compact = res.compact()
+    with pytest.raises(ValueError):
+        CompactMixture(compact._types, compact._values[:-1], compact._stderr, compact._chis)
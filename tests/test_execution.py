@@ -0,0 +1,103 @@
+import os
+import sys
+import threading
+import types
+
+import pytest
+
+from mixfit import execution
+from mixfit.execution import ExecutionPolicy
+from mixfit.mixfit import Mixfit
+
+class _FakeLimiter:
+    def __init__(self, log, limits):
+        self._log = log
+        log.append(("limit", limits))
+
+    def restore_original_limits(self):
+        self._log.append(("restore",))
+
+@pytest.fixture
+def threadpoolctl(monkeypatch):
+    log = []
+    module = types.ModuleType("threadpoolctl")
+    module.threadpool_limits = lambda limits = None: _FakeLimiter(log, limits)
+    monkeypatch.setitem(sys.modules, "threadpoolctl", module)
+    return log
+
+@pytest.mark.parametrize("kwargs", [ { "cores" : 0 }, { "workers" : 0 }, { "threads" : 0 }, { "cores" : 1.5 } ])
+def test_invalid_policy(kwargs):
+    with pytest.raises(ValueError):
+        ExecutionPolicy(**kwargs)
+
+def test_policy_split():
+    policy = ExecutionPolicy(cores = 8, workers = 4)
+    assert policy.threads == 2
+    assert policy.pool_workers(2) == 2
+    assert policy.pool_threads(2) == 4
+    assert ExecutionPolicy(cores = 8, workers = 4, threads = 1).pool_threads(2) == 1
+
+def test_auto_policy():
+    small = ExecutionPolicy.auto(1000, spectra = 100, factories = 4, cores = 8)
+    assert (small.workers, small.threads) == (8, 1)
+    single = ExecutionPolicy.auto(1000, spectra = 1, factories = 4, cores = 8)
+    assert (single.workers, single.threads) == (1, 8)
+    tiny = ExecutionPolicy.auto(100, spectra = 10, factories = 1, cores = 8)
+    assert tiny.workers == 1
+
+def test_thread_pool_scopes_limits(threadpoolctl, monkeypatch):
+    for k in execution._THREAD_ENV:
+        monkeypatch.delenv(k, raising = False)
+
+    started = threading.Barrier(2)
+    release = threading.Event()
+    def task():
+        started.wait(timeout = 10)
+        release.wait(timeout = 10)
+        return len(threadpoolctl)
+
+    with ExecutionPolicy(cores = 4, workers = 2).thread_pool() as pool:
+        futures = [ pool.submit(task), pool.submit(task) ]
+        release.set()
+        assert [ f.result() for f in futures ] == [ 1, 1 ]
+
+    # Overlapping tasks share one limit which is restored once
+    assert threadpoolctl == [ ("limit", 2), ("restore",) ]
+    for k in execution._THREAD_ENV:
+        assert k not in os.environ
+
+def test_thread_pool_without_threadpoolctl(monkeypatch):
+    monkeypatch.setitem(sys.modules, "threadpoolctl", None)
+    for k in execution._THREAD_ENV:
+        monkeypatch.delenv(k, raising = False)
+    with ExecutionPolicy(cores = 2, workers = 1).thread_pool() as pool:
+        assert pool.submit(lambda: 42).result() == 42
+    for k in execution._THREAD_ENV:
+        assert k not in os.environ
+
+def test_owned_executor_uses_policy(threadpoolctl):
+    mf = Mixfit(policy = ExecutionPolicy(cores = 4, workers = 2))
+    try:
+        pool = mf._get_executor()
+        assert pool.submit(lambda: 1).result() == 1
+    finally:
+        mf.close()
+    assert threadpoolctl == [ ("limit", 2), ("restore",) ]
+
+def test_owned_executor_without_policy(threadpoolctl):
+    mf = Mixfit(maxWorkers = 3)
+    try:
+        pool = mf._get_executor()
+        assert isinstance(pool, execution._LimitedThreadPoolExecutor)
+        assert pool._max_workers == 3
+    finally:
+        mf.close()
+
+def test_owned_executor_one_worker_per_core(threadpoolctl):
+    # Short traces do not shrink the owned pool, it serves all later fits
+    mf = Mixfit()
+    try:
+        pool = mf._get_executor()
+        assert pool._max_workers == execution.available_cores()
+    finally:
+        mf.close()
@@ -0,0 +1,116 @@
+import pickle
+
+import numpy as np
+import pytest
+
+from mixfit.mixfit import Mixfit
+from mixfitfunctions.expression import ExpressionFunction, ExpressionFunctionFactory
+
+PARAMS = [
+    { "name" : "amp", "desc" : "Amplitude", "init" : 1 },
+    { "name" : "x0", "desc" : "Center" },
+    { "name" : "w", "desc" : "Width", "init" : 1 },
+    { "name" : "offset", "desc" : "Constant offset", "init" : 0 }
+]
+
+def _factory(expression, params = PARAMS, **kwargs):
+    return ExpressionFunctionFactory("EXPR", "Expression", "Expression under test", expression, params, **kwargs)
+
+def _lmparams(fun, values):
+    return fun.lmparams({ f"f0_{n}" : v for n, v in values.items() })
+
+VALUES = { "amp" : 1.3, "x0" : 0.43, "w" : 1.7, "offset" : 0.2 }
+
+@pytest.mark.parametrize("expression, reference", [
+    ("amp / cosh((x - x0) / w)**2 + offset", lambda x, amp, x0, w, offset: amp / np.cosh((x - x0) / w)**2 + offset),
+    ("amp * exp(-abs(x - x0) / w) + offset", lambda x, amp, x0, w, offset: amp * np.exp(-np.abs(x - x0) / w) + offset),
+    ("amp * sin(x / w)**2 * arctan(x0) - offset", lambda x, amp, x0, w, offset: amp * np.sin(x / w)**2 * np.arctan(x0) - offset),
+    ("amp * w**(x0 + 1) + sqrt(w) * log(w) / pi + offset * e", lambda x, amp, x0, w, offset: amp * w**(x0 + 1) + np.sqrt(w) * np.log(w) / np.pi + offset * np.e + 0 * x),
+    ("-amp * tanh(x - x0) + sinh(w) * cos(x) + tan(offset)", lambda x, amp, x0, w, offset: -amp * np.tanh(x - x0) + np.sinh(w) * np.cos(x) + np.tan(offset))
+])
+def test_model_and_derivatives(expression, reference):
+    x = np.linspace(-5, 5, 101)
+    fun = _factory(expression)(prefix = "f0")
+    params = _lmparams(fun, VALUES)
+
+    assert np.allclose(fun(params, x), reference(x, **VALUES))
+    assert np.allclose(fun(params, x, data = np.ones_like(x)), 1 - reference(x, **VALUES))
+
+    jac = fun.jacobian(params, x)
+    assert jac.shape == (len(x), len(PARAMS))
+    for ip, p in enumerate(PARAMS):
+        h = 1e-6
+        hi, lo = dict(VALUES), dict(VALUES)
+        hi[p["name"]] += h
+        lo[p["name"]] -= h
+        fd = (reference(x, **hi) - reference(x, **lo)) / (2 * h)
+        assert np.allclose(jac[:,ip], fd, rtol = 1e-5, atol = 1e-7)
+
+def test_constant_expression_has_shape_of_x():
+    x = np.linspace(0, 1, 7)
+    fun = _factory("offset + 2", [ { "name" : "offset", "desc" : "Offset" } ])()
+    params = fun.lmparams({ "offset" : 1.0 })
+    assert np.allclose(fun(params, x), np.full((7,), 3.0))
+    assert np.allclose(fun.jacobian(params, x), np.ones((7, 1)))
+
+@pytest.mark.parametrize("expression", [
+    "amp * (x - ",
+    "amp * y",
+    "amp * gamma(x)",
+    "amp * np.exp(x)",
+    "amp * exp(x, w)",
+    "amp * exp(x = w)",
+    "amp * True",
+    "amp * 'x'",
+    "amp % w",
+    "not amp",
+    "x[0] * amp",
+    "amp if x else w"
+])
+def test_invalid_expressions_are_rejected(expression):
+    with pytest.raises(ValueError):
+        _factory(expression)
+
+@pytest.mark.parametrize("name", [ "x", "pi", "exp", "1a", "a-b" ])
+def test_invalid_parameter_names_are_rejected(name):
+    with pytest.raises(ValueError):
+        _factory(f"{name} * x", [ { "name" : name, "desc" : "Parameter" } ])
+
+def test_guess_has_to_be_callable():
+    with pytest.raises(ValueError):
+        _factory("amp * x + x0 + w + offset", guess = 1.0)
+
+def test_pickle_round_trip():
+    x = np.linspace(-5, 5, 11)
+    fun = _factory("amp / cosh((x - x0) / w)**2 + offset")(prefix = "f0")
+    params = _lmparams(fun, VALUES)
+    fun2 = pickle.loads(pickle.dumps(fun))
+    assert np.allclose(fun2(params, x), fun(params, x))
+    assert np.allclose(fun2.jacobian(params, x), fun.jacobian(params, x))
+
+def test_fit_uses_jacobian(monkeypatch):
+    calls = []
+    jacobian = ExpressionFunction.jacobian
+    def spy(self, pars, x):
+        calls.append(len(x))
+        return jacobian(self, pars, x)
+    monkeypatch.setattr(ExpressionFunction, "jacobian", spy)
+
+    x = np.linspace(-20, 20, 400)
+    data = 2.0 / np.cosh((x - 3.0) / 1.5)**2 + 0.1
+    factory = _factory(
+        "amp / cosh((x - x0) / w)**2 + offset",
+        guess = _guess
+    )
+    assert factory()._has_jacobian()
+
+    res = Mixfit(allowed = [ factory ], maxIterations = 1).fit(x, data)
+    assert len(calls) > 0
+    p = res._params[0]
+    assert abs(p["f0_amp"].value - 2.0) < 1e-6
+    assert abs(p["f0_x0"].value - 3.0) < 1e-6
+    assert abs(abs(p["f0_w"].value) - 1.5) < 1e-6
+
+def _guess(x, data):
+    i = np.argmax(data)
+    return { "amp" : data[i], "x0" : x[i], "w" : 1.0, "offset" : 0.0 }
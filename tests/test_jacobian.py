@@ -0,0 +1,145 @@
+import numpy as np
+import pytest
+
+from lmfit import Parameters
+
+from mixfit.mixfit import Mixfit, Mixture
+from mixfitfunctions import kernels, registry
+
+FUNCTIONS = [ "GAUSSIAN", "CAUCHY", "DIFFGAUSSIAN", "DIFFERENTIALCAUCHY", "LINEAR", "CONSTANT" ]
+VOIGT_FUNCTIONS = [ "VOIGT", "DIFFVOIGT", "PSEUDOVOIGT", "DIFFPSEUDOVOIGT" ]
+
+@pytest.fixture(params = [ "numpy", "numba" ])
+def backend(request):
+    if request.param == "numba":
+        pytest.importorskip("numba")
+    kernels.use_backend(request.param)
+    yield request.param
+    kernels.use_backend("numpy")
+
+def _data():
+    x = np.linspace(-10, 10, 300)
+    rng = np.random.default_rng(1)
+    data = np.exp(-x**2 / 3) + 0.3 * rng.standard_normal(len(x))
+    return x, data
+
+def _params(fun, x, data):
+    guess = fun.guess(x, data)
+    # Keep widths away from zero so the finite differences are well behaved
+    for n in guess:
+        if fun._pnames[n] in ("sigma", "gamma", "fwhm", "w"):
+            guess[n] = abs(guess[n]) + 0.5
+    return fun.lmparams(guess)
+
+def _finite_differences(f, params):
+    out = []
+    for n, p in params.items():
+        if not p.vary:
+            continue
+        h = 1e-6 * max(1.0, abs(p.value))
+        p1, p2 = params.copy(), params.copy()
+        p1[n].value = p.value + h
+        p2[n].value = p.value - h
+        out.append((f(p1) - f(p2)) / (2 * h))
+    return np.asarray(out).T
+
+def _mixture(fids, x, data):
+    mixture = Mixture()
+    params = Parameters()
+    for i, fid in enumerate(fids):
+        fun = registry.create(fid)(prefix = f"f{i}")
+        p = _params(fun, x, data)
+        mixture._functions.append(fun)
+        mixture._params.append(p)
+        params.add_many(*p.values())
+    return mixture, params
+
+def _assert_close(jac, fd):
+    assert jac.shape == fd.shape
+    assert np.max(np.abs(jac - fd)) <= 1e-4 * np.max(np.abs(fd))
+
+@pytest.mark.parametrize("weighted", [ False, True ])
+@pytest.mark.parametrize("loss", [ None, "huber", "soft_l1" ])
+@pytest.mark.parametrize("fid", FUNCTIONS + VOIGT_FUNCTIONS)
+def test_residual_jacobian_of_candidates(fid, loss, weighted):
+    x, data = _data()
+    kws = { "data" : data, "weights" : np.linspace(0.5, 2.0, len(x)) if weighted else None, "loss" : loss, "lossScale" : 0.2 }
+    fun = registry.create(fid)(prefix = "f0")
+    params = _params(fun, x, data)
+
+    jac = fun._residual_jacobian(params, x, **kws)
+    fd = _finite_differences(lambda p: fun._residual(p, x, **kws), params)
+    _assert_close(jac, fd)
+
+@pytest.mark.parametrize("weighted", [ False, True ])
+@pytest.mark.parametrize("loss", [ None, "huber", "soft_l1" ])
+def test_residual_jacobian_of_mixture(backend, loss, weighted):
+    x, data = _data()
+    weights = np.linspace(0.5, 2.0, len(x)) if weighted else None
+    mixture, params = _mixture(FUNCTIONS, x, data)
+    assert mixture._has_jacobian()
+
+    jac = mixture._jacobian2(params, x, data, weights, loss, 0.2)
+    fd = _finite_differences(lambda p: mixture._call2(p, x, data, weights, loss, 0.2), params)
+    _assert_close(jac, fd)
+
+@pytest.mark.parametrize("loss", [ None, "soft_l1" ])
+def test_residual_jacobian_of_mixture_without_kernels(loss):
+    x, data = _data()
+    weights = np.linspace(0.5, 2.0, len(x))
+    mixture, params = _mixture([ "GAUSSIAN", "LINEAR" ] + VOIGT_FUNCTIONS, x, data)
+    assert mixture._has_jacobian()
+
+    jac = mixture._jacobian2(params, x, data, weights, loss, 0.2)
+    fd = _finite_differences(lambda p: mixture._call2(p, x, data, weights, loss, 0.2), params)
+    _assert_close(jac, fd)
+
+@pytest.mark.parametrize("fid", VOIGT_FUNCTIONS)
+def test_fit_uses_jacobian(monkeypatch, fid):
+    factory = registry.create(fid)
+    cls = type(factory())
+    calls = []
+    jacobian = cls.jacobian
+    def spy(self, pars, x):
+        calls.append(len(x))
+        return jacobian(self, pars, x)
+    monkeypatch.setattr(cls, "jacobian", spy)
+
+    x, data = _data()
+    Mixfit(allowed = [ fid ], maxIterations = 1).fit(x, data)
+    assert len(calls) > 0
+
+def test_offsets_folded(backend):
+    x = np.linspace(0, 100, 1000)
+    rng = np.random.default_rng(0)
+    data = kernels.evaluate(kernels.GAUSSIAN, x, 1.0, 30, 2.0, 0.1) + kernels.evaluate(kernels.CAUCHY, x, 3.0, 60, 3.0, 0.0) + 0.01 * rng.standard_normal(len(x))
+
+    res = Mixfit(allowed = [ "GAUSSIAN", "CAUCHY" ], maxIterations = 2).fit(x, data)
+    assert len(res._functions) == 2
+
+    # Covariance is available, only the fixed (folded) offset has no
+    # uncertainty of its own
+    offsets = [ f._offset_name() for f in res._functions ]
+    for p in res._params:
+        for n, q in p.items():
+            if n in offsets[1:]:
+                assert q.stderr is None
+            else:
+                assert q.stderr is not None and np.isfinite(q.stderr)
+    total = np.sum([ p[n].value for p, n in zip(res._params, offsets) ])
+    assert abs(total - 0.1) < 0.01
+
+def test_fit_with_jacobians_is_pinned():
+    # Pins the result of the default fit with analytic jacobians and folded
+    # offsets on a fixed spectrum. Finite differences needed 1418 function
+    # evaluations for the same mixture
+    x = np.linspace(0, 100, 1000)
+    rng = np.random.default_rng(0)
+    data = kernels.evaluate(kernels.GAUSSIAN, x, 1.0, 30, 2.0, 0.1) + kernels.evaluate(kernels.CAUCHY, x, 3.0, 60, 3.0, 0.0)
+    data = data + kernels.evaluate(kernels.GAUSSIAN, x, 0.5, 62, 1.0, 0.0) + 0.01 * rng.standard_normal(len(x))
+
+    res = Mixfit(allowed = [ "GAUSSIAN", "CAUCHY" ], minResiduumImprovement = 0.01).fit(x, data)
+    assert [ f._fid for f in res._functions ] == [ "GAUSSIAN", "CAUCHY", "GAUSSIAN", "GAUSSIAN" ]
+    assert np.allclose(res._chis, [ 12.905, 0.44791, 0.17703, 0.10554 ], rtol = 1e-3)
+    assert res._nfev < 700
+    assert [ p[f._offset_name()].stderr is None for f, p in zip(res._functions, res._params) ] == [ False, True, True, True ]
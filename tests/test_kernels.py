@@ -0,0 +1,71 @@
+import numpy as np
+import pytest
+
+from mixfitfunctions import kernels
+
+SHAPES = [ kernels.CONSTANT, kernels.LINEAR, kernels.GAUSSIAN, kernels.CAUCHY, kernels.DIFFGAUSSIAN, kernels.DIFFCAUCHY ]
+
+@pytest.fixture
+def numba_backend():
+    pytest.importorskip("numba")
+    kernels.use_backend("numba")
+    yield
+    kernels.use_backend("numpy")
+
+def _mixture():
+    shapes = np.asarray(SHAPES)
+    params = np.asarray([
+        [ 0.0, 0.0, 0.0, 0.1 ],
+        [ 0.01, 0.0, 0.0, -0.2 ],
+        [ 1.0, 3.0, 0.7, 0.05 ],
+        [ 2.0, -1.0, 1.3, 0.0 ],
+        [ 0.5, 1.0, 0.4, 0.0 ],
+        [ -0.3, 5.0, 0.9, 0.02 ]
+    ])
+    return shapes, params
+
+def test_default_backend_is_numpy(monkeypatch):
+    monkeypatch.delenv("MIXFIT_BACKEND", raising = False)
+    kernels.use_backend()
+    assert kernels.backend() == "numpy"
+
+def test_unknown_backend():
+    with pytest.raises(ValueError):
+        kernels.use_backend("fortran")
+
+@pytest.mark.parametrize("shape", SHAPES)
+def test_jacobian_matches_finite_differences(shape):
+    x = np.linspace(-10, 10, 201)
+    p = np.asarray([ 1.3, 0.4, 1.1, 0.2 ])
+    jac = kernels.jacobian(shape, x, *p)
+    for k in range(4):
+        h = np.zeros(4)
+        h[k] = 1e-6
+        fd = (kernels.evaluate(shape, x, *(p + h)) - kernels.evaluate(shape, x, *(p - h))) / 2e-6
+        assert np.allclose(jac[:,k], fd, rtol = 1e-5, atol = 1e-7)
+
+def test_mixture_is_sum_of_shapes():
+    shapes, params = _mixture()
+    x = np.linspace(-10, 10, 301)
+    expected = np.sum([ kernels.evaluate(s, x, *p) for s, p in zip(shapes, params) ], axis = 0)
+    assert np.allclose(kernels.evaluate_mixture(shapes, params, x), expected)
+
+    data = np.sin(x)
+    w = np.linspace(0.5, 2.0, len(x))
+    assert np.allclose(kernels.evaluate_mixture(shapes, params, x, data = data, weights = w), (data - expected) * w)
+
+@pytest.mark.parametrize("loss", [ None, "huber", "soft_l1" ])
+def test_backends_agree(numba_backend, loss):
+    shapes, params = _mixture()
+    x = np.linspace(-10, 10, 301)
+    data = np.sin(x)
+    w = np.linspace(0.5, 2.0, len(x))
+
+    nb = kernels.evaluate_mixture(shapes, params, x, data = data, weights = w, loss = loss, scale = 0.3)
+    nbjac = kernels.mixture_jacobian(shapes, params, x)
+    kernels.use_backend("numpy")
+    npy = kernels.evaluate_mixture(shapes, params, x, data = data, weights = w, loss = loss, scale = 0.3)
+    npjac = kernels.mixture_jacobian(shapes, params, x)
+
+    assert np.allclose(nb, npy, rtol = 1e-12, atol = 1e-14)
+    assert np.allclose(nbjac, npjac, rtol = 1e-12, atol = 1e-14)
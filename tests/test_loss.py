@@ -0,0 +1,55 @@
+import numpy as np
+import pytest
+
+from mixfit.mixfit import Mixfit
+from mixfitfunctions import kernels
+
+def _rho(loss, z):
+    # Reference cost of the squared, scaled residual z
+    if loss == "huber":
+        return np.where(z <= 1, z, 2 * np.sqrt(z) - 1)
+    return 2 * (np.sqrt(1 + z) - 1)
+
+@pytest.mark.parametrize("scale", [ 0.3, 2.0 ])
+@pytest.mark.parametrize("loss", [ "huber", "soft_l1" ])
+def test_loss_matches_reference_cost(loss, scale):
+    r = np.linspace(-5, 5, 401)
+    out = kernels.finish_residual(r.copy(), loss = loss, scale = scale)
+    assert np.allclose(np.square(out), scale**2 * _rho(loss, np.square(r / scale)), rtol = 1e-12, atol = 1e-14)
+    assert np.all(np.sign(out) == np.sign(r))
+
+def test_huber_is_linear_below_scale():
+    r = np.linspace(-0.3, 0.3, 61)
+    assert np.array_equal(kernels.finish_residual(r.copy(), loss = "huber", scale = 0.3), r)
+
+@pytest.mark.parametrize("loss", [ None, "linear", "huber", "soft_l1" ])
+def test_weights_are_applied_before_loss(loss):
+    x = np.linspace(-10, 10, 301)
+    data = np.sin(x)
+    w = np.linspace(0.5, 2.0, len(x))
+    r = data - kernels.evaluate(kernels.GAUSSIAN, x, 1.0, 3.0, 0.7, 0.05)
+
+    expected = kernels.finish_residual(r * w, loss = loss, scale = 0.3)
+    assert np.allclose(kernels.finish_residual(r.copy(), weights = w, loss = loss, scale = 0.3), expected)
+    assert np.allclose(kernels.evaluate(kernels.GAUSSIAN, x, 1.0, 3.0, 0.7, 0.05, data = data, weights = w, loss = loss, scale = 0.3), expected)
+
+def test_unknown_loss():
+    with pytest.raises(ValueError):
+        kernels.finish_residual(np.zeros((3,)), loss = "cauchy")
+    with pytest.raises(ValueError):
+        Mixfit(loss = "cauchy")
+    with pytest.raises(ValueError):
+        Mixfit(loss = "huber", lossScale = 0)
+
+@pytest.mark.parametrize("loss", [ "huber", "soft_l1" ])
+def test_robust_fit_ignores_outliers(loss):
+    x = np.linspace(0, 100, 1000)
+    rng = np.random.default_rng(7)
+    data = kernels.evaluate(kernels.GAUSSIAN, x, 2.0, 50, 3.0, 0.0) + 0.01 * rng.standard_normal(len(x))
+    # A few strong spikes on one side of the line
+    data[[ 520, 540, 560, 580 ]] += 1.0
+
+    plain = Mixfit(allowed = [ "GAUSSIAN" ], maxIterations = 1).fit(x, data)
+    robust = Mixfit(allowed = [ "GAUSSIAN" ], maxIterations = 1, loss = loss, lossScale = 0.03).fit(x, data)
+    assert abs(robust._params[0]["f0_mu"].value - 50) < 0.5 * abs(plain._params[0]["f0_mu"].value - 50)
+    assert abs(robust._params[0]["f0_mu"].value - 50) < 0.01
@@ -0,0 +1,127 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+
+from mixfit.mapfit import fit_map
+from mixfit.mixfit import Mixfit
+from mixfitfunctions import kernels
+
+ROWS, COLS = 3, 4
+
+def _cube(extra = None):
+    # Lines drift slowly over the map, extra adds a line to the pixels of
+    # the given columns and up
+    x = np.linspace(0, 100, 1001)
+    rng = np.random.default_rng(21)
+    cube = np.empty((ROWS, COLS, len(x)))
+    for r in range(ROWS):
+        for c in range(COLS):
+            cube[r, c] = kernels.evaluate(kernels.GAUSSIAN, x, 2.0, 30 + 0.2 * r, 2.0, 0.0) + kernels.evaluate(kernels.CAUCHY, x, 3.0, 70 - 0.2 * c, 1.5, 0.0)
+            if (extra is not None) and (c >= extra):
+                cube[r, c] += kernels.evaluate(kernels.GAUSSIAN, x, 1.5, 50, 1.0, 0.0)
+            cube[r, c] += 0.01 * rng.standard_normal(len(x))
+    return x, cube
+
+class _RecordingExecutor(ThreadPoolExecutor):
+    """Thread pool that keeps the pixel, the neighbour mixture and the
+    reference chi^2 of every submitted pixel fit"""
+    def __init__(self):
+        super().__init__(max_workers = 2)
+        self.pixels = []
+
+    def submit(self, fn, *args, **kwargs):
+        self.pixels.append(args[4:7])
+        return super().submit(fn, *args, **kwargs)
+
+KWS = { "allowed" : [ "GAUSSIAN", "CAUCHY" ], "maxIterations" : 4, "stopError" : 0.15 }
+
+@pytest.fixture
+def mf():
+    return Mixfit(**KWS)
+
+def test_wavefronts_propagate_neighbours(mf):
+    x, cube = _cube()
+    with _RecordingExecutor() as executor:
+        results = fit_map(mf, x, cube, seed = (1, 1), executor = executor)
+
+    assert len(executor.pixels) == ROWS * COLS
+    dist = [ abs(r - 1) + abs(c - 1) for (r, c), _, _ in executor.pixels ]
+    assert dist == sorted(dist)
+
+    for (r, c), initial, reference in executor.pixels:
+        if (r, c) == (1, 1):
+            assert initial is None
+            continue
+        # Started from the (already fitted) result of a neighbour one step
+        # closer to the seed
+        neighbours = [ (r + dr, c + dc) for dr, dc in ((-1, 0), (1, 0), (0, -1), (0, 1)) ]
+        neighbours = [ (rn, cn) for rn, cn in neighbours if (0 <= rn < ROWS) and (0 <= cn < COLS) and (abs(rn - 1) + abs(cn - 1) == abs(r - 1) + abs(c - 1) - 1) ]
+        assert any([ initial is results[nb] for nb in neighbours ])
+        assert reference == initial._chis[-1]
+
+    # Warm started pixels only refine the components of the neighbour
+    seedFit = results[1, 1]
+    for r in range(ROWS):
+        for c in range(COLS):
+            assert results[r, c].fids() == seedFit.fids()
+            if (r, c) != (1, 1):
+                assert results[r, c]._nfev < seedFit._nfev
+
+def _independent(mf, x, cube):
+    return [ [ mf.fit(x, cube[r, c]) for c in range(COLS) ] for r in range(ROWS) ]
+
+def _centers(res):
+    return sorted([ res.params(i)[n][0] for i in range(len(res)) for n in ("mu", "x0") if n in res.params(i) ])
+
+def test_map_matches_independent_fits(mf):
+    x, cube = _cube()
+    with ThreadPoolExecutor(2) as executor:
+        results = fit_map(mf, x, cube, executor = executor)
+    independent = _independent(mf, x, cube)
+
+    for r in range(ROWS):
+        for c in range(COLS):
+            res, ref = results[r, c], independent[r][c]
+            assert sorted(res.fids()) == sorted([ f._fid for f in ref._functions ])
+            assert np.isclose(res._chis[-1], ref._chis[-1], rtol = 1e-3)
+            assert np.allclose(_centers(res), [ 30 + 0.2 * r, 70 - 0.2 * c ], atol = 0.02)
+
+def test_appearing_line_is_refit(mf):
+    x, cube = _cube(extra = 2)
+    with ThreadPoolExecutor(2) as executor:
+        results = fit_map(mf, x, cube, seed = (1, 0), executor = executor)
+        stale = fit_map(mf, x, cube, seed = (1, 0), executor = executor, refitRatio = None)
+    independent = _independent(mf, x, cube)
+
+    for r in range(ROWS):
+        for c in range(COLS):
+            ref = independent[r][c]
+            assert len(ref._functions) == (3 if c >= 2 else 2)
+            assert len(results[r, c]) == len(ref._functions)
+            assert np.isclose(results[r, c]._chis[-1], ref._chis[-1], rtol = 1e-3)
+            # Without refits the line is never picked up
+            assert len(stale[r, c]) == 2
+
+def test_process_pool(mf):
+    x, cube = _cube()
+    results = fit_map(Mixfit(**KWS), x, cube)
+    with ThreadPoolExecutor(2) as executor:
+        expected = fit_map(mf, x, cube, executor = executor)
+    for r in range(ROWS):
+        for c in range(COLS):
+            assert results[r, c].fids() == expected[r, c].fids()
+            assert np.allclose(results[r, c]._values, expected[r, c]._values)
+
+def test_invalid_arguments(mf):
+    x, cube = _cube()
+    with pytest.raises(ValueError):
+        fit_map(mf, x[:-1], cube)
+    with pytest.raises(ValueError):
+        fit_map(mf, x, cube, weights = np.ones(cube.shape[1:]))
+    with pytest.raises(ValueError):
+        fit_map(mf, x, cube, seed = (ROWS, 0))
+    with pytest.raises(ValueError):
+        fit_map(mf, x, cube, refitRatio = 0)
+    with pytest.raises(ValueError):
+        fit_map(mf, x, cube, warmNfev = 0)
@@ -0,0 +1,72 @@
+import numpy as np
+import pytest
+
+from mixfit import prescreen
+from mixfit.mixfit import Mixfit
+from mixfitfunctions import kernels, registry
+from mixfitfunctions.gaussian import MixfitFunctionGaussianFactory
+
+FUNCTIONS = [ "GAUSSIAN", "CAUCHY", "DIFFGAUSSIAN", "DIFFERENTIALCAUCHY", "LINEAR" ]
+
+def _spectrum():
+    x = np.linspace(0, 100, 2000)
+    rng = np.random.default_rng(13)
+    gaussian = kernels.evaluate(kernels.GAUSSIAN, x, 2.0, 30, 1.5, 0.0)
+    cauchy = kernels.evaluate(kernels.CAUCHY, x, 3.0, 70, 1.0, 0.0)
+    return x, gaussian, cauchy, 0.01 * rng.standard_normal(len(x))
+
+def _functions():
+    return [ registry.create(fid)() for fid in FUNCTIONS ]
+
+def test_grid_step():
+    assert np.isclose(prescreen.grid_step(np.linspace(0, 10, 101)), 0.1)
+    assert prescreen.grid_step(np.linspace(0, 10, 5)) is None
+    assert prescreen.grid_step(np.geomspace(1, 10, 101)) is None
+
+def test_not_screenable():
+    funs = _functions()
+    assert [ prescreen.screenable(f) for f in funs ] == [ True, True, True, True, False ]
+    x, gaussian, cauchy, noise = _spectrum()
+    assert prescreen.prescreen(np.geomspace(1, 100, 2000), gaussian, funs) == []
+
+@pytest.mark.parametrize("line, fid, center, width, amp", [ (0, "GAUSSIAN", 30, 1.5, 2.0), (1, "CAUCHY", 70, 1.0, 3.0) ])
+def test_seeds_recover_planted_line(line, fid, center, width, amp):
+    x, gaussian, cauchy, noise = _spectrum()
+    data = [ gaussian, cauchy ][line] + noise
+    funs = _functions()
+
+    screened = prescreen.prescreen(x, data, funs)
+    assert len(screened) == 4
+    assert [ s for s, _, _ in screened ] == sorted([ s for s, _, _ in screened ], reverse = True)
+    score, ifun, seed = screened[0]
+    assert funs[ifun]._fid == fid
+    assert abs(seed[1] - center) < 2 * (x[1] - x[0])
+    # Widths are screened on a geometric grid (steps of about 30 %)
+    assert abs(np.log(seed[2] / width)) < np.log(1.35)
+    assert abs(seed[0] / amp - 1) < 0.2
+
+def test_center_limits():
+    x, gaussian, cauchy, noise = _spectrum()
+    fun = MixfitFunctionGaussianFactory(limits = { "mu" : (50, 90) })()
+    screened = prescreen.prescreen(x, gaussian + cauchy + noise, [ fun ])
+    assert 50 <= screened[0][2][1] <= 90
+    assert abs(screened[0][2][1] - 70) < 1
+
+def test_prescreened_fit_needs_fewer_evaluations():
+    x, gaussian, cauchy, noise = _spectrum()
+    data = gaussian + cauchy + noise
+    full = Mixfit(maxIterations = 2).fit(x, data)
+    screened = Mixfit(maxIterations = 2, prescreen = 2).fit(x, data)
+
+    assert [ f._fid for f in screened._functions ] == [ "GAUSSIAN", "CAUCHY" ]
+    assert [ f._fid for f in screened._functions ] == [ f._fid for f in full._functions ]
+    assert np.isclose(screened._chis[-1], full._chis[-1], rtol = 1e-3)
+    assert abs(screened._params[0]["f0_mu"].value - 30) < 0.01
+    assert abs(screened._params[1]["f1_x0"].value - 70) < 0.05
+    assert screened._nfev < full._nfev / 2
+
+def test_invalid_prescreen():
+    with pytest.raises(ValueError):
+        Mixfit(prescreen = 0)
+    with pytest.raises(ValueError):
+        Mixfit(prescreenWidths = 0)
@@ -0,0 +1,76 @@
+import importlib
+import os
+import subprocess
+import sys
+
+import pytest
+
+import mixfit
+from mixfit.mixfit import Mixfit
+from mixfitfunctions import registry
+from mixfitfunctions.gaussian import MixfitFunctionGaussianFactory
+
+@pytest.fixture
+def clean_registry(monkeypatch):
+    monkeypatch.setattr(registry, "_references", dict(registry._references))
+    monkeypatch.setattr(registry, "_loaded", dict(registry._loaded))
+    monkeypatch.setattr(registry, "_entryPointsScanned", False)
+
+def test_import_is_lazy():
+    # A fresh interpreter, the test process has loaded everything already
+    src = os.path.dirname(os.path.dirname(os.path.abspath(mixfit.__file__)))
+    code = "import sys, mixfit.mixfit; print(','.join([ m for m in ('lmfit', 'scipy', 'mixfitfunctions.voigt', 'mixfitfunctions.gaussian') if m in sys.modules ]))"
+    env = dict(os.environ, PYTHONPATH = src)
+    out = subprocess.run([ sys.executable, "-c", code ], env = env, capture_output = True, text = True, check = True)
+    assert out.stdout.strip() == ""
+
+def test_references_are_resolved_on_first_use(clean_registry):
+    registry.register("LAZYGAUSSIAN", "mixfitfunctions.gaussian:MixfitFunctionGaussianFactory")
+    assert "LAZYGAUSSIAN" not in registry._loaded
+    assert registry.get("LAZYGAUSSIAN") is MixfitFunctionGaussianFactory
+    assert registry._loaded["LAZYGAUSSIAN"] is MixfitFunctionGaussianFactory
+
+@pytest.mark.parametrize("fid, factory", [ (1, MixfitFunctionGaussianFactory), ("X", "mixfitfunctions.gaussian"), ("X", 3) ])
+def test_invalid_registrations(clean_registry, fid, factory):
+    with pytest.raises(ValueError):
+        registry.register(fid, factory)
+
+def test_unknown_function(clean_registry):
+    with pytest.raises(ValueError):
+        registry.get("NOSUCHSHAPE")
+
+def test_entry_point(clean_registry, tmp_path, monkeypatch):
+    # A third party distribution supplying a shape by entry point
+    (tmp_path / "mixfit_test_shape.py").write_text(
+        "from mixfitfunctions.gaussian import MixfitFunctionGaussianFactory\n"
+        "class ShapeFactory(MixfitFunctionGaussianFactory):\n"
+        "    pass\n"
+    )
+    info = tmp_path / "mixfit_test_shape-1.0.dist-info"
+    info.mkdir()
+    (info / "METADATA").write_text("Metadata-Version: 2.1\nName: mixfit-test-shape\nVersion: 1.0\n")
+    (info / "entry_points.txt").write_text(f"[{registry.ENTRY_POINT_GROUP}]\nTESTSHAPE = mixfit_test_shape:ShapeFactory\n")
+    monkeypatch.syspath_prepend(str(tmp_path))
+    importlib.invalidate_caches()
+
+    assert "TESTSHAPE" in registry.available()
+    # Listing does not import the module
+    assert "mixfit_test_shape" not in sys.modules
+    try:
+        factory = registry.get("TESTSHAPE")
+        assert factory.__name__ == "ShapeFactory"
+        mf = Mixfit(allowed = [ "TESTSHAPE" ], maxIterations = 1)
+        assert isinstance(mf._factories[0], factory)
+    finally:
+        sys.modules.pop("mixfit_test_shape", None)
+
+def test_builtin_wins_over_entry_point(clean_registry, tmp_path, monkeypatch):
+    info = tmp_path / "mixfit_test_override-1.0.dist-info"
+    info.mkdir()
+    (info / "METADATA").write_text("Metadata-Version: 2.1\nName: mixfit-test-override\nVersion: 1.0\n")
+    (info / "entry_points.txt").write_text(f"[{registry.ENTRY_POINT_GROUP}]\nGAUSSIAN = nosuchmodule:Factory\n")
+    monkeypatch.syspath_prepend(str(tmp_path))
+    importlib.invalidate_caches()
+
+    registry.available()
+    assert registry.get("GAUSSIAN") is MixfitFunctionGaussianFactory
@@ -0,0 +1,143 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+
+from mixfit import segmented
+from mixfit.mixfit import Mixfit, Mixture
+from mixfitfunctions import kernels, registry
+
+def _spectrum():
+    # Two groups of lines on a sloped baseline, separated by a quiet gap
+    x = np.linspace(0, 200, 2000)
+    rng = np.random.default_rng(3)
+    data = 0.05 + 2e-4 * x + 0.01 * rng.standard_normal(len(x))
+    data = data + kernels.evaluate(kernels.GAUSSIAN, x, 2.0, 40, 2.0, 0.0) + kernels.evaluate(kernels.CAUCHY, x, 1.0, 47, 1.5, 0.0)
+    data = data + kernels.evaluate(kernels.GAUSSIAN, x, 3.0, 150, 3.0, 0.0) + kernels.evaluate(kernels.GAUSSIAN, x, 1.0, 160, 2.0, 0.0)
+    return x, data
+
+def _mixture(components, chi):
+    mixture = Mixture()
+    for i, (fid, values) in enumerate(components):
+        fun = registry.create(fid)(prefix = f"f{i}")
+        mixture._functions.append(fun)
+        mixture._params.append(fun.lmparams({ f"f{i}_{n}" : v for n, v in values.items() }))
+    mixture._chis = [ chi ] * len(components)
+    return mixture
+
+def test_confine_removes_components_outside_of_segment():
+    x = np.linspace(0, 100, 1000)
+    mixture = _mixture([
+        ("GAUSSIAN", { "amp" : 2.0, "mu" : 30, "sigma" : 2.0, "offset" : 0.0 }),
+        ("LINEAR", { "slope" : 1e-3, "intercept" : 0.0 }),
+        ("GAUSSIAN", { "amp" : 1.0, "mu" : 60, "sigma" : 0.5, "offset" : 0.0 }),
+        ("GAUSSIAN", { "amp" : 1.0, "mu" : 30, "sigma" : 500, "offset" : 0.0 })
+    ], 0.1)
+
+    res, removed = segmented.confine(mixture, x, 200, 500)
+    assert removed == 3
+    assert [ f._fid for f in res._functions ] == [ "GAUSSIAN" ]
+    assert res._params[0]["f0_mu"].value == 30
+
+def test_confine_keeps_lines_at_the_boundary():
+    x = np.linspace(0, 100, 1000)
+    mixture = _mixture([
+        ("GAUSSIAN", { "amp" : 2.0, "mu" : 48, "sigma" : 2.0, "offset" : 0.0 }),
+        ("CAUCHY", { "amp" : 1e-3, "x0" : 80, "gamma" : 1.0, "offset" : 0.0 })
+    ], 0.1)
+
+    # The second line is outside but its energy is below the chi^2
+    res, removed = segmented.confine(mixture, x, 200, 500)
+    assert removed == 0
+    assert len(res._functions) == 2
+
+def test_stitched_chi_matches_full_fit():
+    x, data = _spectrum()
+    mf = Mixfit(allowed = [ "GAUSSIAN", "CAUCHY", "LINEAR", "DIFFGAUSSIAN" ], maxIterations = 4)
+    full = mf.fit(x, data)
+    with ThreadPoolExecutor(2) as executor:
+        stitched = mf.fit_segmented(x, data, breakpoints = [ 100 ], executor = executor, polish = False)
+        polished = mf.fit_segmented(x, data, breakpoints = [ 100 ], executor = executor)
+
+    assert np.isclose(stitched._chis[-1], stitched._chisqr(x, data))
+    assert stitched._chis[-1] < 5 * full._chis[-1]
+    assert polished._chis[-1] <= stitched._chis[-1]
+    assert polished._chis[-1] < 2 * full._chis[-1]
+    assert len(polished._chis) == len(polished._functions)
+
+def _cut_lines():
+    # Lines cut by the breakpoints at 100 and 200
+    x = np.linspace(0, 300, 3000)
+    rng = np.random.default_rng(4)
+    data = 0.05 + 0.01 * rng.standard_normal(len(x))
+    for c in (50, 97, 150, 203, 250):
+        data = data + kernels.evaluate(kernels.GAUSSIAN, x, 2.0, c, 2.0, 0.0)
+    return x, data
+
+def _refined_lengths(monkeypatch):
+    lengths = []
+    refine = Mixture._refine
+    def spy(self, x, data, **kwargs):
+        lengths.append((len(x), kwargs.get("budget")))
+        return refine(self, x, data, **kwargs)
+    monkeypatch.setattr(Mixture, "_refine", spy)
+    return lengths
+
+def test_boundary_polish_refines_neighbouring_segments(monkeypatch):
+    x, data = _cut_lines()
+    mf = Mixfit(allowed = [ "GAUSSIAN" ], maxIterations = 3)
+    with ThreadPoolExecutor(1) as executor:
+        stitched = mf.fit_segmented(x, data, breakpoints = [ 100, 200 ], executor = executor, polish = False)
+        lengths = _refined_lengths(monkeypatch)
+        polished = mf.fit_segmented(x, data, breakpoints = [ 100, 200 ], executor = executor)
+
+    # Two windows of two segments each, never the full sweep
+    assert len(x) not in [ n for n, _ in lengths ]
+    assert [ n for n, _ in lengths ].count(2000) == 2
+    assert polished._chis[-1] < stitched._chis[-1]
+    assert np.isclose(polished._chis[-1], polished._chisqr(x, data))
+
+@pytest.mark.parametrize("polish", [ "boundary", "full" ])
+@pytest.mark.parametrize("polishNfev", [ None, 20 ])
+def test_polish_budget(monkeypatch, polish, polishNfev):
+    x, data = _cut_lines()
+    mf = Mixfit(allowed = [ "GAUSSIAN" ], maxIterations = 2)
+    lengths = _refined_lengths(monkeypatch)
+    with ThreadPoolExecutor(1) as executor:
+        mf.fit_segmented(x, data, breakpoints = [ 100, 200 ], executor = executor, polish = polish, polishNfev = polishNfev)
+
+    budgets = [ b for n, b in lengths if n == (len(x) if polish == "full" else 2000) ]
+    assert len(budgets) >= 1
+    if polishNfev is None:
+        assert all([ b is None for b in budgets ])
+    else:
+        # All polishing refinements share one budget
+        assert all([ b is budgets[0] for b in budgets ])
+        assert budgets[0]._nfevLeft <= polishNfev
+
+def test_unknown_polish():
+    x, data = _cut_lines()
+    with pytest.raises(ValueError):
+        Mixfit(maxIterations = 1).fit_segmented(x, data, breakpoints = [ 100 ], polish = "global")
+
+@pytest.mark.parametrize("fid, values", [
+    ("GAUSSIAN", { "amp" : 2.0, "sigma" : 2.0 }),
+    ("VOIGT", { "amp" : 2.0, "sigma" : 1.0, "gamma" : 1.0 }),
+    ("PSEUDOVOIGT", { "amp" : 2.0, "fwhm" : 3.0, "eta" : 0.5 })
+])
+def test_stitch_shifts_baselines_of_all_shapes(fid, values):
+    # Three segments with two lines each, every segment describes the
+    # baseline of 5 by the sum of its offsets
+    x = np.linspace(0, 300, 3000)
+    data = np.full(x.shape, 5.0)
+    segments = []
+    for s in range(3):
+        centers = [ 100 * s + 30, 100 * s + 70 ]
+        components = [ (fid, dict(values, offset = o, **{ ("mu" if fid == "GAUSSIAN" else "x0") : c })) for c, o in zip(centers, [ 1.5, 3.5 ]) ]
+        segments.append(_mixture(components, 0.0))
+        for fun, params in zip(segments[-1]._functions, segments[-1]._params):
+            data = data + fun(params, x) - params[fun._offset_name()].value
+
+    res = segmented.stitch(segments)
+    assert np.isclose(np.sum([ p[f._offset_name()].value for f, p in zip(res._functions, res._params) ]), 5.0)
+    assert res._chisqr(x, data) < 1e-20
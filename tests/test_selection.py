@@ -0,0 +1,74 @@
+import numpy as np
+import pytest
+
+from mixfit.mixfit import Mixfit, _selection
+from mixfitfunctions import kernels
+
+def _indices(selection, n):
+    return np.arange(n)[selection]
+
+def test_no_selection():
+    assert _selection(np.arange(10), 10) is None
+
+def test_roi_is_a_slice():
+    x = np.linspace(0, 9, 10)
+    assert _selection(x, 10, roi = (2.5, 6)) == slice(3, 7)
+    assert _selection(x, 10, roi = (None, 1)) == slice(0, 2)
+    assert _selection(x, 10, roi = (8, None)) == slice(8, 10)
+
+def test_boolean_and_index_masks():
+    x = np.linspace(0, 9, 10)
+    mask = np.zeros((10,), dtype = bool)
+    mask[[ 1, 2, 5 ]] = True
+    assert list(_selection(x, 10, mask = mask)) == [ 1, 2, 5 ]
+    assert list(_selection(x, 10, mask = np.asarray([ 5, 1, 2 ]))) == [ 1, 2, 5 ]
+    assert _selection(x, 10, mask = np.asarray([ 4, 3, 5 ])) == slice(3, 6)
+
+def test_exclude_and_combinations():
+    x = np.linspace(0, 9, 10)
+    assert list(_selection(x, 10, exclude = [ (2, 3), (7.5, 100) ])) == [ 0, 1, 4, 5, 6, 7 ]
+    mask = np.ones((10,), dtype = bool)
+    mask[4] = False
+    selection = _selection(x, 10, mask = mask, roi = (1, 7), exclude = [ (6, 6) ])
+    assert list(_indices(selection, 10)) == [ 1, 2, 3, 5, 7 ]
+
+def test_empty_selection():
+    x = np.linspace(0, 9, 10)
+    assert len(_indices(_selection(x, 10, roi = (20, 30)), 10)) == 0
+
+@pytest.mark.parametrize("kwargs", [
+    { "mask" : np.ones((5,), dtype = bool) },
+    { "mask" : np.asarray([ 0.5, 1.0 ]) },
+    { "mask" : np.zeros((2, 5), dtype = np.int64) },
+    { "roi" : (1, 2, 3) },
+    { "exclude" : [ (1, 2, 3) ] }
+])
+def test_invalid_selections(kwargs):
+    with pytest.raises(ValueError):
+        _selection(np.linspace(0, 9, 10), 10, **kwargs)
+
+def _spectrum():
+    x = np.linspace(0, 100, 1001)
+    rng = np.random.default_rng(4)
+    data = kernels.evaluate(kernels.GAUSSIAN, x, 2.0, 30, 2.0, 0.0) + kernels.evaluate(kernels.GAUSSIAN, x, 3.0, 70, 3.0, 0.0)
+    return x, data + 0.01 * rng.standard_normal(len(x))
+
+def test_fit_no_samples_left():
+    x, data = _spectrum()
+    with pytest.raises(ValueError):
+        Mixfit(maxIterations = 1).fit(x, data, roi = (200, 300))
+
+def test_fit_on_roi_matches_sliced_data():
+    x, data = _spectrum()
+    mf = Mixfit(allowed = [ "GAUSSIAN" ], maxIterations = 1)
+    res = mf.fit(x, data, roi = (50, 100))
+    ref = mf.fit(x[500:], data[500:].copy())
+    assert np.allclose(res._chis, ref._chis)
+    assert abs(res._params[0]["f0_mu"].value - 70) < 0.01
+    # The mixture is evaluated on the full grid
+    assert res(x).shape == x.shape
+
+def test_fit_with_excluded_line():
+    x, data = _spectrum()
+    res = Mixfit(allowed = [ "GAUSSIAN" ], maxIterations = 1).fit(x, data, exclude = [ (60, 80) ])
+    assert abs(res._params[0]["f0_mu"].value - 30) < 0.01
@@ -0,0 +1,76 @@
+import numpy as np
+
+from mixfit import sharedmem
+from mixfit.mixfit import Mixfit
+from mixfitfunctions import kernels
+from mixfitfunctions.gaussian import MixfitFunctionGaussianFactory
+
+def _spectrum():
+    x = np.linspace(0, 100, 1001)
+    rng = np.random.default_rng(5)
+    data = kernels.evaluate(kernels.GAUSSIAN, x, 2.0, 30, 2.0, 0.0) + kernels.evaluate(kernels.GAUSSIAN, x, 1.0, 70, 8.0, 0.0)
+    return x, data + 0.01 * rng.standard_normal(len(x))
+
+def _assert_same(a, b):
+    assert [ f._fid for f in a._functions ] == [ f._fid for f in b._functions ]
+    for pa, pb in zip(a._params, b._params):
+        assert sorted(pa) == sorted(pb)
+        for n in pa:
+            assert pa[n].value == pb[n].value
+            assert (pa[n].min, pa[n].max, pa[n].vary) == (pb[n].min, pb[n].max, pb[n].vary)
+            assert (pa[n].stderr is None) == (pb[n].stderr is None)
+            if pa[n].stderr is not None:
+                assert pa[n].stderr == pb[n].stderr
+    assert list(a._chis) == list(b._chis)
+    assert a._nfev == b._nfev
+    assert a._budgetExhausted == b._budgetExhausted
+
+def test_pack_unpack_round_trip():
+    x, data = _spectrum()
+    mf = Mixfit(allowed = [ "CAUCHY", "GAUSSIAN", "LINEAR" ], maxIterations = 3)
+    res = mf.fit(x, data)
+    packed = sharedmem.pack_mixture(res, mf._factories)
+    _assert_same(sharedmem.unpack_mixture(packed, mf._factories), res)
+
+def test_pack_uses_producing_factory():
+    # Two factories of the same function id that only differ in their
+    # limits, the narrow one can only describe the second line
+    x, data = _spectrum()
+    narrow = MixfitFunctionGaussianFactory(limits = { "sigma" : (0.5, 3) })
+    wide = MixfitFunctionGaussianFactory(limits = { "sigma" : (5, 20) })
+    mf = Mixfit(allowed = [ narrow, wide ], maxIterations = 2)
+    res = mf.fit(x, data)
+    assert [ f._ifac for f in res._functions ] == [ 0, 1 ]
+
+    packed = sharedmem.pack_mixture(res, mf._factories)
+    assert list(packed[0]) == [ 0, 1 ]
+    back = sharedmem.unpack_mixture(packed, mf._factories)
+    _assert_same(back, res)
+    assert back._params[1]["f1_sigma"].min == 5
+
+def test_pack_functions_from_other_fitters():
+    # Components without a producing factory are matched by id and limits
+    x, data = _spectrum()
+    narrow = MixfitFunctionGaussianFactory(limits = { "sigma" : (0.5, 3) })
+    wide = MixfitFunctionGaussianFactory(limits = { "sigma" : (5, 20) })
+    res = Mixfit(allowed = [ narrow, wide ], maxIterations = 2).fit(x, data)
+    for f in res._functions:
+        f._ifac = None
+
+    factories = [ MixfitFunctionGaussianFactory(limits = { "sigma" : (5, 20) }), MixfitFunctionGaussianFactory(limits = { "sigma" : (0.5, 3) }) ]
+    packed = sharedmem.pack_mixture(res, factories)
+    assert list(packed[0]) == [ 1, 0 ]
+
+def test_shared_array_round_trip():
+    import pickle
+
+    a = np.random.default_rng(0).standard_normal(100)
+    shared = sharedmem.SharedArray(a)
+    try:
+        b, release = sharedmem.attach(pickle.loads(pickle.dumps(shared)))
+        assert np.array_equal(a, b)
+        assert not b.flags.writeable
+        b = None
+        release()
+    finally:
+        shared.close()
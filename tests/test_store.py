@@ -0,0 +1,89 @@
+import numpy as np
+import pytest
+
+from mixfit.mixfit import Mixfit
+from mixfit.store import ResultStore, mixture_record
+from mixfitfunctions import kernels
+
+def _spectrum(shift = 0.0):
+    x = np.linspace(0, 100, 1001)
+    rng = np.random.default_rng(6)
+    data = kernels.evaluate(kernels.GAUSSIAN, x, 2.0, 30 + shift, 2.0, 0.0) + kernels.evaluate(kernels.CAUCHY, x, 3.0, 70 + shift, 3.0, 0.0)
+    return x, data + 0.01 * rng.standard_normal(len(x))
+
+@pytest.fixture
+def mf():
+    return Mixfit(allowed = [ "GAUSSIAN", "CAUCHY" ], maxIterations = 2)
+
+def test_add_query_round_trip(mf):
+    x, data = _spectrum()
+    res = mf.fit(x, data)
+    with ResultStore() as store:
+        fitId = store.add(res, source = "run:0", created = 100.0)
+        sel = store.query(fitIds = [ fitId ])
+
+        assert list(sel["fit_id"]) == [ fitId, fitId ]
+        assert list(sel["idx"]) == [ 0, 1 ]
+        assert list(sel["fid"]) == [ f._fid for f in res._functions ]
+        assert list(sel["stage"]) == [ 0, 1 ]
+        assert np.allclose(sel["chisqr"], res._chis)
+        assert list(sel["source"]) == [ "run:0", "run:0" ]
+        assert list(sel["created"]) == [ 100.0, 100.0 ]
+        for i, (fun, params) in enumerate(zip(res._functions, res._params)):
+            for n, p in params.items():
+                name = fun._pnames[n]
+                assert sel[name][i] == p.value
+                if p.stderr is None:
+                    assert np.isnan(sel[f"{name}_stderr"][i])
+                else:
+                    assert sel[f"{name}_stderr"][i] == p.stderr
+        # Parameters of other functions are NaN
+        assert np.isnan(sel["gamma"][[ f._fid for f in res._functions ].index("GAUSSIAN")])
+
+        fits = store.fits(source = "run:0")
+        assert list(fits["fit_id"]) == [ fitId ]
+        assert list(fits["ncomponents"]) == [ 2 ]
+        assert fits["chisqr"][0] == res._chis[-1]
+        assert fits["nfev"][0] == res._nfev
+
+def test_query_ranges_and_sources(mf):
+    with ResultStore() as store:
+        for shift in (0.0, 5.0, 10.0):
+            x, data = _spectrum(shift)
+            store.add(mf.fit(x, data), source = f"shift:{shift}")
+
+        sel = store.query(fid = "GAUSSIAN", mu = (32, None))
+        assert sorted(np.round(sel["mu"])) == [ 35, 40 ]
+        sel = store.query(fid = [ "GAUSSIAN", "CAUCHY" ], source = "shift:5.0")
+        assert sorted(sel["fid"]) == [ "CAUCHY", "GAUSSIAN" ]
+        assert len(store.query(mu = (1000, 2000))["fit_id"]) == 0
+        with pytest.raises(ValueError):
+            store.query(foo = (0, 1))
+
+def test_replace_by_source(mf):
+    x, data = _spectrum()
+    res = mf.fit(x, data)
+    with ResultStore() as store:
+        store.add(res, source = "a")
+        store.add(res, source = "a", replace = True)
+        assert len(store.fits()["fit_id"]) == 1
+        assert len(store.query()["fit_id"]) == 2
+
+def test_records_are_accepted(mf):
+    x, data = _spectrum()
+    res = mf.fit(x, data)
+    with ResultStore() as store:
+        fitId = store.add(mixture_record(res))
+        assert np.allclose(store.query(fitIds = [ fitId ])["chisqr"], res._chis)
+
+def test_warm_started_fit_has_no_stage_chisqr(mf):
+    x, data = _spectrum()
+    res = mf.fit(x, data)
+    warm = mf.fit(x, data, initial = res)
+    assert len(warm._chis) == len(warm._functions)
+
+    with ResultStore() as store:
+        sel = store.query(fitIds = [ store.add(warm) ])
+        assert list(sel["stage"]) == [ -1, -1 ]
+        assert np.all(np.isnan(sel["chisqr"]))
+        assert store.fits()["chisqr"][0] == warm._chis[-1]
@@ -0,0 +1,67 @@
+import numpy as np
+import pytest
+
+from mixfit import synthetic
+from mixfitfunctions import registry
+
+def test_same_seed_same_batch():
+    x = np.linspace(0, 500, 2000)
+    a = synthetic.generate(20, x, components = (2, 6), offset = (-0.5, 0.5), noise = (0.01, 0.05), seed = 7)
+    b = synthetic.generate(20, x, components = (2, 6), offset = (-0.5, 0.5), noise = (0.01, 0.05), seed = 7)
+    c = synthetic.generate(20, x, components = (2, 6), offset = (-0.5, 0.5), noise = (0.01, 0.05), seed = 8)
+
+    assert np.array_equal(a.data, b.data)
+    assert np.array_equal(a.shapes, b.shapes)
+    assert np.array_equal(a.params, b.params, equal_nan = True)
+    assert all([ a.truth(i) == b.truth(i) for i in range(len(a)) ])
+    assert not np.array_equal(a.data, c.data)
+
+@pytest.mark.parametrize("separation", [ None, 1.0 ])
+def test_truth_matches_data(separation):
+    x = np.linspace(0, 500, 2000)
+    batch = synthetic.generate(12, x, components = (0, 8), offset = (-1.0, 1.0), noise = 0.0, separation = separation, seed = 3)
+
+    assert batch.data.shape == (12, len(x))
+    for i in range(len(batch)):
+        truth = batch.truth(i)
+        assert len(truth) == batch.ncomponents[i]
+        assert set([ comp["fid"] for comp in truth ]) <= set(synthetic.PEAKS)
+
+        model = np.full(len(x), batch.offset[i])
+        centers = []
+        for comp in truth:
+            fun = registry.create(comp["fid"])()
+            names = fun._kernel_names
+            centers.append(comp["params"][names[1]])
+            assert comp["params"][names[3]] == 0.0
+            model += fun(comp["params"], x)
+        assert centers == sorted(centers)
+        assert np.allclose(batch.data[i], model, rtol = 0, atol = 1e-12)
+
+def test_separation():
+    x = np.linspace(0, 1000, 4000)
+    batch = synthetic.generate(10, x, components = 6, width = (2.0, 5.0), separation = 2.0, noise = 0.0, seed = 5)
+
+    for i in range(len(batch)):
+        centers = batch.params[i,:,1]
+        widths = batch.params[i,:,2]
+        assert np.all(np.diff(centers) >= 2.0 * (widths[:-1] + widths[1:]) - 1e-9)
+
+def test_noise_level():
+    x = np.linspace(0, 1000, 20000)
+    batch = synthetic.generate(3, x, components = 0, offset = 0.25, noise = 0.1, seed = 11)
+
+    assert np.all(batch.ncomponents == 0)
+    assert batch.truth(0) == []
+    assert np.allclose(np.mean(batch.data, axis = 1), 0.25, atol = 0.005)
+    assert np.allclose(np.std(batch.data, axis = 1), 0.1, rtol = 0.03)
+
+def test_invalid_arguments():
+    with pytest.raises(ValueError):
+        synthetic.generate(0)
+    with pytest.raises(ValueError):
+        synthetic.generate(1, components = (5, 2))
+    with pytest.raises(ValueError):
+        synthetic.generate(1, shapes = [ "LINEAR" ])
+    with pytest.raises(ValueError):
+        synthetic.generate(1, components = 50, width = 10.0, separation = 5.0)
@@ -0,0 +1,85 @@
+import numpy as np
+import pytest
+
+from mixfit.mixfit import Mixfit
+from mixfitfunctions import kernels
+
+def _spectrum(shift = 0.0, seed = 12):
+    x = np.linspace(0, 100, 1001)
+    rng = np.random.default_rng(seed)
+    data = kernels.evaluate(kernels.GAUSSIAN, x, 2.0, 30 + shift, 2.0, 0.0) + kernels.evaluate(kernels.CAUCHY, x, 3.0, 70 - shift, 1.5, 0.0)
+    return x, data + 0.01 * rng.standard_normal(len(x))
+
+def _lines(seed):
+    # A peak and a derivative feature: the matched filter seeds the
+    # candidate of each shape on its own feature, so the loser of the
+    # first stage still describes a feature that is present in the second
+    x = np.linspace(0, 100, 1001)
+    rng = np.random.default_rng(seed)
+    data = kernels.evaluate(kernels.GAUSSIAN, x, 1.0, 30, 1.0, 0.0) + kernels.evaluate(kernels.DIFFGAUSSIAN, x, 2.0, 70, 1.5, 0.0)
+    return x, data + 0.01 * rng.standard_normal(len(x))
+
+def _centers(res):
+    return [ params[fun._kernel_pnames[1]].value for fun, params in zip(res._functions, res._params) ]
+
+@pytest.mark.parametrize("compact", [ False, True ])
+def test_initial_reuses_components(compact):
+    mf = Mixfit(allowed = [ "GAUSSIAN", "CAUCHY" ], maxIterations = 2)
+    previous = mf.fit(*_spectrum())
+
+    x, data = _spectrum(0.5, seed = 13)
+    cold = mf.fit(x, data)
+    warm = mf.fit(x, data, initial = previous.compact() if compact else previous)
+
+    # The components of the previous fit are refined in place, no stage
+    # search is needed any more
+    assert [ f._fid for f in warm._functions ] == [ f._fid for f in previous._functions ]
+    assert np.allclose(_centers(warm), [ 30.5, 69.5 ], atol = 0.05)
+    assert np.isclose(warm._chis[-1], cold._chis[-1], rtol = 1e-3)
+    assert warm._nfev < cold._nfev / 2
+
+    # The initial mixture is left untouched
+    assert np.allclose(_centers(previous), [ 30, 70 ], atol = 0.05)
+
+@pytest.mark.parametrize("seed", [ 0, 1, 2 ])
+def test_warm_start_reuses_candidates(seed, monkeypatch):
+    x, data = _lines(seed)
+    kws = { "allowed" : [ "GAUSSIAN", "DIFFGAUSSIAN" ], "maxIterations" : 2, "prescreen" : 2 }
+    cold = Mixfit(**kws).fit(x, data)
+
+    reused = []
+    mf = Mixfit(warmStart = True, warmStartTolerance = 1e-2, **kws)
+    warmCandidate = mf._warm_candidate
+    def record(ifac, prefix, x, delta, previous, guess, weights):
+        fun, params, reuse = warmCandidate(ifac, prefix, x, delta, previous, guess, weights)
+        if reuse:
+            values = previous[0]
+            assert all([ params[p].value == values[n] for p, n in fun._pnames.items() ])
+        reused.append((fun._fid, reuse))
+        return fun, params, reuse
+    monkeypatch.setattr(mf, "_warm_candidate", record)
+    warm = mf.fit(x, data)
+
+    # The Gaussian loses the first stage to the derivative feature and is
+    # taken over unchanged in the second one
+    assert [ f._fid for f in warm._functions ] == [ "DIFFGAUSSIAN", "GAUSSIAN" ]
+    assert ("GAUSSIAN", True) in reused
+    assert np.isclose(warm._chis[-1], cold._chis[-1], rtol = 1e-6)
+    assert warm._nfev < cold._nfev
+
+def test_warm_start_restarts_taken_features():
+    x, data = _spectrum()
+    mf = Mixfit(allowed = [ "GAUSSIAN", "CAUCHY" ], maxIterations = 2, warmStart = True)
+    reused = []
+    warmCandidate = mf._warm_candidate
+    def record(*args):
+        res = warmCandidate(*args)
+        reused.append(res[2])
+        return res
+    mf._warm_candidate = record
+    res = mf.fit(x, data)
+
+    # Both candidates of the first stage chase the same line, the loser
+    # is started from its guess again
+    assert reused == [ False, False ]
+    assert np.isclose(res._chis[-1], Mixfit(allowed = [ "GAUSSIAN", "CAUCHY" ], maxIterations = 2).fit(x, data)._chis[-1])